@@ -0,0 +1,400 @@
+'''
+A benchmark of the throughput of the data generator for 2D object detection.
+
+Synthesizes a dataset in the Pascal VOC format with random JPEG images and boxes and measures how
+many batches per second the data generator produces for each combination of a dataset source
+(image files on disk, images in memory, HDF5 dataset, memory-mapped dataset), a data augmentation
+chain, and with or without label encoding. The results can be saved as JSON and compared against
+the results of an earlier run to catch performance regressions.
+
+Usage:
+
+    python benchmarks/benchmark_data_pipeline.py --output results.json
+    python benchmarks/benchmark_data_pipeline.py --compare results.json
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_generator.object_detection_2d_data_generator import DataGenerator
+from data_generator.object_detection_2d_geometric_ops import Resize
+from data_generator.object_detection_2d_photometric_ops import ConvertTo3Channels
+from data_generator.data_augmentation_chain_original_ssd import SSDDataAugmentation
+from data_generator.data_augmentation_chain_constant_input_size import DataAugmentationConstantInputSize
+from data_generator.data_augmentation_chain_satellite import DataAugmentationSatellite
+from data_generator.object_detection_2d_pipeline_stats import PipelineStats
+from ssd_encoder_decoder.ssd_input_encoder import SSDInputEncoder
+
+CLASSES = ['background',
+           'aeroplane', 'bicycle', 'bird', 'boat',
+           'bottle', 'bus', 'car', 'cat',
+           'chair', 'cow', 'diningtable', 'dog',
+           'horse', 'motorbike', 'person', 'pottedplant',
+           'sheep', 'sofa', 'train', 'tvmonitor']
+
+SOURCES = ('disk', 'memory', 'hdf5', 'memmap')
+CHAINS = ('ssd', 'constant_input_size', 'satellite')
+
+# The model input size, the same as for SSD300.
+IMG_HEIGHT = 300
+IMG_WIDTH = 300
+
+def make_synthetic_voc_dataset(dataset_dir, num_images, min_size=(250, 250), max_size=(500, 500), max_boxes=6, seed=0):
+    '''
+    Writes a dataset in the Pascal VOC format with random images and boxes, unless the same dataset
+    already exists in `dataset_dir`. Every image consists of a random background gradient with a few
+    randomly colored rectangles and ellipses, one for each box, plus a little noise, so that the JPEG
+    files have a realistic size and take a realistic time to decode.
+
+    Arguments:
+        dataset_dir (str): The directory to write the dataset to. Gets the subdirectories 'JPEGImages',
+            'Annotations', and 'ImageSets/Main'.
+        num_images (int): The number of images.
+        min_size (tuple, optional): The minimal `(height, width)` of the images.
+        max_size (tuple, optional): The maximal `(height, width)` of the images.
+        max_boxes (int, optional): The maximal number of boxes per image.
+        seed (int, optional): The seed of the random number generator.
+
+    Returns:
+        A dictionary with the settings that the dataset was generated with, which identifies the dataset.
+    '''
+    meta = {'num_images': num_images, 'min_size': list(min_size), 'max_size': list(max_size), 'max_boxes': max_boxes, 'seed': seed}
+    meta_path = os.path.join(dataset_dir, 'synthetic_dataset.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r') as f:
+            if json.load(f) == meta:
+                return meta
+
+    images_dir = os.path.join(dataset_dir, 'JPEGImages')
+    annotations_dir = os.path.join(dataset_dir, 'Annotations')
+    image_sets_dir = os.path.join(dataset_dir, 'ImageSets', 'Main')
+    for directory in [images_dir, annotations_dir, image_sets_dir]:
+        os.makedirs(directory, exist_ok=True)
+
+    random_state = np.random.RandomState(seed)
+    image_ids = []
+
+    for i in range(num_images):
+        image_id = '{:06d}'.format(i)
+        image_ids.append(image_id)
+        height = random_state.randint(min_size[0], max_size[0] + 1)
+        width = random_state.randint(min_size[1], max_size[1] + 1)
+
+        # A smooth background with some noise.
+        gradient = np.linspace(0, 1, width)[np.newaxis,:,np.newaxis] * np.linspace(0.5, 1, height)[:,np.newaxis,np.newaxis]
+        image = gradient * random_state.randint(0, 256, size=3) + (1 - gradient) * random_state.randint(0, 256, size=3)
+        image += random_state.normal(0, 8, size=(height, width, 1))
+        image = Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+        draw = ImageDraw.Draw(image)
+
+        objects = []
+        for _ in range(random_state.randint(1, max_boxes + 1)):
+            box_width = random_state.randint(width // 10, width // 2)
+            box_height = random_state.randint(height // 10, height // 2)
+            xmin = random_state.randint(0, width - box_width)
+            ymin = random_state.randint(0, height - box_height)
+            xmax = xmin + box_width
+            ymax = ymin + box_height
+            color = tuple(int(c) for c in random_state.randint(0, 256, size=3))
+            if random_state.rand() < 0.5:
+                draw.rectangle([xmin, ymin, xmax, ymax], fill=color)
+            else:
+                draw.ellipse([xmin, ymin, xmax, ymax], fill=color)
+            objects.append('<object><name>{}</name><pose>Unspecified</pose><truncated>0</truncated><difficult>{}</difficult>'
+                           '<bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax></bndbox></object>'.format(
+                           CLASSES[random_state.randint(1, len(CLASSES))], int(random_state.rand() < 0.1), xmin, ymin, xmax, ymax))
+
+        image.save(os.path.join(images_dir, image_id + '.jpg'), quality=90)
+        with open(os.path.join(annotations_dir, image_id + '.xml'), 'w') as f:
+            f.write('<annotation><folder>synthetic</folder><filename>{}.jpg</filename>'
+                    '<size><width>{}</width><height>{}</height><depth>3</depth></size>{}</annotation>'.format(image_id, width, height, ''.join(objects)))
+
+    with open(os.path.join(image_sets_dir, 'trainval.txt'), 'w') as f:
+        f.write('\n'.join(image_ids) + '\n')
+
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    return meta
+
+def build_data_generator(source, dataset_dir, dataset_meta, work_dir):
+    '''
+    Creates a data generator for the synthetic dataset that reads the images from the given source.
+    The HDF5 and memory-mapped datasets are created in `work_dir` the first time they are needed.
+    Their names depend on the settings of the synthetic dataset, so that a regenerated synthetic dataset
+    doesn't get benchmarked through HDF5 and memory-mapped datasets of the dataset it replaced.
+
+    Arguments:
+        source (str): One of 'disk', 'memory', 'hdf5', or 'memmap'.
+        dataset_dir (str): The directory of the synthetic dataset.
+        dataset_meta (dict): The settings of the synthetic dataset as returned by `make_synthetic_voc_dataset()`.
+        work_dir (str): The directory for the HDF5 and memory-mapped datasets.
+
+    Returns:
+        The `DataGenerator`.
+    '''
+    def parse(data_generator):
+        data_generator.parse_xml(images_dirs=[os.path.join(dataset_dir, 'JPEGImages')],
+                                 image_set_filenames=[os.path.join(dataset_dir, 'ImageSets', 'Main', 'trainval.txt')],
+                                 annotations_dirs=[os.path.join(dataset_dir, 'Annotations')],
+                                 classes=CLASSES,
+                                 include_classes='all',
+                                 exclude_truncated=False,
+                                 exclude_difficult=False,
+                                 ret=False,
+                                 verbose=False)
+        return data_generator
+
+    dataset_name = 'dataset_{}'.format(hashlib.sha1(json.dumps(dataset_meta, sort_keys=True).encode('utf-8')).hexdigest()[:12])
+
+    if source == 'disk':
+        return parse(DataGenerator(load_images_into_memory=False, verbose=False))
+    elif source == 'memory':
+        return parse(DataGenerator(load_images_into_memory=True, verbose=False))
+    elif source == 'hdf5':
+        hdf5_path = os.path.join(work_dir, dataset_name + '.h5')
+        if not os.path.isfile(hdf5_path):
+            parse(DataGenerator(verbose=False)).create_hdf5_dataset(file_path=hdf5_path, verbose=False)
+        return DataGenerator(load_images_into_memory=False, hdf5_dataset_path=hdf5_path, verbose=False)
+    elif source == 'memmap':
+        memmap_dir = os.path.join(work_dir, dataset_name + '_memmap')
+        if not os.path.isfile(os.path.join(memmap_dir, 'dataset.json')):
+            parse(DataGenerator(verbose=False)).create_memmap_dataset(dataset_dir=memmap_dir, verbose=False)
+        return DataGenerator(load_images_into_memory=False, memmap_dataset_dir=memmap_dir, verbose=False)
+    else:
+        raise ValueError("Unknown source '{}'. Must be one of {}.".format(source, SOURCES))
+
+def build_transformations(chain):
+    '''
+    Returns the list of transformations for the given data augmentation chain. All chains produce
+    images of size `(IMG_HEIGHT, IMG_WIDTH)`.
+
+    Arguments:
+        chain (str): One of 'ssd', 'constant_input_size', or 'satellite'.
+
+    Returns:
+        The list of transformations.
+    '''
+    if chain == 'ssd':
+        return [SSDDataAugmentation(img_height=IMG_HEIGHT, img_width=IMG_WIDTH)]
+    elif chain == 'constant_input_size':
+        # This chain keeps the size of its input images, which vary in size here.
+        return [ConvertTo3Channels(), DataAugmentationConstantInputSize(), Resize(height=IMG_HEIGHT, width=IMG_WIDTH)]
+    elif chain == 'satellite':
+        return [ConvertTo3Channels(), DataAugmentationSatellite(resize_height=IMG_HEIGHT, resize_width=IMG_WIDTH)]
+    else:
+        raise ValueError("Unknown chain '{}'. Must be one of {}.".format(chain, CHAINS))
+
+def build_label_encoder():
+    '''
+    Returns an `SSDInputEncoder` with the configuration of SSD300 for Pascal VOC.
+    '''
+    return SSDInputEncoder(img_height=IMG_HEIGHT,
+                           img_width=IMG_WIDTH,
+                           n_classes=len(CLASSES) - 1,
+                           predictor_sizes=[(38, 38), (19, 19), (10, 10), (5, 5), (3, 3), (1, 1)],
+                           scales=[0.1, 0.2, 0.37, 0.54, 0.71, 0.88, 1.05],
+                           aspect_ratios_per_layer=[[1.0, 2.0, 0.5],
+                                                    [1.0, 2.0, 0.5, 3.0, 1.0/3.0],
+                                                    [1.0, 2.0, 0.5, 3.0, 1.0/3.0],
+                                                    [1.0, 2.0, 0.5, 3.0, 1.0/3.0],
+                                                    [1.0, 2.0, 0.5],
+                                                    [1.0, 2.0, 0.5]],
+                           two_boxes_for_ar1=True,
+                           steps=[8, 16, 32, 64, 100, 300],
+                           offsets=[0.5, 0.5, 0.5, 0.5, 0.5, 0.5],
+                           clip_boxes=False,
+                           variances=[0.1, 0.1, 0.2, 0.2],
+                           matching_type='multi',
+                           pos_iou_threshold=0.5,
+                           neg_iou_limit=0.5,
+                           normalize_coords=True)
+
+def run_benchmark(data_generator, transformations, label_encoder, batch_size, num_batches, warmup_batches, num_workers, seed):
+    '''
+    Measures the throughput of the data generator for one configuration.
+
+    Arguments:
+        data_generator (DataGenerator): The data generator.
+        transformations (list): The transformations.
+        label_encoder (callable): The label encoder or `None`.
+        batch_size (int): The batch size.
+        num_batches (int): The number of batches to time.
+        warmup_batches (int): The number of batches to produce before the timing starts.
+        num_workers (int): The number of worker processes as for `DataGenerator.generate()`.
+        seed (int): The seed for Numpy's random number generator.
+
+    Returns:
+        A dictionary with the number of batches and images per second and the pipeline stats.
+    '''
+    np.random.seed(seed)
+    returns = {'processed_images', 'encoded_labels'} if not (label_encoder is None) else {'processed_images', 'processed_labels'}
+    stats = PipelineStats()
+    generator = data_generator.generate(batch_size=batch_size,
+                                        shuffle=True,
+                                        transformations=transformations,
+                                        label_encoder=label_encoder,
+                                        returns=returns,
+                                        keep_images_without_gt=False,
+                                        num_workers=num_workers,
+                                        stats=stats)
+    for _ in range(warmup_batches):
+        next(generator)
+    stats.reset()
+    stats.start()
+    num_images = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        num_images += len(next(generator)[0])
+    elapsed_time = time.perf_counter() - start
+    generator.close()
+    return {'batches_per_second': num_batches / elapsed_time,
+            'images_per_second': num_images / elapsed_time,
+            'pipeline_stats': stats.to_dict()}
+
+def get_environment():
+    '''
+    Returns a description of the environment that the benchmark runs in, so that results from
+    different machines or versions don't get compared by accident.
+    '''
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def compare_results(results, baseline, tolerance):
+    '''
+    Prints the results next to the results of a baseline run and returns whether any configuration
+    became slower by more than the tolerance.
+
+    Arguments:
+        results (list): The results of this run.
+        baseline (list): The results of the baseline run.
+        tolerance (float): The relative slowdown that is still acceptable, e.g. 0.1 for 10%.
+
+    Returns:
+        `True` if there is a regression, `False` otherwise.
+    '''
+    def key(result):
+        return (result['source'], result['chain'], result['encode'])
+    baseline = {key(result): result for result in baseline}
+    regression = False
+    print('{:<8} {:<20} {:<7} {:>12} {:>12} {:>9}'.format('source', 'chain', 'encode', 'baseline', 'current', 'change'))
+    for result in results:
+        if not key(result) in baseline:
+            continue
+        old = baseline[key(result)]['batches_per_second']
+        new = result['batches_per_second']
+        change = new / old - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regression = True
+        print('{:<8} {:<20} {:<7} {:>12.2f} {:>12.2f} {:>+8.1%}{}'.format(result['source'], result['chain'], str(result['encode']), old, new, change, flag))
+    return regression
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the throughput of the data generator on a synthetic dataset.')
+    parser.add_argument('--dataset-dir', default=os.path.join('benchmarks', 'synthetic_voc'),
+                        help='The directory of the synthetic dataset. It is created if it does not exist yet.')
+    parser.add_argument('--work-dir', default=None,
+                        help='The directory for the HDF5 and memory-mapped datasets. Defaults to the dataset directory.')
+    parser.add_argument('--num-images', type=int, default=500, help='The number of images of the synthetic dataset.')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-batches', type=int, default=20, help='The number of batches to time per configuration.')
+    parser.add_argument('--warmup-batches', type=int, default=2)
+    parser.add_argument('--num-workers', type=int, default=0, help='The number of worker processes of the data generator.')
+    parser.add_argument('--sources', nargs='+', choices=SOURCES, default=list(SOURCES))
+    parser.add_argument('--chains', nargs='+', choices=CHAINS, default=list(CHAINS))
+    parser.add_argument('--encode', choices=('both', 'yes', 'no'), default='both', help='Whether to benchmark with label encoding, without, or both.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='The JSON file to save the results to.')
+    parser.add_argument('--compare', default=None, help='A JSON file with the results of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='The relative slowdown compared to the baseline that counts as a regression.')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if not (args.work_dir is None) else args.dataset_dir
+    os.makedirs(work_dir, exist_ok=True)
+    dataset_meta = make_synthetic_voc_dataset(args.dataset_dir, args.num_images)
+
+    encode_options = {'both': [False, True], 'yes': [True], 'no': [False]}[args.encode]
+    label_encoder = build_label_encoder() if True in encode_options else None
+
+    results = []
+    for source in args.sources:
+        data_generator = build_data_generator(source, args.dataset_dir, dataset_meta, work_dir)
+        for chain in args.chains:
+            for encode in encode_options:
+                result = run_benchmark(data_generator=data_generator,
+                                       transformations=build_transformations(chain),
+                                       label_encoder=label_encoder if encode else None,
+                                       batch_size=args.batch_size,
+                                       num_batches=args.num_batches,
+                                       warmup_batches=args.warmup_batches,
+                                       num_workers=args.num_workers,
+                                       seed=args.seed)
+                result.update({'source': source, 'chain': chain, 'encode': encode})
+                results.append(result)
+                stages = result['pipeline_stats']['stages']
+                hottest_stage = max((stage for stage in stages if stage != 'batch'), key=lambda stage: stages[stage]['total_time'], default=None)
+                print('{:<8} {:<20} encode={:<5} {:8.2f} batches/s {:9.1f} images/s   hottest stage: {}'.format(
+                      source, chain, str(encode), result['batches_per_second'], result['images_per_second'], hottest_stage))
+
+    report = {'environment': get_environment(),
+              'settings': {'num_images': args.num_images,
+                           'batch_size': args.batch_size,
+                           'num_batches': args.num_batches,
+                           'warmup_batches': args.warmup_batches,
+                           'num_workers': args.num_workers,
+                           'seed': args.seed},
+              'results': results}
+
+    if not (args.output is None):
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not (args.compare is None):
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline['settings'] != report['settings']:
+            print('Warning: The baseline was run with different settings: {}'.format(baseline['settings']))
+        if compare_results(results, baseline['results'], args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
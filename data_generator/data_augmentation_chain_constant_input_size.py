@@ -58,7 +58,7 @@ class DataAugmentationConstantInputSize:
         self.bounds_validator = bounds_validator
         self.n_boxes_min = n_boxes_min
         self.background = background
-        self.labels_format = labels_format
+        self._labels_format = labels_format
 
         # Determines which boxes are kept in an image after the transformations have been applied.
         self.box_filter = BoxFilter(check_overlap=True,
@@ -152,12 +152,22 @@ class DataAugmentationConstantInputSize:
                           self.random_translate,
                           self.random_flip]
 
-    def __call__(self, image, labels=None):
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # Pass the labels format on to all transformations that process labels once, rather than on every call.
+        self._labels_format = labels_format
+        self.box_filter.labels_format = labels_format
+        self.image_validator.labels_format = labels_format
+        self.random_flip.labels_format = labels_format
+        self.random_translate.labels_format = labels_format
+        self.random_zoom_in.labels_format = labels_format
+        self.random_zoom_out.labels_format = labels_format
 
-        self.random_translate.labels_format = self.labels_format
-        self.random_zoom_in.labels_format = self.labels_format
-        self.random_zoom_out.labels_format = self.labels_format
-        self.random_flip.labels_format = self.labels_format
+    def __call__(self, image, labels=None):
 
         # Choose sequence 1 with probability 0.5.
         if np.random.choice(2):
@@ -19,12 +19,12 @@ limitations under the License.
 from __future__ import division
 import numpy as np
 import cv2
-import inspect
 
-from data_generator.object_detection_2d_photometric_ops import ConvertColor, ConvertDataType, ConvertTo3Channels, RandomBrightness, RandomContrast, RandomHue, RandomSaturation, RandomChannelSwap
+from data_generator.object_detection_2d_photometric_ops import ConvertTo3Channels, RandomPhotometricDistortions, RandomChannelSwap
 from data_generator.object_detection_2d_patch_sampling_ops import PatchCoordinateGenerator, RandomPatch, RandomPatchInf
 from data_generator.object_detection_2d_geometric_ops import ResizeRandomInterp, RandomFlip
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoundGenerator, BoxFilter, ImageValidator
+from data_generator.object_detection_2d_misc_utils import supports_inverter
 
 class SSDRandomCrop:
     '''
@@ -42,7 +42,7 @@ class SSDRandomCrop:
                 'xmin', 'ymin', 'xmax', and 'ymax' to their respective indices within last axis of the labels array.
         '''
 
-        self.labels_format = labels_format
+        self._labels_format = labels_format
 
         # This randomly samples one of the lower IoU bounds defined
         # by the `sample_space` every time it is called.
@@ -96,8 +96,19 @@ class SSDRandomCrop:
                                           prob=0.857,
                                           labels_format=self.labels_format)
 
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # Pass the labels format on to all transformations that process labels once, rather than on every call.
+        self._labels_format = labels_format
+        self.box_filter.labels_format = labels_format
+        self.image_validator.labels_format = labels_format
+        self.random_crop.labels_format = labels_format
+
     def __call__(self, image, labels=None, return_inverter=False):
-        self.random_crop.labels_format = self.labels_format
         return self.random_crop(image, labels, return_inverter)
 
 class SSDExpand:
@@ -118,7 +129,7 @@ class SSDExpand:
                 'xmin', 'ymin', 'xmax', and 'ymax' to their respective indices within last axis of the labels array.
         '''
 
-        self.labels_format = labels_format
+        self._labels_format = labels_format
 
         # Generate coordinates for patches that are between 1.0 and 4.0 times
         # the size of the input image in both spatial dimensions.
@@ -139,8 +150,17 @@ class SSDExpand:
                                   background=background,
                                   labels_format=self.labels_format)
 
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # Pass the labels format on to all transformations that process labels once, rather than on every call.
+        self._labels_format = labels_format
+        self.expand.labels_format = labels_format
+
     def __call__(self, image, labels=None, return_inverter=False):
-        self.expand.labels_format = self.labels_format
         return self.expand(image, labels, return_inverter)
 
 class SSDPhotometricDistortions:
@@ -151,59 +171,26 @@ class SSDPhotometricDistortions:
 
     def __init__(self):
 
-        self.convert_RGB_to_HSV = ConvertColor(current='RGB', to='HSV')
-        self.convert_HSV_to_RGB = ConvertColor(current='HSV', to='RGB')
-        self.convert_to_float32 = ConvertDataType(to='float32')
-        self.convert_to_uint8 = ConvertDataType(to='uint8')
         self.convert_to_3_channels = ConvertTo3Channels()
-        self.random_brightness = RandomBrightness(lower=-32, upper=32, prob=0.5)
-        self.random_contrast = RandomContrast(lower=0.5, upper=1.5, prob=0.5)
-        self.random_saturation = RandomSaturation(lower=0.5, upper=1.5, prob=0.5)
-        self.random_hue = RandomHue(max_delta=18, prob=0.5)
+        # Applies the brightness, contrast, saturation and hue changes of both of the original
+        # sequences, with the contrast change before or after the saturation and hue changes
+        # with probability 0.5 each.
+        self.random_distortions = RandomPhotometricDistortions(random_brightness=(-32, 32, 0.5),
+                                                               random_contrast=(0.5, 1.5, 0.5),
+                                                               random_saturation=(0.5, 1.5, 0.5),
+                                                               random_hue=(18, 0.5),
+                                                               contrast_first=0.5)
         self.random_channel_swap = RandomChannelSwap(prob=0.0)
 
-        self.sequence1 = [self.convert_to_3_channels,
-                          self.convert_to_float32,
-                          self.random_brightness,
-                          self.random_contrast,
-                          self.convert_to_uint8,
-                          self.convert_RGB_to_HSV,
-                          self.convert_to_float32,
-                          self.random_saturation,
-                          self.random_hue,
-                          self.convert_to_uint8,
-                          self.convert_HSV_to_RGB,
-                          self.random_channel_swap]
-
-        self.sequence2 = [self.convert_to_3_channels,
-                          self.convert_to_float32,
-                          self.random_brightness,
-                          self.convert_to_uint8,
-                          self.convert_RGB_to_HSV,
-                          self.convert_to_float32,
-                          self.random_saturation,
-                          self.random_hue,
-                          self.convert_to_uint8,
-                          self.convert_HSV_to_RGB,
-                          self.convert_to_float32,
-                          self.random_contrast,
-                          self.convert_to_uint8,
-                          self.random_channel_swap]
+        self.sequence = [self.convert_to_3_channels,
+                         self.random_distortions,
+                         self.random_channel_swap]
 
     def __call__(self, image, labels):
 
-        # Choose sequence 1 with probability 0.5.
-        if np.random.choice(2):
-
-            for transform in self.sequence1:
-                image, labels = transform(image, labels)
-            return image, labels
-        # Choose sequence 2 with probability 0.5.
-        else:
-
-            for transform in self.sequence2:
-                image, labels = transform(image, labels)
-            return image, labels
+        for transform in self.sequence:
+            image, labels = transform(image, labels)
+        return image, labels
 
 class SSDDataAugmentation:
     '''
@@ -227,7 +214,7 @@ class SSDDataAugmentation:
                 'xmin', 'ymin', 'xmax', and 'ymax' to their respective indices within last axis of the labels array.
         '''
 
-        self.labels_format = labels_format
+        self._labels_format = labels_format
 
         self.photometric_distortions = SSDPhotometricDistortions()
         self.expand = SSDExpand(background=background, labels_format=self.labels_format)
@@ -259,16 +246,29 @@ class SSDDataAugmentation:
                          self.random_flip,
                          self.resize]
 
+        # Which of the transformations above can return an inverter.
+        self.returns_inverter = [supports_inverter(transform) for transform in self.sequence]
+
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # Pass the labels format on to all transformations that process labels once, rather than on every call.
+        self._labels_format = labels_format
+        self.box_filter.labels_format = labels_format
+        self.expand.labels_format = labels_format
+        self.random_crop.labels_format = labels_format
+        self.random_flip.labels_format = labels_format
+        self.resize.labels_format = labels_format
+
     def __call__(self, image, labels, return_inverter=False):
-        self.expand.labels_format = self.labels_format
-        self.random_crop.labels_format = self.labels_format
-        self.random_flip.labels_format = self.labels_format
-        self.resize.labels_format = self.labels_format
 
         inverters = []
 
-        for transform in self.sequence:
-            if return_inverter and ('return_inverter' in inspect.signature(transform).parameters):
+        for transform, returns_inverter in zip(self.sequence, self.returns_inverter):
+            if return_inverter and returns_inverter:
                 image, labels, inverter = transform(image, labels, return_inverter=True)
                 inverters.append(inverter)
             else:
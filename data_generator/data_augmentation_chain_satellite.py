@@ -20,7 +20,7 @@ limitations under the License.
 from __future__ import division
 import numpy as np
 
-from data_generator.object_detection_2d_photometric_ops import ConvertColor, ConvertDataType, ConvertTo3Channels, RandomBrightness, RandomContrast, RandomHue, RandomSaturation
+from data_generator.object_detection_2d_photometric_ops import ConvertTo3Channels, RandomPhotometricDistortions
 from data_generator.object_detection_2d_geometric_ops import Resize, RandomFlip, RandomRotate
 from data_generator.object_detection_2d_patch_sampling_ops import PatchCoordinateGenerator, RandomPatch
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter, ImageValidator
@@ -63,7 +63,7 @@ class DataAugmentationSatellite:
         self.bounds_validator = bounds_validator
         self.n_boxes_min = n_boxes_min
         self.background = background
-        self.labels_format = labels_format
+        self._labels_format = labels_format
 
         # Determines which boxes are kept in an image after the transformations have been applied.
         self.box_filter_patch = BoxFilter(check_overlap=True,
@@ -87,20 +87,17 @@ class DataAugmentationSatellite:
 
         # Utility transformations
         self.convert_to_3_channels  = ConvertTo3Channels() # Make sure all images end up having 3 channels.
-        self.convert_RGB_to_HSV     = ConvertColor(current='RGB', to='HSV')
-        self.convert_HSV_to_RGB     = ConvertColor(current='HSV', to='RGB')
-        self.convert_to_float32     = ConvertDataType(to='float32')
-        self.convert_to_uint8       = ConvertDataType(to='uint8')
         self.resize                 = Resize(height=resize_height,
                                              width=resize_width,
                                              box_filter=self.box_filter_resize,
                                              labels_format=self.labels_format)
 
         # Photometric transformations
-        self.random_brightness      = RandomBrightness(lower=random_brightness[0], upper=random_brightness[1], prob=random_brightness[2])
-        self.random_contrast        = RandomContrast(lower=random_contrast[0], upper=random_contrast[1], prob=random_contrast[2])
-        self.random_saturation      = RandomSaturation(lower=random_saturation[0], upper=random_saturation[1], prob=random_saturation[2])
-        self.random_hue             = RandomHue(max_delta=random_hue[0], prob=random_hue[1])
+        self.random_distortions     = RandomPhotometricDistortions(random_brightness=random_brightness,
+                                                                   random_contrast=random_contrast,
+                                                                   random_saturation=random_saturation,
+                                                                   random_hue=random_hue,
+                                                                   contrast_first=1.0)
 
         # Geometric transformations
         self.random_horizontal_flip = RandomFlip(dim='horizontal', prob=random_flip, labels_format=self.labels_format)
@@ -123,35 +120,37 @@ class DataAugmentationSatellite:
 
         # Define the processing chain.
         self.transformations = [self.convert_to_3_channels,
-                                self.convert_to_float32,
-                                self.random_brightness,
-                                self.random_contrast,
-                                self.convert_to_uint8,
-                                self.convert_RGB_to_HSV,
-                                self.convert_to_float32,
-                                self.random_saturation,
-                                self.random_hue,
-                                self.convert_to_uint8,
-                                self.convert_HSV_to_RGB,
+                                self.random_distortions,
                                 self.random_horizontal_flip,
                                 self.random_vertical_flip,
                                 self.random_rotate,
                                 self.random_patch,
                                 self.resize]
 
-    def __call__(self, image, labels=None):
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # Pass the labels format on to all transformations that process labels once, rather than on every call.
+        self._labels_format = labels_format
+        self.box_filter_patch.labels_format = labels_format
+        self.box_filter_resize.labels_format = labels_format
+        self.image_validator.labels_format = labels_format
+        self.resize.labels_format = labels_format
+        self.random_horizontal_flip.labels_format = labels_format
+        self.random_vertical_flip.labels_format = labels_format
+        self.random_rotate.labels_format = labels_format
+        self.random_patch.labels_format = labels_format
 
-        self.random_patch.labels_format = self.labels_format
-        self.random_horizontal_flip.labels_format = self.labels_format
-        self.random_vertical_flip.labels_format = self.labels_format
-        self.random_rotate.labels_format = self.labels_format
-        self.resize.labels_format = self.labels_format
+    def __call__(self, image, labels=None):
 
         if not (labels is None):
             for transform in self.transformations:
                 image, labels = transform(image, labels)
             return image, labels
         else:
-            for transform in self.sequence1:
+            for transform in self.transformations:
                 image = transform(image)
             return image
@@ -64,7 +64,7 @@ class DataAugmentationVariableInputSize:
         self.bounds_validator = bounds_validator
         self.n_boxes_min = n_boxes_min
         self.background = background
-        self.labels_format = labels_format
+        self._labels_format = labels_format
 
         # Determines which boxes are kept in an image after the transformations have been applied.
         self.box_filter_patch = BoxFilter(check_overlap=True,
@@ -136,17 +136,28 @@ class DataAugmentationVariableInputSize:
                                 self.random_flip,
                                 self.resize]
 
-    def __call__(self, image, labels=None):
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # Pass the labels format on to all transformations that process labels once, rather than on every call.
+        self._labels_format = labels_format
+        self.box_filter_patch.labels_format = labels_format
+        self.box_filter_resize.labels_format = labels_format
+        self.image_validator.labels_format = labels_format
+        self.resize.labels_format = labels_format
+        self.random_flip.labels_format = labels_format
+        self.random_patch.labels_format = labels_format
 
-        self.random_patch.labels_format = self.labels_format
-        self.random_flip.labels_format = self.labels_format
-        self.resize.labels_format = self.labels_format
+    def __call__(self, image, labels=None):
 
         if not (labels is None):
             for transform in self.transformations:
                 image, labels = transform(image, labels)
             return image, labels
         else:
-            for transform in self.sequence1:
+            for transform in self.transformations:
                 image = transform(image)
             return image
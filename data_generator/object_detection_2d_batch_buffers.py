@@ -0,0 +1,93 @@
+'''
+Preallocated arrays to assemble batches in.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+
+class BatchBufferPool:
+    '''
+    A fixed number of preallocated batch arrays that are used in turn to assemble consecutive batches,
+    instead of allocating new arrays for every batch. The pool keeps separate buffers for each output,
+    e.g. one set for the processed images and one for the encoded labels.
+
+    A batch that was assembled in a buffer stays valid until the buffer is used again, i.e. until
+    `num_buffers` more batches of the same output have been assembled. With two buffers, the batch that
+    was yielded last stays intact while the next batch is being assembled.
+
+    The buffers of an output are allocated for the shape and data type of its first batch and reallocated
+    only if a batch with a different item shape or data type or with more items comes along.
+    '''
+
+    def __init__(self, num_buffers=2):
+        '''
+        Arguments:
+            num_buffers (int, optional): The number of buffers per output.
+        '''
+        if num_buffers < 1:
+            raise ValueError("A batch buffer pool needs at least one buffer, but `num_buffers` is {}.".format(num_buffers))
+        self.num_buffers = num_buffers
+        self.buffers = {}
+        self.next_buffer = {}
+
+    def empty(self, name, shape, dtype):
+        '''
+        Returns the next buffer of an output without initializing its contents, like `np.empty()`.
+
+        Arguments:
+            name (str): The name of the output, e.g. 'processed_images'.
+            shape (tuple): The shape of the batch, where the first axis is the number of batch items.
+            dtype (dtype): The data type of the batch.
+
+        Returns:
+            A view into one of the output's buffers with the given shape and data type.
+        '''
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        buffers = self.buffers.get(name)
+        if (buffers is None) or (buffers[0].shape[1:] != shape[1:]) or (buffers[0].dtype != dtype) or (len(buffers[0]) < shape[0]):
+            batch_size = shape[0] if (buffers is None) else max(shape[0], len(buffers[0]))
+            buffers = [np.empty((batch_size,) + shape[1:], dtype=dtype) for _ in range(self.num_buffers)]
+            self.buffers[name] = buffers
+            self.next_buffer[name] = 0
+        batch = buffers[self.next_buffer[name]][:shape[0]]
+        self.next_buffer[name] = (self.next_buffer[name] + 1) % self.num_buffers
+        return batch
+
+    def stack(self, images, name='processed_images'):
+        '''
+        Stacks images along a new first axis into the next buffer. Each image is copied into the buffer
+        exactly once. Batches whose images don't all have the same shape and data type are stacked into
+        a new array as usual.
+
+        Arguments:
+            images (list): The images of a batch as Numpy arrays.
+            name (str, optional): The name of the output.
+
+        Returns:
+            The batch as a Numpy array, which is a view into one of the buffers if possible.
+        '''
+        if len(images) == 0:
+            return np.array(images)
+        item_shape = images[0].shape
+        dtype = images[0].dtype
+        if any((image.shape != item_shape) or (image.dtype != dtype) for image in images):
+            return np.array(images)
+        batch = self.empty(name, (len(images),) + item_shape, dtype)
+        for i, image in enumerate(images):
+            batch[i] = image
+        return batch
@@ -0,0 +1,99 @@
+'''
+Keras callbacks for the data generator for 2D object detection.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+from keras.callbacks import Callback
+
+class GeneratorStateCheckpoint(Callback):
+    '''
+    Saves the state of a `DataGenerator`'s training generator along with the model checkpoints, so that
+    an interrupted training can resume with the batch right after the last one that the model was
+    trained on. Use it with the same `filepath` pattern and `period` as the `ModelCheckpoint` callback,
+    but with a different file extension.
+
+    The callback counts the batches that the model was trained on and saves the generator state after
+    the last of them, so it doesn't matter how many batches Keras has requested from the generator in
+    advance. However, the generator must run in the training process itself, i.e. `use_multiprocessing`
+    must be `False` in `fit_generator()`.
+
+    To resume the training, load the saved state with `DataGenerator.load_generator_state()`, pass it
+    to `generate()` as `initial_state`, and pass the epoch to `fit_generator()` as `initial_epoch`.
+    '''
+
+    def __init__(self, data_generator, filepath, period=1):
+        '''
+        Arguments:
+            data_generator (DataGenerator): The data generator that produces the training batches.
+            filepath (str): The path to save the generator state to. Can contain named formatting
+                options like the `filepath` of `ModelCheckpoint`, e.g. 'state_epoch-{epoch:02d}.pkl'.
+            period (int, optional): The number of epochs between checkpoints.
+        '''
+        super(GeneratorStateCheckpoint, self).__init__()
+        self.data_generator = data_generator
+        self.filepath = filepath
+        self.period = period
+        self.num_batches = 0 # The number of batches trained on since the generator was started.
+        self.epochs_since_last_save = 0
+
+    def on_batch_end(self, batch, logs=None):
+        self.num_batches += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        self.epochs_since_last_save += 1
+        if self.epochs_since_last_save >= self.period:
+            self.epochs_since_last_save = 0
+            filepath = self.filepath.format(epoch=epoch + 1, **logs)
+            self.data_generator.save_generator_state(filepath, num_batches=self.num_batches)
+
+class PipelineStatsLogger(Callback):
+    '''
+    Reports the `PipelineStats` of the data generator at the end of every epoch, so that the stage of the
+    batch production that takes the most time can be found in the middle of a training.
+
+    The number of images per second and the time per batch of each stage are added to the logs, where
+    other callbacks like `CSVLogger` or `TensorBoard` pick them up, under the names 'pipeline_images_per_second'
+    and 'pipeline_<stage>_time'. Optionally, the complete stats are also written to a JSON file.
+    '''
+
+    def __init__(self, stats, filepath=None, reset=True):
+        '''
+        Arguments:
+            stats (PipelineStats): The stats object that was passed to `DataGenerator.generate()`.
+            filepath (str, optional): The path of the JSON file to write the stats to at the end of every epoch.
+                Can contain named formatting options like the `filepath` of `ModelCheckpoint`, e.g.
+                'pipeline_stats_epoch-{epoch:02d}.json'. If `None`, no JSON file is written.
+            reset (bool, optional): If `True`, the stats are reset at the end of every epoch, so that each epoch
+                is reported separately. Otherwise the stats accumulate over the entire training.
+        '''
+        super(PipelineStatsLogger, self).__init__()
+        self.stats = stats
+        self.filepath = filepath
+        self.reset = reset
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs if not (logs is None) else {}
+        stats = self.stats.to_dict()
+        logs['pipeline_images_per_second'] = stats['images_per_second']
+        for stage, stage_stats in stats['stages'].items():
+            logs['pipeline_{}_time'.format(stage)] = stage_stats['time_per_batch']
+        if not (self.filepath is None):
+            self.stats.dump_json(self.filepath.format(epoch=epoch + 1, **logs))
+        if self.reset:
+            self.stats.reset()
+            self.stats.start()
@@ -18,16 +18,19 @@ limitations under the License.
 
 from __future__ import division
 import numpy as np
-import inspect
 from collections import defaultdict
 import warnings
 import sklearn.utils
-from copy import deepcopy
 from PIL import Image
 import cv2
 import csv
+import io
 import os
+import hashlib
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from tqdm import tqdm, trange
 try:
     import h5py
@@ -40,7 +43,12 @@ except ImportError:
 try:
     from bs4 import BeautifulSoup
 except ImportError:
-    warnings.warn("'BeautifulSoup' module is missing. The XML-parser will be unavailable.")
+    warnings.warn("'BeautifulSoup' module is missing. The 'bs4' XML-parser will be unavailable.")
+try:
+    from lxml import etree
+except ImportError:
+    import xml.etree.ElementTree as etree # The standard library's C implementation, a bit slower than lxml.
+from functools import partial
 try:
     import pickle
 except ImportError:
@@ -48,6 +56,18 @@ except ImportError:
 
 from ssd_encoder_decoder.ssd_input_encoder import SSDInputEncoder
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter
+from data_generator.object_detection_2d_photometric_ops import ConvertTo3Channels, ConvertColor, ConvertDataType, Hue, RandomHue, Saturation, RandomSaturation, \
+                                                             Brightness, RandomBrightness, Contrast, RandomContrast, Gamma, RandomGamma, \
+                                                             HistogramEqualization, RandomHistogramEqualization, ChannelSwap, RandomChannelSwap, \
+                                                             RandomPhotometricDistortions
+from data_generator.object_detection_2d_geometric_ops import Resize, ResizeRandomInterp
+from data_generator.object_detection_2d_label_store import LabelStore
+from data_generator.object_detection_2d_image_cache import DecodedImageCache
+from data_generator.object_detection_2d_image_arena import ImageArena
+from data_generator.object_detection_2d_batch_buffers import BatchBufferPool
+from data_generator.object_detection_2d_misc_utils import supports_inverter
+from data_generator.object_detection_2d_hdf5_utils import resize_hdf5_datasets, check_hdf5_compatibility, update_variable_image_size
+from data_generator.object_detection_2d_parallel_utils import get_multiprocessing_context, parallel_batches, init_hdf5_worker, prepare_hdf5_image
 
 class DegenerateBatchError(Exception):
     '''
@@ -63,6 +83,129 @@ class DatasetError(Exception):
     '''
     pass
 
+# The transformations that act on each pixel independently of its position, so they can be
+# applied before or after resizing an image with nearly the same result.
+POINTWISE_TRANSFORMATIONS = (ConvertTo3Channels, ConvertColor, ConvertDataType, Hue, RandomHue, Saturation, RandomSaturation,
+                             Brightness, RandomBrightness, Contrast, RandomContrast, Gamma, RandomGamma,
+                             HistogramEqualization, RandomHistogramEqualization, ChannelSwap, RandomChannelSwap,
+                             RandomPhotometricDistortions)
+
+# Changes whenever the parser outputs change, so that outdated parse cache entries aren't used.
+PARSE_CACHE_VERSION = 1
+
+# The number of most recently yielded batches whose generator states are kept, so that the state
+# of a batch can still be retrieved after a consumer like Keras has prefetched further batches.
+GENERATOR_STATE_HISTORY_SIZE = 256
+
+def parse_xml_annotation(image_id,
+                         annotations_dir,
+                         classes,
+                         include_classes,
+                         exclude_truncated,
+                         exclude_difficult,
+                         labels_output_format,
+                         xml_parser='etree'):
+    '''
+    Parses the Pascal VOC XML annotation file of one image. This is a module-level function so that
+    `DataGenerator.parse_xml()` can run it in worker processes.
+
+    Arguments:
+        image_id (str): The ID of the image, which is also the name of its annotation file without extension.
+        annotations_dir (str): The directory that contains the annotation file.
+        xml_parser (str, optional): The XML parser to be used, either 'etree' or 'bs4'.
+        All other arguments are as described in the documentation of `DataGenerator.parse_xml()`.
+
+    Returns:
+        A 2-tuple containing a list of the boxes in the image, each of which is a list in the format
+        given by `labels_output_format`, and a list indicating for each box whether it is annotated
+        as "difficult".
+    '''
+
+    filename = '{}'.format(image_id) + '.jpg'
+    boxes = [] # We'll store all boxes for this image here.
+    eval_neutr = [] # We'll store whether a box is annotated as "difficult" here.
+
+    def add_object(folder, class_name, pose, truncated, difficult, xmin, ymin, xmax, ymax):
+        class_id = classes.index(class_name)
+        # Check whether this class is supposed to be included in the dataset.
+        if (not include_classes == 'all') and (not class_id in include_classes): return
+        truncated = int(truncated)
+        if exclude_truncated and (truncated == 1): return
+        difficult = int(difficult)
+        if exclude_difficult and (difficult == 1): return
+        item_dict = {'folder': folder,
+                     'image_name': filename,
+                     'image_id': image_id,
+                     'class_name': class_name,
+                     'class_id': class_id,
+                     'pose': pose,
+                     'truncated': truncated,
+                     'difficult': difficult,
+                     'xmin': int(xmin),
+                     'ymin': int(ymin),
+                     'xmax': int(xmax),
+                     'ymax': int(ymax)}
+        box = []
+        for item in labels_output_format:
+            box.append(item_dict[item])
+        boxes.append(box)
+        if difficult: eval_neutr.append(True)
+        else: eval_neutr.append(False)
+
+    annotation_path = os.path.join(annotations_dir, image_id + '.xml')
+
+    if xml_parser == 'bs4':
+
+        with open(annotation_path) as f:
+            soup = BeautifulSoup(f, 'xml')
+
+        folder = soup.folder.text # In case we want to return the folder in addition to the image file name. Relevant for determining which dataset an image belongs to.
+        #filename = soup.filename.text
+
+        objects = soup.find_all('object') # Get a list of all objects in this image.
+
+        # Parse the data for each object.
+        for obj in objects:
+            bndbox = obj.find('bndbox', recursive=False)
+            add_object(folder=folder,
+                       class_name=obj.find('name', recursive=False).text,
+                       pose=obj.find('pose', recursive=False).text,
+                       truncated=obj.find('truncated', recursive=False).text,
+                       difficult=obj.find('difficult', recursive=False).text,
+                       xmin=bndbox.xmin.text,
+                       ymin=bndbox.ymin.text,
+                       xmax=bndbox.xmax.text,
+                       ymax=bndbox.ymax.text)
+
+    elif xml_parser == 'etree':
+
+        def get_text(element):
+            # The equivalent of BeautifulSoup's `text`, i.e. all the text inside the element.
+            return ''.join(element.itertext())
+
+        folder = None
+        # Stream through the file instead of building the entire tree. The objects are complete
+        # once their end tag is reached.
+        for event, element in etree.iterparse(annotation_path, events=('end',)):
+            if (element.tag == 'folder') and (folder is None):
+                folder = get_text(element)
+            elif element.tag == 'object':
+                bndbox = element.find('bndbox')
+                add_object(folder=folder,
+                           class_name=get_text(element.find('name')),
+                           pose=get_text(element.find('pose')),
+                           truncated=get_text(element.find('truncated')),
+                           difficult=get_text(element.find('difficult')),
+                           xmin=get_text(next(bndbox.iter('xmin'))),
+                           ymin=get_text(next(bndbox.iter('ymin'))),
+                           xmax=get_text(next(bndbox.iter('xmax'))),
+                           ymax=get_text(next(bndbox.iter('ymax'))))
+
+    else:
+        raise ValueError("`xml_parser` can be either 'etree' or 'bs4', but received '{}'.".format(xml_parser))
+
+    return boxes, eval_neutr
+
 class DataGenerator:
     '''
     A generator to generate batches of samples and corresponding labels indefinitely.
@@ -88,6 +231,10 @@ class DataGenerator:
                  image_ids=None,
                  eval_neutral=None,
                  labels_output_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax'),
+                 memmap_dataset_dir=None,
+                 parse_cache_dir=None,
+                 image_cache_bytes=0,
+                 image_arena_path=None,
                  verbose=True):
         '''
         Initializes the data generator. You can either load a dataset directly here in the constructor,
@@ -96,7 +243,8 @@ class DataGenerator:
         Arguments:
             load_images_into_memory (bool, optional): If `True`, the entire dataset will be loaded into memory.
                 This enables noticeably faster data generation than loading batches of images into memory ad hoc.
-                Be sure that you have enough memory before you activate this option.
+                Be sure that you have enough memory before you activate this option. The images are stored in an
+                `ImageArena`, a single shared memory buffer, so that forked worker processes don't duplicate them.
             hdf5_dataset_path (str, optional): The full file path of an HDF5 file that contains a dataset in the
                 format that the `create_hdf5_dataset()` method produces. If you load such an HDF5 dataset, you
                 don't need to use any of the parser methods anymore, the HDF5 dataset already contains all relevant
@@ -119,9 +267,10 @@ class DataGenerator:
                 the images will be composed from `images_dir` and the names in the text file, i.e. this
                 should be the directory that contains the images to which the text file refers.
                 If `filenames_type` is not 'text', then this argument is irrelevant.
-            labels (string or list, optional): `None` or either a Python list/tuple or a string representing
-                the path to a pickled file containing a list/tuple. The list/tuple must contain Numpy arrays
-                that represent the labels of the dataset.
+            labels (string or list, optional): `None` or either a Python list/tuple, a `LabelStore`, or a string
+                representing the path to a pickled file containing a list/tuple or a `LabelStore`. The list/tuple
+                must contain Numpy arrays that represent the labels of the dataset. The labels are stored in a
+                `LabelStore` either way.
             image_ids (string or list, optional): `None` or either a Python list/tuple or a string representing
                 the path to a pickled file containing a list/tuple. The list/tuple must contain the image
                 IDs of the images in the dataset.
@@ -132,6 +281,28 @@ class DataGenerator:
             labels_output_format (list, optional): A list of five strings representing the desired order of the five
                 items class ID, xmin, ymin, xmax, ymax in the generated ground truth data (if any). The expected
                 strings are 'xmin', 'ymin', 'xmax', 'ymax', 'class_id'.
+            memmap_dataset_dir (str, optional): The directory of a memory-mapped dataset in the format that the
+                `create_memmap_dataset()` method produces. Just like an HDF5 dataset, such a dataset already contains
+                all relevant data, so you don't need to use any of the parser methods anymore.
+            parse_cache_dir (str, optional): `None` or a directory in which the parser methods cache their outputs.
+                The cache entries are keyed on the paths, sizes, and modification times of the annotation files
+                that a parser reads and on the parser arguments, so as long as none of these change, parsing the
+                same dataset again just loads the cached outputs, which takes a fraction of the time that parsing
+                takes. The directory will be created if it doesn't exist.
+            image_cache_bytes (int, optional): The memory budget in bytes of a cache for decoded images. If greater
+                than zero, the images that are read from image files or from an HDF5 dataset are kept in a
+                least-recently-used cache of this size, so that they don't need to be read and decoded again the
+                next time they are needed, e.g. in the next epoch or by an evaluator that uses this data generator.
+                This is useful if the dataset doesn't fit into memory entirely, otherwise use `load_images_into_memory`.
+                Note that worker processes, if any, each have a cache of their own.
+            image_arena_path (str, optional): Only relevant if `load_images_into_memory` is `True`. If `None`, the
+                images are loaded into an anonymous shared memory buffer, which only processes that are forked from
+                this one share. Otherwise, the path of a file for the buffer, preferably on a memory-backed file system
+                such as '/dev/shm'. If a complete image arena for this dataset already exists at this path, e.g. because
+                another training job on the same host created it, this data generator attaches to it instead of loading
+                the images again, so that all jobs share one copy of the images. Whether the arena belongs to this dataset
+                is decided by a fingerprint of the paths, sizes and modification times of the image files (or of the HDF5
+                or memory-mapped dataset), and an arena with a different fingerprint is rebuilt.
             verbose (bool, optional): If `True`, prints out the progress for some constructor operations that may
                 take a bit longer.
         '''
@@ -142,9 +313,22 @@ class DataGenerator:
                             'xmax': labels_output_format.index('xmax'),
                             'ymax': labels_output_format.index('ymax')} # This dictionary is for internal use.
 
+        self.convert_to_3_channels = ConvertTo3Channels() # Images in HDF5 datasets always have three channels.
+        self.parse_cache_dir = parse_cache_dir
+        if image_cache_bytes > 0:
+            self.image_cache = DecodedImageCache(image_cache_bytes)
+        else:
+            self.image_cache = None
+
         self.dataset_size = 0 # As long as we haven't loaded anything yet, the dataset size is zero.
         self.load_images_into_memory = load_images_into_memory
-        self.images = None # The only way that this list will not stay `None` is if `load_images_into_memory == True`.
+        self.image_arena_path = image_arena_path
+        self.images = None # The only way that this will not stay `None` is if `load_images_into_memory == True`.
+        self.generator_states = deque(maxlen=GENERATOR_STATE_HISTORY_SIZE) # The initial state and the states after the most recently yielded batches of `generate()`.
+        # There is no HDF5 or memory-mapped dataset until one gets loaded below.
+        self.hdf5_dataset = None
+        self.hdf5_dataset_pid = None # The ID of the process that opened `hdf5_dataset`.
+        self.memmap_index = None
 
         # `self.filenames` is a list containing all file names of the image samples (full paths).
         # Note that it does not contain the actual image files themselves. This list is one of the outputs of the parser methods.
@@ -165,25 +349,20 @@ class DataGenerator:
             self.dataset_size = len(self.filenames)
             self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
             if load_images_into_memory:
-                self.images = []
-                if verbose: it = tqdm(self.filenames, desc='Loading images into memory', file=sys.stdout)
-                else: it = self.filenames
-                for filename in it:
-                    with Image.open(filename) as image:
-                        self.images.append(np.array(image, dtype=np.uint8))
+                self._load_images_into_memory(verbose)
         else:
             self.filenames = None
 
-        # In case ground truth is available, `self.labels` is a list containing for each image a list (or NumPy array)
+        # In case ground truth is available, `self.labels` is a `LabelStore` containing for each image a 2D Numpy array
         # of ground truth bounding boxes for that image.
         if not labels is None:
             if isinstance(labels, str):
                 with open(labels, 'rb') as f:
-                    self.labels = pickle.load(f)
-            elif isinstance(labels, (list, tuple)):
-                self.labels = labels
+                    self.labels = LabelStore.from_labels(pickle.load(f), num_columns=len(labels_output_format))
+            elif isinstance(labels, (list, tuple, LabelStore)):
+                self.labels = LabelStore.from_labels(labels, num_columns=len(labels_output_format))
             else:
-                raise ValueError("`labels` must be either a Python list/tuple or a string representing the path to a pickled file containing a list/tuple. The value you passed is neither of the two.")
+                raise ValueError("`labels` must be either a Python list/tuple, a `LabelStore`, or a string representing the path to a pickled file containing a list/tuple. The value you passed is neither of the two.")
         else:
             self.labels = None
 
@@ -213,8 +392,57 @@ class DataGenerator:
             self.hdf5_dataset_path = hdf5_dataset_path
             self.load_hdf5_dataset(verbose=verbose)
         else:
+            self.hdf5_dataset_path = None
+            self.hdf5_image_layout = None
             self.hdf5_dataset = None
 
+        if not memmap_dataset_dir is None:
+            self.memmap_dataset_dir = memmap_dataset_dir
+            self.load_memmap_dataset(verbose=verbose)
+        else:
+            self.memmap_dataset_dir = None
+            self.memmap_index = None
+            self.memmap_shards = {}
+
+    def __getstate__(self):
+        # HDF5 file handles can't be pickled. A data generator that gets sent to another
+        # process (e.g. a batch production worker) reopens the HDF5 dataset there instead.
+        # The same goes for the shards of a memory-mapped dataset, which would otherwise be
+        # pickled with all their contents. They are mapped again on demand.
+        # Another process starts out with an empty image cache of its own.
+        state = self.__dict__.copy()
+        state['hdf5_dataset'] = None
+        state['hdf5_dataset_pid'] = None
+        state['memmap_shards'] = {}
+        if not (self.image_cache is None):
+            state['image_cache'] = DecodedImageCache(self.image_cache.max_bytes)
+        return state
+
+    def reopen_hdf5_dataset(self):
+        '''
+        Opens a new handle to the HDF5 dataset at `hdf5_dataset_path` without reloading
+        any labels, image IDs etc. This is needed in processes that were forked from the
+        process that originally opened the dataset, since HDF5 file handles do not survive
+        `fork()`, and in processes that received an unpickled copy of this data generator.
+        `_produce_batch()` calls it automatically in such processes.
+
+        Returns:
+            None.
+        '''
+        self.hdf5_dataset = h5py.File(self.hdf5_dataset_path, 'r')
+        self.hdf5_dataset_pid = os.getpid()
+
+    def _ensure_hdf5_dataset(self):
+        '''
+        Reopens the HDF5 dataset if this data generator has an HDF5 dataset, but no handle to it
+        that was opened in the current process, i.e. if it was unpickled or forked from another process.
+
+        Returns:
+            None.
+        '''
+        if not (self.hdf5_dataset_path is None) and ((self.hdf5_dataset is None) or (self.hdf5_dataset_pid != os.getpid())):
+            self.reopen_hdf5_dataset()
+
     def load_hdf5_dataset(self, verbose=True):
         '''
         Loads an HDF5 dataset that is in the format that the `create_hdf5_dataset()` method
@@ -229,24 +457,22 @@ class DataGenerator:
         '''
 
         self.hdf5_dataset = h5py.File(self.hdf5_dataset_path, 'r')
+        self.hdf5_dataset_pid = os.getpid()
+        self.hdf5_image_layout = self.hdf5_dataset.attrs.get('image_layout', 'flattened') # Datasets created before there was a choice of layouts are flattened.
+        self._clear_image_cache()
         self.dataset_size = len(self.hdf5_dataset['images'])
         self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32) # Instead of shuffling the HDF5 dataset or images in memory, we will shuffle this index list.
 
         if self.load_images_into_memory:
-            self.images = []
-            if verbose: tr = trange(self.dataset_size, desc='Loading images into memory', file=sys.stdout)
-            else: tr = range(self.dataset_size)
-            for i in tr:
-                self.images.append(self.hdf5_dataset['images'][i].reshape(self.hdf5_dataset['image_shapes'][i]))
+            self._load_images_into_memory(verbose)
 
         if self.hdf5_dataset.attrs['has_labels']:
-            self.labels = []
-            labels = self.hdf5_dataset['labels']
-            label_shapes = self.hdf5_dataset['label_shapes']
-            if verbose: tr = trange(self.dataset_size, desc='Loading labels', file=sys.stdout)
-            else: tr = range(self.dataset_size)
-            for i in tr:
-                self.labels.append(labels[i].reshape(label_shapes[i]))
+            if verbose: print('Loading labels')
+            # Read all labels at once.
+            labels = self.hdf5_dataset['labels'][:]
+            label_shapes = self.hdf5_dataset['label_shapes'][:]
+            self.labels = LabelStore.from_labels([labels[i].reshape(label_shapes[i]) for i in range(self.dataset_size)],
+                                                 num_columns=len(self.labels_output_format))
 
         if self.hdf5_dataset.attrs['has_image_ids']:
             self.image_ids = []
@@ -264,6 +490,249 @@ class DataGenerator:
             for i in tr:
                 self.eval_neutral.append(eval_neutral[i])
 
+    def load_memmap_dataset(self, verbose=True):
+        '''
+        Loads a memory-mapped dataset that is in the format that the `create_memmap_dataset()`
+        method produces.
+
+        The image shards are not read here. They are mapped into memory the first time an image
+        from them is needed, and the images are then read straight from the OS page cache.
+        The labels and evaluation-neutrality annotations are read-only views into memory-mapped
+        arrays, too.
+
+        Arguments:
+            verbose (bool, optional): If `True`, prints out the progress while loading
+                the dataset.
+
+        Returns:
+            None.
+        '''
+
+        with open(os.path.join(self.memmap_dataset_dir, 'dataset.json'), 'r') as f:
+            meta = json.load(f)
+
+        self.memmap_index = np.load(os.path.join(self.memmap_dataset_dir, 'image_index.npy'))
+        self.memmap_shards = {}
+        self._clear_image_cache()
+        self.dataset_size = len(self.memmap_index)
+        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32) # Instead of shuffling the shards or images in memory, we will shuffle this index list.
+
+        if self.load_images_into_memory:
+            self._load_images_into_memory(verbose)
+
+        if meta['has_labels'] or meta['has_eval_neutral']:
+            label_offsets = np.load(os.path.join(self.memmap_dataset_dir, 'label_offsets.npy'))
+
+        if meta['has_labels']:
+            labels = np.load(os.path.join(self.memmap_dataset_dir, 'labels.npy'), mmap_mode='r')
+            self.labels = LabelStore(labels, label_offsets)
+
+        if meta['has_image_ids']:
+            self.image_ids = np.load(os.path.join(self.memmap_dataset_dir, 'image_ids.npy')).tolist()
+
+        if meta['has_eval_neutral']:
+            eval_neutral = np.load(os.path.join(self.memmap_dataset_dir, 'eval_neutral.npy'), mmap_mode='r')
+            self.eval_neutral = [eval_neutral[label_offsets[i]:label_offsets[i+1]] for i in range(self.dataset_size)]
+
+    def _clear_image_cache(self):
+        '''
+        Empties the decoded-image cache, if there is one. Must be called whenever a different
+        dataset is loaded, since the cached images are identified by their dataset indices.
+        '''
+        if not (self.image_cache is None):
+            self.image_cache.clear()
+
+    def _load_images_into_memory(self, verbose):
+        '''
+        Loads all images of the dataset into an `ImageArena`, or attaches to an existing arena at
+        `image_arena_path`. The arena is allocated in one piece, using the image shapes from the
+        image file headers or from the index of the HDF5 or memory-mapped dataset.
+
+        Arguments:
+            verbose (bool): If `True`, prints out the progress while loading the images.
+
+        Returns:
+            None.
+        '''
+        if not (self.image_arena_path is None):
+            fingerprint = self._get_image_arena_fingerprint()
+            if ImageArena.exists(self.image_arena_path, fingerprint):
+                self.images = ImageArena.attach(self.image_arena_path)
+                return
+            # An arena of a different dataset or of an outdated version of this dataset is rebuilt. Processes that
+            # are still attached to it keep their mapping of the old file.
+            ImageArena.remove(self.image_arena_path)
+        else:
+            fingerprint = None
+
+        # Find out how much memory the images need.
+        arena = ImageArena.create(self._get_stored_image_shapes(), path=self.image_arena_path, fingerprint=fingerprint)
+
+        if verbose: tr = trange(self.dataset_size, desc='Loading images into memory', file=sys.stdout)
+        else: tr = range(self.dataset_size)
+        for i in tr:
+            if not (self.hdf5_dataset is None):
+                image = self._read_hdf5_image(i)
+            elif not (self.memmap_index is None):
+                image = self._read_memmap_image(i)
+            else:
+                image = self._load_image_file(self.filenames[i])
+            arena.write(i, image)
+
+        if not (self.image_arena_path is None):
+            arena.save_index()
+
+        self.images = arena
+
+    def _get_image_arena_fingerprint(self):
+        '''
+        Computes a fingerprint of the images of the dataset from the paths, sizes and modification times
+        of the files that they are read from, without reading any images.
+
+        Returns:
+            The fingerprint as a hexadecimal string.
+        '''
+        if not (self.hdf5_dataset is None):
+            input_files = [self.hdf5_dataset_path]
+        elif not (self.memmap_index is None):
+            input_files = [os.path.join(self.memmap_dataset_dir, name) for name in sorted(os.listdir(self.memmap_dataset_dir))]
+        else:
+            input_files = self.filenames
+        key = hashlib.sha1()
+        key.update(repr(len(input_files)).encode('utf-8'))
+        for input_file in input_files:
+            stat = os.stat(input_file)
+            key.update(repr((os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        return key.hexdigest()
+
+    def _get_stored_image_shapes(self):
+        '''
+        Returns the shapes of the images as they are stored, i.e. in the HDF5 or memory-mapped dataset
+        or in the image files, without decoding any images.
+
+        Returns:
+            A list that contains the shape of each image as a tuple.
+        '''
+        if not (self.hdf5_dataset is None):
+            return [tuple(shape) for shape in self.hdf5_dataset['image_shapes'][:]]
+        elif not (self.memmap_index is None):
+            return [tuple(shape) for shape in self.memmap_index[:,2:]]
+        else:
+            return [self._get_image_file_shape(filename) for filename in self.filenames]
+
+    def get_image_sizes(self):
+        '''
+        Returns the height and width of every image of the dataset without decoding any images.
+        The sizes are taken from the images in memory or from the HDF5 or memory-mapped dataset if
+        possible, and from the headers of the image files otherwise.
+
+        Returns:
+            A Numpy array of shape `(dataset_size, 2)` that contains the height and width of each
+            image in the order of the dataset.
+        '''
+        if not (self.images is None):
+            return np.array(self.images.shapes[:,:2])
+        return np.array([shape[:2] for shape in self._get_stored_image_shapes()], dtype=np.int64).reshape(-1, 2)
+
+    def _get_image_file_shape(self, filename):
+        '''
+        Reads the shape that an image file will have once it is decoded from its header.
+
+        Arguments:
+            filename (str): The full path of the image file.
+
+        Returns:
+            The shape of the image as a tuple `(height, width)` if it has a single band
+            and `(height, width, channels)` otherwise.
+        '''
+        with Image.open(filename) as image:
+            width, height = image.size
+            bands = len(image.getbands())
+        if bands == 1:
+            return (height, width)
+        else:
+            return (height, width, bands)
+
+    def _get_parse_cache_path(self, parser, input_files, arguments):
+        '''
+        Computes the path of the parse cache entry for the outputs of a parser.
+
+        Arguments:
+            parser (str): The name of the parser.
+            input_files (list): The paths of all files that the parser reads.
+            arguments (dict): All arguments that the parser output depends on.
+
+        Returns:
+            The path of the cache entry or `None` if there is no parse cache.
+        '''
+        if self.parse_cache_dir is None:
+            return None
+        key = hashlib.sha1()
+        key.update(repr((PARSE_CACHE_VERSION, parser, tuple(self.labels_output_format), sorted(arguments.items()))).encode('utf-8'))
+        for input_file in input_files:
+            stat = os.stat(input_file)
+            key.update(repr((os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        return os.path.join(self.parse_cache_dir, '{}_{}.pkl'.format(parser, key.hexdigest()))
+
+    def _load_parse_cache(self, cache_path):
+        '''
+        Loads the outputs of a parser from the parse cache, if the cache contains them.
+
+        Arguments:
+            cache_path (str): The path of the cache entry as returned by `_get_parse_cache_path()`.
+
+        Returns:
+            `True` if the outputs were loaded from the cache and `False` otherwise.
+        '''
+        if (cache_path is None) or not os.path.isfile(cache_path):
+            return False
+        with open(cache_path, 'rb') as f:
+            attributes = pickle.load(f)
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        return True
+
+    def _save_parse_cache(self, cache_path, attribute_names):
+        '''
+        Stores the outputs of a parser in the parse cache.
+
+        Arguments:
+            cache_path (str): The path of the cache entry as returned by `_get_parse_cache_path()`.
+            attribute_names (list): The names of the attributes that hold the outputs of the parser.
+
+        Returns:
+            None.
+        '''
+        if cache_path is None:
+            return
+        if not os.path.isdir(self.parse_cache_dir):
+            os.makedirs(self.parse_cache_dir)
+        attributes = {name: getattr(self, name) for name in attribute_names}
+        # Write to a temporary file first so that other processes never read an incomplete cache entry.
+        temp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(attributes, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+
+    def _finish_parsing(self, verbose):
+        '''
+        Puts the labels that a parser has produced into a `LabelStore`, sets up the dataset
+        indices and maybe loads the images into memory.
+
+        Arguments:
+            verbose (bool): If `True`, prints out the progress while loading the images.
+
+        Returns:
+            None.
+        '''
+        if not (self.labels is None):
+            self.labels = LabelStore.from_labels(self.labels, num_columns=len(self.labels_output_format))
+        self._clear_image_cache()
+        self.dataset_size = len(self.filenames)
+        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
+        if self.load_images_into_memory:
+            self._load_images_into_memory(verbose)
+
     def parse_csv(self,
                   images_dir,
                   labels_filename,
@@ -313,6 +782,20 @@ class DataGenerator:
         if self.labels_filename is None or self.input_format is None:
             raise ValueError("`labels_filename` and/or `input_format` have not been set yet. You need to pass them as arguments.")
 
+        # A random sample of the dataset must not be cached, since it is supposed to be different every time.
+        if not random_sample:
+            cache_path = self._get_parse_cache_path(parser='csv',
+                                                    input_files=[labels_filename],
+                                                    arguments={'images_dir': images_dir,
+                                                               'input_format': tuple(input_format),
+                                                               'include_classes': include_classes})
+        else:
+            cache_path = None
+        if self._load_parse_cache(cache_path):
+            self._finish_parsing(verbose)
+            if ret: return self.images, self.filenames, self.labels, self.image_ids
+            return
+
         # Erase data that might have been parsed before
         self.filenames = []
         self.image_ids = []
@@ -384,15 +867,8 @@ class DataGenerator:
                         self.filenames.append(os.path.join(self.images_dir, current_file))
                         self.image_ids.append(current_image_id)
 
-        self.dataset_size = len(self.filenames)
-        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
-        if self.load_images_into_memory:
-            self.images = []
-            if verbose: it = tqdm(self.filenames, desc='Loading images into memory', file=sys.stdout)
-            else: it = self.filenames
-            for filename in it:
-                with Image.open(filename) as image:
-                    self.images.append(np.array(image, dtype=np.uint8))
+        self._finish_parsing(verbose)
+        self._save_parse_cache(cache_path, ['filenames', 'labels', 'image_ids'])
 
         if ret: # In case we want to return these
             return self.images, self.filenames, self.labels, self.image_ids
@@ -410,6 +886,8 @@ class DataGenerator:
                   include_classes = 'all',
                   exclude_truncated=False,
                   exclude_difficult=False,
+                  xml_parser='etree',
+                  num_workers=0,
                   ret=False,
                   verbose=True):
         '''
@@ -436,6 +914,13 @@ class DataGenerator:
                 are to be included in the dataset. If 'all', all ground truth boxes will be included in the dataset.
             exclude_truncated (bool, optional): If `True`, excludes boxes that are labeled as 'truncated'.
             exclude_difficult (bool, optional): If `True`, excludes boxes that are labeled as 'difficult'.
+            xml_parser (str, optional): The XML parser with which the annotation files are parsed. Can be either
+                'etree' or 'bs4'. 'etree' streams through the files with lxml's `iterparse()`, or with the one of
+                Python's standard library if lxml isn't installed, which is many times faster than building a
+                BeautifulSoup tree for each file with 'bs4'. Both produce identical outputs for well-formed XML
+                files, but BeautifulSoup is more lenient towards malformed ones.
+            num_workers (int, optional): The number of worker processes across which the annotation files are parsed.
+                If 0, they are parsed in the calling process.
             ret (bool, optional): Whether or not to return the outputs of the parser.
             verbose (bool, optional): If `True`, prints out the progress for operations that may take a bit longer.
 
@@ -450,6 +935,27 @@ class DataGenerator:
         self.classes = classes
         self.include_classes = include_classes
 
+        if not (self.parse_cache_dir is None):
+            # The parser output depends on the image set files and on all annotation files they list.
+            input_files = list(image_set_filenames)
+            for image_set_filename, annotations_dir in zip(image_set_filenames, annotations_dirs):
+                with open(image_set_filename) as f:
+                    input_files += [os.path.join(annotations_dir, line.strip() + '.xml') for line in f]
+            cache_path = self._get_parse_cache_path(parser='xml',
+                                                    input_files=input_files,
+                                                    arguments={'images_dirs': tuple(images_dirs),
+                                                               'annotations_dirs': tuple(annotations_dirs),
+                                                               'classes': tuple(classes),
+                                                               'include_classes': include_classes if include_classes == 'all' else tuple(include_classes),
+                                                               'exclude_truncated': exclude_truncated,
+                                                               'exclude_difficult': exclude_difficult})
+        else:
+            cache_path = None
+        if self._load_parse_cache(cache_path):
+            self._finish_parsing(verbose)
+            if ret: return self.images, self.filenames, self.labels, self.image_ids, self.eval_neutral
+            return
+
         # Erase data that might have been parsed before.
         self.filenames = []
         self.image_ids = []
@@ -460,81 +966,48 @@ class DataGenerator:
             self.eval_neutral = None
             annotations_dirs = [None] * len(images_dirs)
 
-        for images_dir, image_set_filename, annotations_dir in zip(images_dirs, image_set_filenames, annotations_dirs):
-            # Read the image set file that so that we know all the IDs of all the images to be included in the dataset.
-            with open(image_set_filename) as f:
-                image_ids = [line.strip() for line in f] # Note: These are strings, not integers.
-                self.image_ids += image_ids
-
-            if verbose: it = tqdm(image_ids, desc="Processing image set '{}'".format(os.path.basename(image_set_filename)), file=sys.stdout)
-            else: it = image_ids
+        if (num_workers > 0) and any(not (annotations_dir is None) for annotations_dir in annotations_dirs):
+            pool = get_multiprocessing_context().Pool(processes=num_workers)
+        else:
+            pool = None
 
-            # Loop over all images in this dataset.
-            for image_id in it:
+        try:
+            for images_dir, image_set_filename, annotations_dir in zip(images_dirs, image_set_filenames, annotations_dirs):
+                # Read the image set file that so that we know all the IDs of all the images to be included in the dataset.
+                with open(image_set_filename) as f:
+                    image_ids = [line.strip() for line in f] # Note: These are strings, not integers.
+                    self.image_ids += image_ids
 
-                filename = '{}'.format(image_id) + '.jpg'
-                self.filenames.append(os.path.join(images_dir, filename))
+                self.filenames += [os.path.join(images_dir, '{}'.format(image_id) + '.jpg') for image_id in image_ids]
 
                 if not annotations_dir is None:
-                    # Parse the XML file for this image.
-                    with open(os.path.join(annotations_dir, image_id + '.xml')) as f:
-                        soup = BeautifulSoup(f, 'xml')
-
-                    folder = soup.folder.text # In case we want to return the folder in addition to the image file name. Relevant for determining which dataset an image belongs to.
-                    #filename = soup.filename.text
-
-                    boxes = [] # We'll store all boxes for this image here.
-                    eval_neutr = [] # We'll store whether a box is annotated as "difficult" here.
-                    objects = soup.find_all('object') # Get a list of all objects in this image.
-
-                    # Parse the data for each object.
-                    for obj in objects:
-                        class_name = obj.find('name', recursive=False).text
-                        class_id = self.classes.index(class_name)
-                        # Check whether this class is supposed to be included in the dataset.
-                        if (not self.include_classes == 'all') and (not class_id in self.include_classes): continue
-                        pose = obj.find('pose', recursive=False).text
-                        truncated = int(obj.find('truncated', recursive=False).text)
-                        if exclude_truncated and (truncated == 1): continue
-                        difficult = int(obj.find('difficult', recursive=False).text)
-                        if exclude_difficult and (difficult == 1): continue
-                        # Get the bounding box coordinates.
-                        bndbox = obj.find('bndbox', recursive=False)
-                        xmin = int(bndbox.xmin.text)
-                        ymin = int(bndbox.ymin.text)
-                        xmax = int(bndbox.xmax.text)
-                        ymax = int(bndbox.ymax.text)
-                        item_dict = {'folder': folder,
-                                     'image_name': filename,
-                                     'image_id': image_id,
-                                     'class_name': class_name,
-                                     'class_id': class_id,
-                                     'pose': pose,
-                                     'truncated': truncated,
-                                     'difficult': difficult,
-                                     'xmin': xmin,
-                                     'ymin': ymin,
-                                     'xmax': xmax,
-                                     'ymax': ymax}
-                        box = []
-                        for item in self.labels_output_format:
-                            box.append(item_dict[item])
-                        boxes.append(box)
-                        if difficult: eval_neutr.append(True)
-                        else: eval_neutr.append(False)
+                    parse_annotation = partial(parse_xml_annotation,
+                                               annotations_dir=annotations_dir,
+                                               classes=self.classes,
+                                               include_classes=self.include_classes,
+                                               exclude_truncated=exclude_truncated,
+                                               exclude_difficult=exclude_difficult,
+                                               labels_output_format=self.labels_output_format,
+                                               xml_parser=xml_parser)
+
+                    if not (pool is None):
+                        annotations = pool.imap(parse_annotation, image_ids, chunksize=64)
+                    else:
+                        # Loop over all images in this dataset.
+                        annotations = map(parse_annotation, image_ids)
 
-                    self.labels.append(boxes)
-                    self.eval_neutral.append(eval_neutr)
+                    if verbose: annotations = tqdm(annotations, total=len(image_ids), desc="Processing image set '{}'".format(os.path.basename(image_set_filename)), file=sys.stdout)
 
-        self.dataset_size = len(self.filenames)
-        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
-        if self.load_images_into_memory:
-            self.images = []
-            if verbose: it = tqdm(self.filenames, desc='Loading images into memory', file=sys.stdout)
-            else: it = self.filenames
-            for filename in it:
-                with Image.open(filename) as image:
-                    self.images.append(np.array(image, dtype=np.uint8))
+                    for boxes, eval_neutr in annotations:
+                        self.labels.append(boxes)
+                        self.eval_neutral.append(eval_neutr)
+        finally:
+            if not (pool is None):
+                pool.terminate()
+                pool.join()
+
+        self._finish_parsing(verbose)
+        self._save_parse_cache(cache_path, ['filenames', 'labels', 'image_ids', 'eval_neutral'])
 
         if ret:
             return self.images, self.filenames, self.labels, self.image_ids, self.eval_neutral
@@ -573,6 +1046,17 @@ class DataGenerator:
         self.images_dirs = images_dirs
         self.annotations_filenames = annotations_filenames
         self.include_classes = include_classes
+
+        cache_path = self._get_parse_cache_path(parser='json',
+                                                input_files=annotations_filenames,
+                                                arguments={'images_dirs': tuple(images_dirs),
+                                                           'ground_truth_available': ground_truth_available,
+                                                           'include_classes': include_classes if include_classes == 'all' else tuple(include_classes)})
+        if self._load_parse_cache(cache_path):
+            self._finish_parsing(verbose)
+            if ret: return self.images, self.filenames, self.labels, self.image_ids
+            return
+
         # Erase data that might have been parsed before.
         self.filenames = []
         self.image_ids = []
@@ -651,15 +1135,9 @@ class DataGenerator:
                         boxes.append(box)
                     self.labels.append(boxes)
 
-        self.dataset_size = len(self.filenames)
-        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
-        if self.load_images_into_memory:
-            self.images = []
-            if verbose: it = tqdm(self.filenames, desc='Loading images into memory', file=sys.stdout)
-            else: it = self.filenames
-            for filename in it:
-                with Image.open(filename) as image:
-                    self.images.append(np.array(image, dtype=np.uint8))
+        self._finish_parsing(verbose)
+        self._save_parse_cache(cache_path, ['filenames', 'labels', 'image_ids',
+                                            'cats_to_names', 'classes_to_names', 'cats_to_classes', 'classes_to_cats'])
 
         if ret:
             return self.images, self.filenames, self.labels, self.image_ids
@@ -668,6 +1146,13 @@ class DataGenerator:
                             file_path='dataset.h5',
                             resize=False,
                             variable_image_size=True,
+                            image_layout='flattened',
+                            compression=None,
+                            compression_opts=None,
+                            jpeg_quality=95,
+                            num_workers=0,
+                            commit_size=1000,
+                            resume=False,
                             verbose=True):
         '''
         Converts the currently loaded dataset into a HDF5 file. This HDF5 file contains all
@@ -696,136 +1181,614 @@ class DataGenerator:
             variable_image_size (bool, optional): The only purpose of this argument is that its
                 value will be stored in the HDF5 dataset in order to be able to quickly find out
                 whether the images in the dataset all have the same size or not.
+            image_layout (str, optional): How the images are stored in the HDF5 file. Can be one of
+                'flattened', 'contiguous', and 'encoded'. If 'flattened', each image is stored as a flattened,
+                variable-length array, which works for images of any size. If 'encoded', each image is stored
+                in its compressed file format, i.e. as the original bytes of its image file, or, if `resize`
+                is set, as the bytes of the resized image encoded as a JPEG. The images are then decoded
+                each time they are read. This makes the HDF5 file many times smaller than with the other
+                layouts, which can matter more than the decoding time if the file is read from slow or
+                network storage or if it doesn't fit into the page cache. If 'contiguous', all images
+                are stored in a single array of shape `(dataset_size, height, width, 3)` that is chunked
+                by image, which allows the generator to read an entire batch with a single read operation
+                and which can be compressed. This requires all images to have the same size, i.e. either
+                `resize` must be set or all images in the dataset must already have the same size.
+            compression (str, optional): Only relevant if `image_layout` is 'contiguous'. `None` or the name
+                of an HDF5 compression filter for the images, e.g. 'lzf' or 'gzip'. 'lzf' is fast and
+                reduces the file size moderately, 'gzip' compresses better, but decompression is slower.
+            compression_opts (optional): Only relevant if `compression` is 'gzip'. The compression level
+                as an integer in `[0, 9]`.
+            jpeg_quality (int, optional): Only relevant if `image_layout` is 'encoded' and `resize` is set.
+                The JPEG quality in `[0, 100]` with which the resized images are encoded.
+            num_workers (int, optional): The number of worker processes that load, resize and encode the images.
+                If 0, this is all done in the calling process. Either way, the calling process is the only one that
+                writes to the HDF5 file.
+            commit_size (int, optional): The number of images after which the written data is flushed to disk and
+                the number of images written so far is stored in the file. This is how far an interrupted dataset
+                creation can be resumed. With worker processes, this is also the number of images that are loaded
+                in advance while the previous images are being written.
+            resume (bool, optional): If `True` and an incomplete HDF5 dataset already exists at `file_path`, e.g. because
+                a previous call of this method was interrupted, the dataset creation is resumed after the last committed
+                image instead of starting from scratch. The existing dataset must have been created from the same dataset
+                with the same `image_layout`. If there is no file at `file_path`, a new dataset is created.
             verbose (bool, optional): Whether or not prit out the progress of the dataset creation.
 
         Returns:
             None.
         '''
 
+        if not image_layout in {'flattened', 'contiguous', 'encoded'}:
+            raise ValueError("`image_layout` can be one of 'flattened', 'contiguous', or 'encoded', but received '{}'.".format(image_layout))
+
+        dataset_size = len(self.filenames)
+
+        if resume and os.path.isfile(file_path):
+            # Open the existing HDF5 file and find out where we left off.
+            hdf5_dataset = h5py.File(file_path, 'a')
+            if not 'n_committed' in hdf5_dataset.attrs:
+                hdf5_dataset.close()
+                raise ValueError("The HDF5 dataset at '{}' has no record of how many images were committed, so it cannot be resumed.".format(file_path))
+            if (len(hdf5_dataset['images']) != dataset_size) or (hdf5_dataset.attrs.get('image_layout', 'flattened') != image_layout):
+                hdf5_dataset.close()
+                raise ValueError("The HDF5 dataset at '{}' was not created from this dataset with `image_layout = '{}'`, so it cannot be resumed.".format(file_path, image_layout))
+            start = int(hdf5_dataset.attrs['n_committed'])
+
+        else:
+
+            # Create the HDF5 file.
+            hdf5_dataset = h5py.File(file_path, 'w')
+
+            # Create a few attributes that tell us what this dataset contains.
+            # The dataset will obviously always contain images, but maybe it will
+            # also contain labels, image IDs, etc.
+            hdf5_dataset.attrs.create(name='has_labels', data=False, shape=None, dtype=np.bool_)
+            hdf5_dataset.attrs.create(name='has_image_ids', data=False, shape=None, dtype=np.bool_)
+            hdf5_dataset.attrs.create(name='has_eval_neutral', data=False, shape=None, dtype=np.bool_)
+            # It's useful to be able to quickly check whether the images in a dataset all
+            # have the same size or not, so add a boolean attribute for that.
+            if variable_image_size and not resize and not (image_layout == 'contiguous'):
+                hdf5_dataset.attrs.create(name='variable_image_size', data=True, shape=None, dtype=np.bool_)
+            else:
+                hdf5_dataset.attrs.create(name='variable_image_size', data=False, shape=None, dtype=np.bool_)
+            hdf5_dataset.attrs['image_layout'] = image_layout
+
+            if image_layout in {'flattened', 'encoded'}:
+                # Create the dataset in which the images will be stored as flattened arrays
+                # or as encoded image files. This allows us, among other things, to store
+                # images of variable size.
+                hdf5_images = hdf5_dataset.create_dataset(name='images',
+                                                          shape=(dataset_size,),
+                                                          maxshape=(None,),
+                                                          dtype=h5py.special_dtype(vlen=np.uint8))
+            else:
+                # Create the dataset in which all images will be stored in one array. Each chunk
+                # holds one image so that reading any subset of the images touches only their chunks.
+                if resize:
+                    image_shape = (resize[0], resize[1], 3)
+                else:
+                    image_shape = self._load_hdf5_image(self.filenames[0], resize).shape
+                hdf5_images = hdf5_dataset.create_dataset(name='images',
+                                                          shape=(dataset_size,) + image_shape,
+                                                          maxshape=(None,) + image_shape,
+                                                          chunks=(1,) + image_shape,
+                                                          compression=compression,
+                                                          compression_opts=compression_opts,
+                                                          dtype=np.uint8)
+
+            # Create the dataset that will hold the image heights, widths and channels that
+            # we need in order to reconstruct the images from the flattened arrays later.
+            hdf5_image_shapes = hdf5_dataset.create_dataset(name='image_shapes',
+                                                            shape=(dataset_size, 3),
+                                                            maxshape=(None, 3),
+                                                            dtype=np.int32)
+
+            if not (self.labels is None):
+
+                # Create the dataset in which the labels will be stored as flattened arrays.
+                hdf5_labels = hdf5_dataset.create_dataset(name='labels',
+                                                          shape=(dataset_size,),
+                                                          maxshape=(None,),
+                                                          dtype=h5py.special_dtype(vlen=np.int32))
+
+                # Create the dataset that will hold the dimensions of the labels arrays for
+                # each image so that we can restore the labels from the flattened arrays later.
+                hdf5_label_shapes = hdf5_dataset.create_dataset(name='label_shapes',
+                                                                shape=(dataset_size, 2),
+                                                                maxshape=(None, 2),
+                                                                dtype=np.int32)
+
+                hdf5_dataset.attrs.modify(name='has_labels', value=True)
+
+            if not (self.image_ids is None):
+
+                hdf5_image_ids = hdf5_dataset.create_dataset(name='image_ids',
+                                                             shape=(dataset_size,),
+                                                             maxshape=(None,),
+                                                             dtype=h5py.special_dtype(vlen=str))
+
+                hdf5_dataset.attrs.modify(name='has_image_ids', value=True)
+
+            if not (self.eval_neutral is None):
+
+                # Create the dataset in which the labels will be stored as flattened arrays.
+                hdf5_eval_neutral = hdf5_dataset.create_dataset(name='eval_neutral',
+                                                                shape=(dataset_size,),
+                                                                maxshape=(None,),
+                                                                dtype=h5py.special_dtype(vlen=np.bool_))
+
+                hdf5_dataset.attrs.modify(name='has_eval_neutral', value=True)
+
+            # The number of images that have been written to the file completely.
+            hdf5_dataset.attrs['n_committed'] = 0
+            start = 0
+
+        self._write_hdf5_items(hdf5_dataset=hdf5_dataset,
+                               offset=0,
+                               start=start,
+                               resize=resize,
+                               image_layout=image_layout,
+                               jpeg_quality=jpeg_quality,
+                               num_workers=num_workers,
+                               commit_size=commit_size,
+                               verbose=verbose)
+
+        hdf5_dataset.close()
         self.hdf5_dataset_path = file_path
+        self.reopen_hdf5_dataset()
+        self.hdf5_image_layout = image_layout
+        self._clear_image_cache() # The images may have been resized.
+        self.dataset_size = len(self.hdf5_dataset['images'])
+        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32) # Instead of shuffling the HDF5 dataset, we will shuffle this index list.
+
+    def append_to_hdf5_dataset(self,
+                               file_path,
+                               resize=False,
+                               jpeg_quality=95,
+                               num_workers=0,
+                               commit_size=1000,
+                               verbose=True):
+        '''
+        Appends the currently loaded dataset to an existing HDF5 dataset in place, e.g. to add
+        newly labeled images to an HDF5 dataset without having to rebuild it.
+
+        The images are stored in the image layout of the existing HDF5 dataset and the currently
+        loaded dataset must have the same kinds of annotations as the existing HDF5 dataset, i.e.
+        labels, image IDs, and evaluation-neutrality annotations. All datasets in the HDF5 file are
+        resized only once before the new images are written.
+
+        Afterwards, the data generator uses the extended HDF5 dataset, i.e. the old and the new images.
+
+        In order to merge entire HDF5 datasets, use `merge_hdf5_datasets()` from `object_detection_2d_hdf5_utils`.
+
+        Arguments:
+            file_path (str): The full file path of the HDF5 dataset to be extended.
+            All other arguments are as described in the documentation of `create_hdf5_dataset()`.
+
+        Returns:
+            None.
+        '''
+
+        # h5py does not allow a file to be opened for writing while it is open for reading.
+        if not (self.hdf5_dataset is None) and (self.hdf5_dataset_path == file_path):
+            self.hdf5_dataset.close()
+            self.hdf5_dataset = None
 
         dataset_size = len(self.filenames)
 
-        # Create the HDF5 file.
-        hdf5_dataset = h5py.File(file_path, 'w')
-
-        # Create a few attributes that tell us what this dataset contains.
-        # The dataset will obviously always contain images, but maybe it will
-        # also contain labels, image IDs, etc.
-        hdf5_dataset.attrs.create(name='has_labels', data=False, shape=None, dtype=np.bool_)
-        hdf5_dataset.attrs.create(name='has_image_ids', data=False, shape=None, dtype=np.bool_)
-        hdf5_dataset.attrs.create(name='has_eval_neutral', data=False, shape=None, dtype=np.bool_)
-        # It's useful to be able to quickly check whether the images in a dataset all
-        # have the same size or not, so add a boolean attribute for that.
-        if variable_image_size and not resize:
-            hdf5_dataset.attrs.create(name='variable_image_size', data=True, shape=None, dtype=np.bool_)
+        hdf5_dataset = h5py.File(file_path, 'a')
+
+        try:
+            if 'n_committed' in hdf5_dataset.attrs and hdf5_dataset.attrs['n_committed'] < len(hdf5_dataset['images']):
+                raise ValueError("The HDF5 dataset at '{}' is incomplete. Resume its creation before appending to it.".format(file_path))
+            image_layout = hdf5_dataset.attrs.get('image_layout', 'flattened')
+            # The 'contiguous' image layout requires all images to have the shape of the images that are already
+            # in the HDF5 dataset. Check the shapes of all images before anything is written, so that a single image
+            # of the wrong size doesn't abort the append halfway. The shapes are read from the image file headers.
+            if image_layout == 'contiguous':
+                if resize:
+                    image_shapes = {(resize[0], resize[1], 3)}
+                else:
+                    image_shapes = {tuple(size) + (3,) for size in self.get_image_sizes()}
+            else:
+                image_shapes = {None}
+            for image_shape in image_shapes:
+                check_hdf5_compatibility(hdf5_dataset=hdf5_dataset,
+                                         image_layout=image_layout,
+                                         has_labels=not (self.labels is None),
+                                         has_image_ids=not (self.image_ids is None),
+                                         has_eval_neutral=not (self.eval_neutral is None),
+                                         image_shape=image_shape)
+
+            offset = len(hdf5_dataset['images'])
+            resize_hdf5_datasets(hdf5_dataset, offset + dataset_size)
+
+            try:
+                self._write_hdf5_items(hdf5_dataset=hdf5_dataset,
+                                       offset=offset,
+                                       start=0,
+                                       resize=resize,
+                                       image_layout=image_layout,
+                                       jpeg_quality=jpeg_quality,
+                                       num_workers=num_workers,
+                                       commit_size=commit_size,
+                                       verbose=verbose)
+            except BaseException:
+                # An append can't be resumed, so shrink the HDF5 dataset back to its original size
+                # rather than leaving it incomplete.
+                resize_hdf5_datasets(hdf5_dataset, offset)
+                if 'n_committed' in hdf5_dataset.attrs:
+                    hdf5_dataset.attrs['n_committed'] = offset
+                raise
+
+            update_variable_image_size(hdf5_dataset)
+        finally:
+            hdf5_dataset.close()
+
+        # Switch over to the extended dataset.
+        self.hdf5_dataset_path = file_path
+        self.filenames = None
+        self.images = None
+        self.labels = None
+        self.image_ids = None
+        self.eval_neutral = None
+        self.load_hdf5_dataset(verbose=verbose)
+
+    def create_memmap_dataset(self,
+                              dataset_dir,
+                              resize=False,
+                              shard_size=2**30,
+                              num_workers=0,
+                              verbose=True):
+        '''
+        Converts the currently loaded dataset into a memory-mapped dataset, an alternative to an HDF5
+        dataset that suits reading from many worker processes.
+
+        The dataset is a directory that contains:
+        1) Binary shard files 'images_00000.bin', 'images_00001.bin', etc. that contain the decoded
+           three-channel images as raw `uint8` pixels, one image after another.
+        2) 'image_index.npy', an array of shape `(dataset_size, 5)` that contains for each image the
+           number of its shard, its byte offset within the shard, and its height, width and channels.
+        3) 'labels.npy', the labels of all images concatenated into one array, and 'label_offsets.npy',
+           an array of length `dataset_size + 1` so that the labels of image `i` are the rows
+           `label_offsets[i]:label_offsets[i+1]`.
+        4) 'eval_neutral.npy' with the evaluation-neutrality annotations of all images concatenated in
+           the same way as the labels, and 'image_ids.npy' with the image IDs.
+        5) 'dataset.json', which records which of the above the dataset contains.
+
+        The shards are mapped into memory with `np.memmap`, so the images of a batch are read as views
+        straight from the OS page cache. Unlike HDF5 file handles, memory maps survive `fork()` and
+        reads do not go through a global lock, so any number of worker processes can read from the
+        same dataset concurrently.
+
+        The created dataset will be used right away.
+
+        Arguments:
+            dataset_dir (str): The directory in which to store the dataset. Will be created if it
+                doesn't exist. You can load this dataset via the `DataGenerator` constructor in the future.
+            resize (tuple, optional): `False` or a 2-tuple `(height, width)` that represents the
+                target size for the images. All images in the dataset will be resized to this
+                target size before they will be written to the shards. If `False`, no resizing
+                will be performed.
+            shard_size (int, optional): The maximal size of a shard file in bytes. An image that is
+                larger than this gets a shard of its own.
+            num_workers (int, optional): The number of worker processes that load and resize the images.
+                If 0, this is all done in the calling process.
+            verbose (bool, optional): Whether or not prit out the progress of the dataset creation.
+
+        Returns:
+            None.
+        '''
+
+        dataset_size = len(self.filenames)
+
+        if not os.path.isdir(dataset_dir):
+            os.makedirs(dataset_dir)
+
+        image_index = np.zeros((dataset_size, 5), dtype=np.int64)
+
+        tasks = [(filename, resize, 'contiguous', None) for filename in self.filenames]
+        if num_workers > 0:
+            pool = get_multiprocessing_context().Pool(processes=num_workers,
+                                                      initializer=init_hdf5_worker,
+                                                      initargs=(self,))
+            images = pool.imap(prepare_hdf5_image, tasks, chunksize=16)
         else:
-            hdf5_dataset.attrs.create(name='variable_image_size', data=False, shape=None, dtype=np.bool_)
-
-        # Create the dataset in which the images will be stored as flattened arrays.
-        # This allows us, among other things, to store images of variable size.
-        hdf5_images = hdf5_dataset.create_dataset(name='images',
-                                                  shape=(dataset_size,),
-                                                  maxshape=(None),
-                                                  dtype=h5py.special_dtype(vlen=np.uint8))
-
-        # Create the dataset that will hold the image heights, widths and channels that
-        # we need in order to reconstruct the images from the flattened arrays later.
-        hdf5_image_shapes = hdf5_dataset.create_dataset(name='image_shapes',
-                                                        shape=(dataset_size, 3),
-                                                        maxshape=(None, 3),
-                                                        dtype=np.int32)
+            pool = None
+            images = (self._prepare_hdf5_image(*task) for task in tasks)
+
+        if verbose:
+            images = tqdm(images, total=dataset_size, desc='Creating memory-mapped dataset', file=sys.stdout)
+
+        shard = -1
+        shard_file = None
+        offset = 0
+
+        try:
+            for i, (image, image_shape) in enumerate(images):
+                # Start a new shard if this image doesn't fit into the current one anymore.
+                if (shard_file is None) or ((offset > 0) and (offset + image.nbytes > shard_size)):
+                    if not (shard_file is None):
+                        shard_file.close()
+                    shard += 1
+                    shard_file = open(os.path.join(dataset_dir, 'images_{:05d}.bin'.format(shard)), 'wb')
+                    offset = 0
+                shard_file.write(np.ascontiguousarray(image).tobytes())
+                image_index[i] = (shard, offset) + tuple(image_shape)
+                offset += image.nbytes
+        finally:
+            if not (shard_file is None):
+                shard_file.close()
+            if not (pool is None):
+                pool.terminate()
+                pool.join()
+
+        np.save(os.path.join(dataset_dir, 'image_index.npy'), image_index)
+
+        if not ((self.labels is None) and (self.eval_neutral is None)):
+            # All labels are concatenated into one array, so we need to know where the labels of each image begin.
+            if not (self.labels is None):
+                num_boxes = LabelStore.from_labels(self.labels, num_columns=len(self.labels_output_format)).get_num_boxes()
+            else:
+                num_boxes = [len(eval_neutral) for eval_neutral in self.eval_neutral]
+            label_offsets = np.zeros(dataset_size + 1, dtype=np.int64)
+            label_offsets[1:] = np.cumsum(num_boxes)
+            np.save(os.path.join(dataset_dir, 'label_offsets.npy'), label_offsets)
 
         if not (self.labels is None):
+            labels = LabelStore.from_labels(self.labels, num_columns=len(self.labels_output_format))
+            np.save(os.path.join(dataset_dir, 'labels.npy'), labels.boxes.astype(np.int32))
 
-            # Create the dataset in which the labels will be stored as flattened arrays.
-            hdf5_labels = hdf5_dataset.create_dataset(name='labels',
-                                                      shape=(dataset_size,),
-                                                      maxshape=(None),
-                                                      dtype=h5py.special_dtype(vlen=np.int32))
-
-            # Create the dataset that will hold the dimensions of the labels arrays for
-            # each image so that we can restore the labels from the flattened arrays later.
-            hdf5_label_shapes = hdf5_dataset.create_dataset(name='label_shapes',
-                                                            shape=(dataset_size, 2),
-                                                            maxshape=(None, 2),
-                                                            dtype=np.int32)
+        if not (self.image_ids is None):
+            np.save(os.path.join(dataset_dir, 'image_ids.npy'), np.array([str(image_id) for image_id in self.image_ids]))
 
-            hdf5_dataset.attrs.modify(name='has_labels', value=True)
+        if not (self.eval_neutral is None):
+            eval_neutral = np.concatenate([np.asarray(eval_neutral, dtype=np.bool_).reshape(-1) for eval_neutral in self.eval_neutral] + [np.zeros(0, dtype=np.bool_)])
+            np.save(os.path.join(dataset_dir, 'eval_neutral.npy'), eval_neutral)
+
+        # Write the description last so that an incomplete dataset can't be loaded.
+        meta = {'dataset_size': dataset_size,
+                'num_shards': shard + 1,
+                'has_labels': not (self.labels is None),
+                'has_image_ids': not (self.image_ids is None),
+                'has_eval_neutral': not (self.eval_neutral is None),
+                'variable_image_size': bool(np.any(image_index[:,2:] != image_index[:1,2:]))}
+        with open(os.path.join(dataset_dir, 'dataset.json'), 'w') as f:
+            json.dump(meta, f)
+
+        self.memmap_dataset_dir = dataset_dir
+        self.memmap_index = image_index
+        self.memmap_shards = {}
+        self._clear_image_cache() # The images may have been resized.
+        self.dataset_size = dataset_size
+        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
 
-        if not (self.image_ids is None):
+    def _read_memmap_image(self, i):
+        '''
+        Returns image `i` of the memory-mapped dataset as a read-only view into its shard.
+        The shard is mapped into memory if it hasn't been yet.
 
-            hdf5_image_ids = hdf5_dataset.create_dataset(name='image_ids',
-                                                         shape=(dataset_size,),
-                                                         maxshape=(None),
-                                                         dtype=h5py.special_dtype(vlen=str))
+        Arguments:
+            i (int): The dataset index of the image.
 
-            hdf5_dataset.attrs.modify(name='has_image_ids', value=True)
+        Returns:
+            The image as a read-only Numpy array of data type `uint8`.
+        '''
+        shard, offset, height, width, channels = self.memmap_index[i]
+        if not shard in self.memmap_shards:
+            self.memmap_shards[shard] = np.memmap(os.path.join(self.memmap_dataset_dir, 'images_{:05d}.bin'.format(shard)), dtype=np.uint8, mode='r')
+        return self.memmap_shards[shard][offset:offset+height*width*channels].reshape(height, width, channels)
+
+    def _write_hdf5_items(self,
+                          hdf5_dataset,
+                          offset,
+                          start,
+                          resize,
+                          image_layout,
+                          jpeg_quality,
+                          num_workers,
+                          commit_size,
+                          verbose):
+        '''
+        Writes the images and annotations of the currently loaded dataset, starting at item `start`,
+        to an HDF5 file whose datasets have already been created with sufficient size. Item `i` of
+        the currently loaded dataset is written to position `offset + i` of the HDF5 datasets.
+
+        The images are loaded in chunks of `commit_size` items, either in this process or in a pool
+        of worker processes. After each chunk has been written, the file is flushed and its attribute
+        'n_committed' is set to the number of items that have been written to it completely.
+
+        All other arguments are as described in the documentation of `create_hdf5_dataset()`.
+
+        Returns:
+            None.
+        '''
+
+        dataset_size = len(self.filenames)
 
+        hdf5_images = hdf5_dataset['images']
+        hdf5_image_shapes = hdf5_dataset['image_shapes']
+        if not (self.labels is None):
+            hdf5_labels = hdf5_dataset['labels']
+            hdf5_label_shapes = hdf5_dataset['label_shapes']
+        if not (self.image_ids is None):
+            hdf5_image_ids = hdf5_dataset['image_ids']
         if not (self.eval_neutral is None):
+            hdf5_eval_neutral = hdf5_dataset['eval_neutral']
 
-            # Create the dataset in which the labels will be stored as flattened arrays.
-            hdf5_eval_neutral = hdf5_dataset.create_dataset(name='eval_neutral',
-                                                            shape=(dataset_size,),
-                                                            maxshape=(None),
-                                                            dtype=h5py.special_dtype(vlen=np.bool_))
+        chunks = [(chunk_start, min(chunk_start + commit_size, dataset_size)) for chunk_start in range(start, dataset_size, commit_size)]
 
-            hdf5_dataset.attrs.modify(name='has_eval_neutral', value=True)
+        def get_tasks(chunk):
+            return [(self.filenames[i], resize, image_layout, jpeg_quality) for i in range(*chunk)]
 
         if verbose:
-            tr = trange(dataset_size, desc='Creating HDF5 dataset', file=sys.stdout)
+            progress = tqdm(total=dataset_size, initial=start, desc='Creating HDF5 dataset', file=sys.stdout)
+
+        if (num_workers > 0) and chunks:
+            pool = get_multiprocessing_context().Pool(processes=num_workers,
+                                                      initializer=init_hdf5_worker,
+                                                      initargs=(self,))
+            # While one chunk is being written, the workers already prepare the next one.
+            next_images = pool.map_async(prepare_hdf5_image, get_tasks(chunks[0]))
         else:
-            tr = range(dataset_size)
+            pool = None
 
-        # Iterate over all images in the dataset.
-        for i in tr:
+        try:
+            for k, chunk in enumerate(chunks):
 
-            # Store the image.
-            with Image.open(self.filenames[i]) as image:
+                if pool is None:
+                    images = (self._prepare_hdf5_image(*task) for task in get_tasks(chunk))
+                else:
+                    images = next_images.get()
+                    if k + 1 < len(chunks):
+                        next_images = pool.map_async(prepare_hdf5_image, get_tasks(chunks[k + 1]))
 
-                image = np.asarray(image, dtype=np.uint8)
+                # Iterate over all images in this chunk.
+                for i, (image, image_shape) in zip(range(*chunk), images):
 
-                # Make sure all images end up having three channels.
-                if image.ndim == 2:
-                    image = np.stack([image] * 3, axis=-1)
-                elif image.ndim == 3:
-                    if image.shape[2] == 1:
-                        image = np.concatenate([image] * 3, axis=-1)
-                    elif image.shape[2] == 4:
-                        image = image[:,:,:3]
+                    j = offset + i
 
-                if resize:
-                    image = cv2.resize(image, dsize=(resize[1], resize[0]))
+                    # Store the image.
+                    if (image_layout == 'contiguous') and (image_shape != hdf5_images.shape[1:]):
+                        raise ValueError("The 'contiguous' image layout requires all images to have the same size, but image '{}' has shape {} while the images dataset has shape {}. ".format(self.filenames[i], image_shape, hdf5_images.shape) +
+                                         "Pass `resize` to make all images the same size.")
+                    hdf5_images[j] = image
+                    # Write the image's shape to the image shapes dataset.
+                    hdf5_image_shapes[j] = image_shape
 
-                # Flatten the image array and write it to the images dataset.
-                hdf5_images[i] = image.reshape(-1)
-                # Write the image's shape to the image shapes dataset.
-                hdf5_image_shapes[i] = image.shape
+                    # Store the ground truth if we have any.
+                    if not (self.labels is None):
 
-            # Store the ground truth if we have any.
-            if not (self.labels is None):
+                        labels = np.asarray(self.labels[i])
+                        # Flatten the labels array and write it to the labels dataset.
+                        hdf5_labels[j] = labels.reshape(-1)
+                        # Write the labels' shape to the label shapes dataset.
+                        hdf5_label_shapes[j] = labels.shape
 
-                labels = np.asarray(self.labels[i])
-                # Flatten the labels array and write it to the labels dataset.
-                hdf5_labels[i] = labels.reshape(-1)
-                # Write the labels' shape to the label shapes dataset.
-                hdf5_label_shapes[i] = labels.shape
+                    # Store the image ID if we have one.
+                    if not (self.image_ids is None):
 
-            # Store the image ID if we have one.
-            if not (self.image_ids is None):
+                        hdf5_image_ids[j] = self.image_ids[i]
 
-                hdf5_image_ids[i] = self.image_ids[i]
+                    # Store the evaluation-neutrality annotations if we have any.
+                    if not (self.eval_neutral is None):
 
-            # Store the evaluation-neutrality annotations if we have any.
-            if not (self.eval_neutral is None):
+                        hdf5_eval_neutral[j] = self.eval_neutral[i]
 
-                hdf5_eval_neutral[i] = self.eval_neutral[i]
+                    if verbose:
+                        progress.update(1)
 
-        hdf5_dataset.close()
-        self.hdf5_dataset = h5py.File(file_path, 'r')
-        self.hdf5_dataset_path = file_path
-        self.dataset_size = len(self.hdf5_dataset['images'])
-        self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32) # Instead of shuffling the HDF5 dataset, we will shuffle this index list.
+                # Commit this chunk.
+                hdf5_dataset.attrs['n_committed'] = offset + chunk[1]
+                hdf5_dataset.flush()
+
+        finally:
+            if not (pool is None):
+                pool.terminate()
+                pool.join()
+            if verbose:
+                progress.close()
+
+    def _prepare_hdf5_image(self, filename, resize, image_layout, jpeg_quality):
+        '''
+        Loads an image file and converts it into the form in which it is written to an HDF5 dataset
+        with the given image layout.
+
+        Arguments:
+            filename (str): The full path of the image file.
+            All other arguments are as described in the documentation of `create_hdf5_dataset()`.
+
+        Returns:
+            A 2-tuple containing the image data to be written to the images dataset and the shape of
+            the decoded 3-channel image.
+        '''
+        if image_layout == 'encoded':
+            return self._encode_hdf5_image(filename, resize, jpeg_quality)
+        image = self._load_hdf5_image(filename, resize)
+        if image_layout == 'flattened':
+            return image.reshape(-1), image.shape
+        else:
+            return image, image.shape
+
+    def _load_hdf5_image(self, filename, resize):
+        '''
+        Loads an image file in the form in which `create_hdf5_dataset()` stores it.
+
+        Arguments:
+            filename (str): The full path of the image file.
+            resize (tuple): `False` or a 2-tuple `(height, width)`, the size to resize the image to.
+
+        Returns:
+            The image as a 3-channel Numpy array of data type `uint8`.
+        '''
+        with Image.open(filename) as image:
+            if resize:
+                # JPEG images can be decoded at reduced resolution if they get downsized anyway.
+                image.draft(image.mode, (resize[1], resize[0]))
+            image = np.asarray(image, dtype=np.uint8)
+
+        # Make sure all images end up having three channels.
+        image = self.convert_to_3_channels(image)
+
+        if resize:
+            image = cv2.resize(image, dsize=(resize[1], resize[0]))
+
+        return image
+
+    def _encode_hdf5_image(self, filename, resize, jpeg_quality):
+        '''
+        Encodes an image file in the form in which `create_hdf5_dataset()` stores it for
+        the 'encoded' image layout.
+
+        Arguments:
+            filename (str): The full path of the image file.
+            resize (tuple): `False` or a 2-tuple `(height, width)`, the size to resize the image to.
+            jpeg_quality (int): The JPEG quality with which a resized image is encoded.
+
+        Returns:
+            A 2-tuple containing the encoded image as a 1D Numpy array of data type `uint8`
+            and the shape of the decoded 3-channel image.
+        '''
+        if resize:
+            image = self._load_hdf5_image(filename, resize)
+            buffer = io.BytesIO()
+            Image.fromarray(image).save(buffer, format='JPEG', quality=jpeg_quality)
+            return np.frombuffer(buffer.getvalue(), dtype=np.uint8), image.shape
+        else:
+            # Store the original file, we only need to open its header to get the image size.
+            with open(filename, 'rb') as f:
+                image_bytes = np.frombuffer(f.read(), dtype=np.uint8)
+            with Image.open(filename) as image:
+                width, height = image.size
+            return image_bytes, (height, width, 3)
+
+    def _decode_hdf5_image(self, image_bytes):
+        '''
+        Decodes an image that is stored in an HDF5 dataset with the 'encoded' image layout.
+
+        Arguments:
+            image_bytes (array): The encoded image as a 1D Numpy array of data type `uint8`.
+
+        Returns:
+            The decoded image as a 3-channel Numpy array of data type `uint8`.
+        '''
+        with Image.open(io.BytesIO(image_bytes.tobytes())) as image:
+            image = np.array(image, dtype=np.uint8)
+        return self.convert_to_3_channels(image)
+
+    def _read_hdf5_image(self, i):
+        '''
+        Reads a single image from the HDF5 dataset.
+
+        Arguments:
+            i (int): The dataset index of the image.
+
+        Returns:
+            The image as a Numpy array of data type `uint8`.
+        '''
+        if self.hdf5_image_layout == 'encoded':
+            return self._decode_hdf5_image(self.hdf5_dataset['images'][i])
+        else:
+            return self.hdf5_dataset['images'][i].reshape(self.hdf5_dataset['image_shapes'][i])
 
     def generate(self,
                  batch_size=32,
@@ -834,7 +1797,16 @@ class DataGenerator:
                  label_encoder=None,
                  returns={'processed_images', 'encoded_labels'},
                  keep_images_without_gt=False,
-                 degenerate_box_handling='remove'):
+                 degenerate_box_handling='remove',
+                 num_workers=0,
+                 max_queue_size=None,
+                 shared_memory=False,
+                 num_decoding_threads=0,
+                 decode_size=None,
+                 batch_sampler=None,
+                 initial_state=None,
+                 stats=None,
+                 num_batch_buffers=0):
         '''
         Generates batches of samples and (optionally) corresponding labels indefinitely.
 
@@ -901,6 +1873,60 @@ class DataGenerator:
                 transformations have been applied (if any), but before the labels were passed to the `label_encoder` (if one was given).
                 Can be one of 'warn' or 'remove'. If 'warn', the generator will merely print a warning to let you know that there
                 are degenerate boxes in a batch. If 'remove', the generator will remove degenerate boxes from the batch silently.
+            num_workers (int, optional): The number of worker processes that produce batches in parallel. If 0, all batches
+                are produced in the calling process. If greater than 0, the loading, transformation and encoding of the batches
+                is distributed over a pool of worker processes, while the batches are still yielded in the same deterministic
+                order in which they would have been produced by a single process. Each batch is produced with its own random seed
+                that is drawn in the calling process, so the batches are reproducible via `np.random.seed()`, but they are not
+                identical to the batches that `num_workers = 0` produces. The worker processes are forked if the platform supports
+                it, otherwise the data generator, the transformations and the label encoder must be picklable.
+            max_queue_size (int, optional): Only relevant if `num_workers > 0`. The maximal number of batches that are being
+                produced in advance. If `None`, defaults to `2 * num_workers`.
+            shared_memory (bool, optional): Only relevant if `num_workers > 0`. If `True`, the worker processes write the
+                processed images and the encoded labels into a ring buffer of `max_queue_size + 1` preallocated batch slots
+                in shared memory instead of sending them back through a pipe, which avoids pickling and copying these large
+                arrays. The yielded 'processed_images' and 'encoded_labels' are then Numpy views into this buffer that
+                remain valid only until the next batch is requested, so copy them if you need to keep them longer. In particular,
+                this means that Keras must consume the generator directly, i.e. with `workers=0` in `fit_generator()`, since Keras'
+                own enqueuer would request further batches while it still holds on to earlier ones. Requires that all processed
+                images and all encoded labels have the same shape. The shapes are taken from the first batch, which is produced
+                in the calling process.
+            num_decoding_threads (int, optional): Only relevant if `num_workers == 0` and the images are loaded from their
+                individual files on disk, i.e. neither from memory nor from an HDF5 dataset. If greater than 0, the image files
+                of each batch are decoded concurrently by this many threads, and the files of the next batch are decoded while
+                the current batch is being transformed and encoded. This speeds up the I/O-bound portion of the batch production.
+            decode_size (tuple or str, optional): Only relevant if the images are loaded from their individual files on disk.
+                `None`, 'auto', or a 2-tuple `(height, width)`. If a size is given, JPEG images are decoded at the smallest
+                reduced scale (1/2, 1/4, or 1/8) at which they are still at least as large as this size, which is several
+                times faster than decoding them at full resolution if they are much larger than that. The labels are scaled
+                accordingly, and if 'inverse_transform' is among the returns, the inverse transforms scale predictions back
+                to the original image size. This only makes sense if the transformations downsize the images to (at most)
+                this size anyway. If 'auto', the size is taken from the transformations if they begin with a `Resize` or
+                `ResizeRandomInterp` transformation, possibly preceded by photometric transformations, and no images are
+                decoded at reduced scale otherwise. The decoded-image cache is not used for images that are decoded at
+                reduced scale. The 'original_images' and 'original_labels' returns are always at the original resolution,
+                so images that were decoded at reduced scale are decoded a second time if 'original_images' is requested.
+            batch_sampler (BatchSampler, optional): A batch sampler from `object_detection_2d_samplers` that determines
+                which items make up each batch, e.g. an `AspectRatioBucketSampler`. If given, `batch_size` and `shuffle`
+                are ignored in favor of the sampler's own settings.
+            initial_state (dict, optional): A generator state as returned by `get_generator_state()` or
+                `load_generator_state()`. If given, the generator resumes right after the batch that the state belongs
+                to instead of starting at the beginning of the dataset, with the same order of the dataset and the same
+                state of Numpy's global random number generator. This requires the same dataset, batch size, shuffling,
+                and batch sampler as the generator that produced the state, and the same mode of production, i.e. the
+                same `num_workers`, `max_queue_size`, and `num_decoding_threads`. The resumed generator then yields exactly
+                the batches that the original generator would have yielded.
+            stats (PipelineStats, optional): A `PipelineStats` object from `object_detection_2d_pipeline_stats` that
+                records the time spent in each stage of the batch production and in each transformation, the bytes of
+                image data read, and the number of images produced per second. If `None`, nothing is recorded.
+            num_batch_buffers (int, optional): Only relevant if `num_workers == 0`. If greater than 0, the processed images
+                of each batch are stacked into one of this many preallocated batch arrays, which are used in turn, instead of
+                into a newly allocated array. The same goes for the encoded labels and the matched anchors if the label encoder
+                is an `SSDInputEncoder`. The yielded arrays are then only valid until this many further
+                batches have been requested, so copy them if you need to keep them longer. With 2 buffers, a batch stays valid
+                while the next batch is being produced. If Keras consumes the generator with a queue, e.g. `workers > 0` in
+                `fit_generator()`, this must be at least `max_queue_size + 2`. This is only effective if all processed images
+                have the same shape.
 
         Yields:
             The next batch as a tuple of items as defined by the `returns` argument.
@@ -909,6 +1935,223 @@ class DataGenerator:
         if self.dataset_size == 0:
             raise DatasetError("Cannot generate batches because you did not load a dataset.")
 
+        processing_kwargs = self._get_processing_kwargs(transformations=transformations,
+                                                        label_encoder=label_encoder,
+                                                        returns=returns,
+                                                        keep_images_without_gt=keep_images_without_gt,
+                                                        degenerate_box_handling=degenerate_box_handling,
+                                                        decode_size=decode_size,
+                                                        stats=stats)
+        if (num_batch_buffers > 0) and (num_workers == 0):
+            processing_kwargs['batch_buffers'] = BatchBufferPool(num_batch_buffers)
+
+        #############################################################################################
+        # Do a few preparatory things like maybe shuffling the dataset initially.
+        #############################################################################################
+
+        if not (batch_sampler is None):
+            batch_size = batch_sampler.batch_size
+
+        if not (stats is None):
+            stats.start()
+
+        if not (initial_state is None):
+            self._check_generator_state(initial_state, batch_size, batch_sampler)
+            if batch_sampler is None:
+                self.dataset_indices = initial_state['dataset_indices']
+            np.random.set_state(initial_state['random_state'])
+            epoch, position, num_batches = initial_state['epoch'], initial_state['position'], initial_state['num_batches']
+        else:
+            if (batch_sampler is None) and shuffle:
+                self._shuffle_dataset()
+            epoch, position, num_batches = 0, 0, 0
+
+        #############################################################################################
+        # Generate mini batches.
+        #############################################################################################
+
+        if batch_sampler is None:
+            epoch_batches = None
+            batches = self._batch_items(batch_size, shuffle, epoch, position)
+        else:
+            # The batches of the first epoch are sampled right away so that they are part of the initial state.
+            epoch_batches = batch_sampler.get_epoch_batches(epoch) if (initial_state is None) else initial_state['epoch_batches']
+            batches = self._sample_batch_items(batch_sampler, epoch, position, epoch_batches)
+
+        # The history starts with the state before the first batch, from which a generator can resume, too.
+        self.generator_states = deque(maxlen=GENERATOR_STATE_HISTORY_SIZE + 1)
+        self.generator_states.append({'epoch': epoch,
+                                      'position': position,
+                                      'dataset_indices': self.dataset_indices if (batch_sampler is None) else None,
+                                      'epoch_batches': epoch_batches,
+                                      'dataset_size': self.dataset_size,
+                                      'batch_size': batch_size,
+                                      'num_batches': num_batches,
+                                      'random_state': np.random.get_state()})
+        self.generator_start = num_batches
+
+        # Keep track of the positions of the batches that have been requested but not yet yielded along
+        # with the state of the random number generator right after each of them was requested.
+        # Depending on the mode of production, several batches may be requested in advance.
+        pending_states = deque()
+        def track_states(batches):
+            for batch in batches:
+                pending_states.append((self.batch_state, np.random.get_state()))
+                yield batch
+        batches = track_states(batches)
+
+        if num_workers > 0:
+            if max_queue_size is None:
+                max_queue_size = 2 * num_workers
+            for ret in parallel_batches(data_generator=self,
+                                        batches=batches,
+                                        processing_kwargs=processing_kwargs,
+                                        num_workers=num_workers,
+                                        max_queue_size=max_queue_size,
+                                        batch_size=batch_size,
+                                        shared_memory=shared_memory):
+                num_batches = self._record_generator_state(pending_states, num_batches, produced_in_process=False)
+                yield ret
+        elif (num_decoding_threads > 0) and self._reads_image_files():
+            for batch, batch_X, batch_decode_scales in self._prefetch_image_files(batches, num_decoding_threads, processing_kwargs['decode_size'], stats):
+                ret = self._produce_batch(*batch, batch_X=batch_X, batch_decode_scales=batch_decode_scales, **processing_kwargs)
+                num_batches = self._record_generator_state(pending_states, num_batches, produced_in_process=True)
+                yield ret
+        else:
+            for batch in batches:
+                ret = self._produce_batch(*batch, **processing_kwargs)
+                num_batches = self._record_generator_state(pending_states, num_batches, produced_in_process=True)
+                yield ret
+
+    def _record_generator_state(self, pending_states, num_batches, produced_in_process):
+        '''
+        Records the state of the generator after a batch has been produced, right before it is yielded,
+        such that a resumed generator goes through the same sequence of random numbers from there on.
+
+        Arguments:
+            pending_states (deque): The positions of the requested batches that haven't been yielded yet as
+                recorded by `_batch_items()` or `_sample_batch_items()`, each along with the state of the random
+                number generator right after the batch was requested. The first one belongs to the batch that
+                is about to be yielded and is removed.
+            num_batches (int): The number of batches that had been yielded before this batch.
+            produced_in_process (bool): Whether the batches are produced, i.e. transformed, in this process.
+
+        Returns:
+            The number of batches that have been yielded including this batch.
+        '''
+        batch_state, _ = pending_states.popleft()
+        if pending_states:
+            # The next batch has been requested already, so its position is known, and since the resumed
+            # generator starts right at it, requesting it again doesn't use any random numbers.
+            state, random_state = pending_states[0]
+            state = dict(state)
+            if produced_in_process:
+                # This batch was transformed after the next batch was requested.
+                random_state = np.random.get_state()
+        else:
+            state = dict(batch_state)
+            if state['epoch_batches'] is None:
+                state['position'] += state['batch_size']
+            else:
+                state['position'] += 1
+            random_state = np.random.get_state()
+        state['num_batches'] = num_batches + 1
+        state['random_state'] = random_state
+        self.generator_states.append(state)
+        return num_batches + 1
+
+    def _check_generator_state(self, state, batch_size, batch_sampler):
+        '''
+        Raises a `ValueError` if a generator state can't be resumed with the given dataset and settings.
+        '''
+        if state['dataset_size'] != self.dataset_size:
+            raise ValueError("The generator state belongs to a dataset of {} images, but the current dataset contains {} images.".format(state['dataset_size'], self.dataset_size))
+        if state['batch_size'] != batch_size:
+            raise ValueError("The generator state belongs to a generator with batch size {}, but the batch size is {}.".format(state['batch_size'], batch_size))
+        if (state['epoch_batches'] is None) != (batch_sampler is None):
+            raise ValueError("A generator state can only be resumed by a generator that uses a batch sampler if and only if the original generator did.")
+
+    def get_generator_state(self, num_batches=None):
+        '''
+        Returns the state of the most recently started generator of `generate()` after a given batch, from which
+        a new generator can resume with its `initial_state` argument, e.g. after the training was interrupted.
+
+        The states of the last `GENERATOR_STATE_HISTORY_SIZE` yielded batches are available, so that the state
+        of the last batch that was actually trained on can be retrieved even if the consumer of the generator
+        has requested further batches in advance. Until the generator has yielded that many batches, its
+        initial state is available, too.
+
+        Arguments:
+            num_batches (int, optional): The number of batches that the generator had yielded since it was started.
+                If `0`, the state before the first batch is returned. If `None`, the state after the most recently
+                yielded batch is returned.
+
+        Returns:
+            The generator state as a dictionary. It contains the epoch, the position of the next batch within the
+            epoch, the order of the dataset or the batches of the epoch, the state of Numpy's global random number
+            generator, and the total number of yielded batches including those before a resumption.
+        '''
+        if len(self.generator_states) == 0:
+            raise ValueError("There is no generator state, since no generator has been started yet.")
+        if num_batches is None:
+            return self.generator_states[-1]
+        if num_batches < 0:
+            raise ValueError("`num_batches` must be non-negative, but is {}.".format(num_batches))
+        # The states are consecutive, so the state after a given batch can be looked up by its number.
+        i = self.generator_start + num_batches - self.generator_states[0]['num_batches']
+        if not (0 <= i < len(self.generator_states)):
+            raise ValueError("The generator state after batch {} is not available anymore or doesn't exist yet.".format(num_batches))
+        return self.generator_states[i]
+
+    def save_generator_state(self, file_path, num_batches=None):
+        '''
+        Saves a generator state as returned by `get_generator_state()` to a pickled file.
+
+        Arguments:
+            file_path (str): The path of the file to save the state to.
+            num_batches (int, optional): As described for `get_generator_state()`.
+
+        Returns:
+            None.
+        '''
+        state = self.get_generator_state(num_batches)
+        # Write to a temporary file first so that an interruption doesn't leave a corrupt state behind.
+        temp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, file_path)
+
+    @staticmethod
+    def load_generator_state(file_path):
+        '''
+        Loads a generator state that was saved by `save_generator_state()`.
+
+        Arguments:
+            file_path (str): The path of the file that contains the state.
+
+        Returns:
+            The generator state, which can be passed to `generate()` as `initial_state`.
+        '''
+        with open(file_path, 'rb') as f:
+            return pickle.load(f)
+
+    def _get_processing_kwargs(self,
+                               transformations,
+                               label_encoder,
+                               returns,
+                               keep_images_without_gt,
+                               degenerate_box_handling,
+                               decode_size=None,
+                               stats=None):
+        '''
+        Warns about impossible returns, prepares the transformations and returns the keyword
+        arguments of `_produce_batch()` that are the same for every batch. All arguments are
+        as described in the documentation of `generate()`.
+
+        Returns:
+            A dictionary with the batch-independent keyword arguments of `_produce_batch()`.
+        '''
+
         #############################################################################################
         # Warn if any of the set returns aren't possible.
         #############################################################################################
@@ -927,251 +2170,700 @@ class DataGenerator:
                               "but you set `returns = {}`. The impossible returns will be `None`.".format(returns))
 
         #############################################################################################
-        # Do a few preparatory things like maybe shuffling the dataset initially.
+        # Prepare the processing of the batches.
         #############################################################################################
 
-        if shuffle:
-            objects_to_shuffle = [self.dataset_indices]
-            if not (self.filenames is None):
-                objects_to_shuffle.append(self.filenames)
-            if not (self.labels is None):
-                objects_to_shuffle.append(self.labels)
-            if not (self.image_ids is None):
-                objects_to_shuffle.append(self.image_ids)
-            if not (self.eval_neutral is None):
-                objects_to_shuffle.append(self.eval_neutral)
-            shuffled_objects = sklearn.utils.shuffle(*objects_to_shuffle)
-            for i in range(len(objects_to_shuffle)):
-                objects_to_shuffle[i][:] = shuffled_objects[i]
-
         if degenerate_box_handling == 'remove':
             box_filter = BoxFilter(check_overlap=False,
                                    check_min_area=False,
                                    check_degenerate=True,
                                    labels_format=self.labels_format)
+        else:
+            box_filter = None
+
+        transform_plan = self._compile_transformations(transformations, return_inverters=('inverse_transform' in returns))
+
+        if decode_size == 'auto':
+            decode_size = self._infer_decode_size(transformations)
+
+        return {'transform_plan': transform_plan,
+                'label_encoder': label_encoder,
+                'returns': returns,
+                'keep_images_without_gt': keep_images_without_gt,
+                'degenerate_box_handling': degenerate_box_handling,
+                'box_filter': box_filter,
+                'decode_size': decode_size,
+                'stats': stats}
 
-        # Override the labels formats of all the transformations to make sure they are set correctly.
+    def _compile_transformations(self, transformations, return_inverters):
+        '''
+        Resolves everything about the transformations that is the same for every image once, so that
+        applying them to an image comes down to calling them one after the other: Overrides the labels
+        formats of the transformations to make sure they are set correctly and determines which of the
+        transformations are to return an inverter function.
+
+        Arguments:
+            transformations (list): The transformations as passed to `generate()`.
+            return_inverters (bool): Whether the inverter functions of the transformations are needed.
+
+        Returns:
+            A list that contains for each transformation a 3-tuple `(position, transform, return_inverter)`,
+            where `position` is the position of the transformation in `transformations` and `return_inverter`
+            is `True` if the transformation is to be called with `return_inverter=True`.
+        '''
         if not (self.labels is None):
             for transform in transformations:
                 transform.labels_format = self.labels_format
 
-        #############################################################################################
-        # Generate mini batches.
-        #############################################################################################
+        return [(position, transform, return_inverters and supports_inverter(transform))
+                for position, transform in enumerate(transformations)]
 
-        current = 0
+    def _infer_decode_size(self, transformations):
+        '''
+        Infers the size at which images can be decoded from the transformations that will be
+        applied to them, i.e. the output size of a resizing transformation at the beginning of
+        the transformations. Photometric transformations before it don't matter, since they act
+        on each pixel independently of its position.
 
-        while True:
+        Arguments:
+            transformations (list): The transformations as passed to `generate()`.
+
+        Returns:
+            The decode size as a 2-tuple `(height, width)` or `None` if the transformations
+            don't begin by resizing the images.
+        '''
+        for transform in transformations:
+            if isinstance(transform, Resize):
+                return (transform.out_height, transform.out_width)
+            elif isinstance(transform, ResizeRandomInterp):
+                return (transform.height, transform.width)
+            elif not isinstance(transform, POINTWISE_TRANSFORMATIONS):
+                return None
+        return None
+
+    def _shuffle_dataset(self):
+        '''
+        Shuffles the dataset by permuting `dataset_indices`. The file names, labels, image IDs,
+        and evaluation-neutrality annotations are not reordered, they are always looked up through
+        the dataset indices, so shuffling takes no more than a permutation of an integer array.
 
-            batch_X, batch_y = [], []
+        `dataset_indices` is replaced by a new array rather than permuted in place, so that batch
+        indices that are views into the previous array remain valid.
+
+        Returns:
+            None.
+        '''
+        permutation = sklearn.utils.shuffle(np.arange(self.dataset_size))
+        self.dataset_indices = self.dataset_indices[permutation]
+
+    def _batch_items(self, batch_size, shuffle, epoch=0, position=0):
+        '''
+        Indefinitely walks through the dataset and yields the items that make up each batch,
+        maybe shuffling the dataset after each complete pass.
+
+        Along with each batch, its position is recorded in `batch_state`, from which the walk
+        can be resumed.
+
+        Arguments:
+            batch_size (int): The size of the batches.
+            shuffle (bool): Whether or not to shuffle the dataset after each complete pass.
+            epoch (int, optional): The number of the complete pass to start in.
+            position (int, optional): The position in `dataset_indices` to start at.
+
+        Yields:
+            A 5-tuple containing the dataset indices, file names, labels, image IDs, and
+            evaluation-neutrality annotations of the items in the next batch. All but the
+            first element may be `None` if the respective data is not available.
+        '''
+
+        current = position
+
+        while True:
 
             if current >= self.dataset_size:
                 current = 0
+                epoch += 1
 
             #########################################################################################
             # Maybe shuffle the dataset if a full pass over the dataset has finished.
             #########################################################################################
 
                 if shuffle:
-                    objects_to_shuffle = [self.dataset_indices]
-                    if not (self.filenames is None):
-                        objects_to_shuffle.append(self.filenames)
-                    if not (self.labels is None):
-                        objects_to_shuffle.append(self.labels)
-                    if not (self.image_ids is None):
-                        objects_to_shuffle.append(self.image_ids)
-                    if not (self.eval_neutral is None):
-                        objects_to_shuffle.append(self.eval_neutral)
-                    shuffled_objects = sklearn.utils.shuffle(*objects_to_shuffle)
-                    for i in range(len(objects_to_shuffle)):
-                        objects_to_shuffle[i][:] = shuffled_objects[i]
+                    self._shuffle_dataset()
 
-            #########################################################################################
-            # Get the images, (maybe) image IDs, (maybe) labels, etc. for this batch.
-            #########################################################################################
+            self.batch_state = {'epoch': epoch,
+                                'position': current,
+                                'dataset_indices': self.dataset_indices,
+                                'epoch_batches': None,
+                                'dataset_size': self.dataset_size,
+                                'batch_size': batch_size}
 
-            # We prioritize our options in the following order:
-            # 1) If we have the images already loaded in memory, get them from there.
-            # 2) Else, if we have an HDF5 dataset, get the images from there.
-            # 3) Else, if we have neither of the above, we'll have to load the individual image
-            #    files from disk.
-            batch_indices = self.dataset_indices[current:current+batch_size]
-            if not (self.images is None):
-                for i in batch_indices:
-                    batch_X.append(self.images[i])
-                if not (self.filenames is None):
-                    batch_filenames = self.filenames[current:current+batch_size]
+            yield self._get_batch_items(slice(current, current+batch_size))
+
+            current += batch_size
+
+    def _sample_batch_items(self, batch_sampler, epoch=0, position=0, epoch_batches=None):
+        '''
+        Indefinitely yields the items that make up each batch in the order determined by a batch sampler.
+
+        Along with each batch, its position is recorded in `batch_state`, from which the sampling
+        can be resumed.
+
+        Arguments:
+            batch_sampler (BatchSampler): The batch sampler.
+            epoch (int, optional): The epoch to start in.
+            position (int, optional): The index of the batch of the epoch to start at.
+            epoch_batches (list, optional): The batches of the epoch to start in. If `None`, they
+                are drawn from the batch sampler.
+
+        Yields:
+            5-tuples in the format that `_batch_items()` yields.
+        '''
+        while True:
+            if epoch_batches is None:
+                epoch_batches = batch_sampler.get_epoch_batches(epoch)
+            for i in range(position, len(epoch_batches)):
+                self.batch_state = {'epoch': epoch,
+                                    'position': i,
+                                    'dataset_indices': None,
+                                    'epoch_batches': epoch_batches,
+                                    'dataset_size': self.dataset_size,
+                                    'batch_size': batch_sampler.batch_size}
+                yield self._get_items(epoch_batches[i])
+            epoch += 1
+            position = 0
+            epoch_batches = None
+
+    def _get_batch_items(self, positions):
+        '''
+        Returns the items at the given positions of `dataset_indices`, i.e. in the current order of
+        the dataset.
+
+        Arguments:
+            positions (array or slice): The positions of the batch items in `dataset_indices`.
+
+        Returns:
+            A 5-tuple in the format that `_batch_items()` yields.
+        '''
+        return self._get_items(self.dataset_indices[positions])
+
+    def _get_items(self, batch_indices):
+        '''
+        Returns the items with the given dataset indices.
+
+        Arguments:
+            batch_indices (array): The dataset indices of the batch items.
+
+        Returns:
+            A 5-tuple in the format that `_batch_items()` yields.
+        '''
+
+        if not (self.filenames is None):
+            batch_filenames = [self.filenames[i] for i in batch_indices]
+        else:
+            batch_filenames = None
+
+        if not (self.labels is None):
+            batch_y = [self.labels[i] for i in batch_indices]
+        else:
+            batch_y = None
+
+        if not (self.image_ids is None):
+            batch_image_ids = [self.image_ids[i] for i in batch_indices]
+        else:
+            batch_image_ids = None
+
+        if not (self.eval_neutral is None):
+            batch_eval_neutral = [self.eval_neutral[i] for i in batch_indices]
+        else:
+            batch_eval_neutral = None
+
+        return batch_indices, batch_filenames, batch_y, batch_image_ids, batch_eval_neutral
+
+    def _load_image_file(self, filename):
+        '''
+        Loads and decodes a single image file.
+
+        Arguments:
+            filename (str): The full path of the image file.
+
+        Returns:
+            The image as a Numpy array of data type `uint8`.
+        '''
+        with Image.open(filename) as image:
+            return np.array(image, dtype=np.uint8)
+
+    def _load_reduced_image_file(self, filename, decode_size):
+        '''
+        Loads and decodes a single image file at reduced resolution if possible. JPEG images
+        are decoded at the smallest DCT scale at which they are still at least as large as
+        `decode_size`, all other images are decoded at full resolution.
+
+        Arguments:
+            filename (str): The full path of the image file.
+            decode_size (tuple): A 2-tuple `(height, width)`, the minimal size of the decoded image.
+
+        Returns:
+            A 2-tuple containing the image as a Numpy array of data type `uint8` and a 2-tuple
+            `(scale_y, scale_x)` of the factors by which the image was scaled during decoding.
+        '''
+        with Image.open(filename) as image:
+            width, height = image.size
+            image.draft(image.mode, (decode_size[1], decode_size[0]))
+            decoded_width, decoded_height = image.size
+            return np.array(image, dtype=np.uint8), (decoded_height / height, decoded_width / width)
+
+    def _scale_labels(self, labels, scale_y, scale_x, offset=0):
+        '''
+        Scales the box coordinates of the labels of an image, e.g. because the image was decoded
+        at reduced resolution.
+
+        Arguments:
+            labels (array): A 2D Numpy array that contains the labels of the image.
+            scale_y (float): The factor by which to scale the vertical coordinates.
+            scale_x (float): The factor by which to scale the horizontal coordinates.
+            offset (int, optional): The offset of the coordinate columns in `labels` relative to
+                `labels_output_format`, e.g. 1 for predictions, which have a confidence column.
+
+        Returns:
+            A scaled copy of the labels with a floating point data type. The coordinates are not rounded,
+            so that they are only rounded once, by the transformations that follow.
+        '''
+        labels = np.asarray(labels)
+        scaled_labels = np.array(labels, dtype=np.result_type(labels.dtype, np.float32))
+        xmin = self.labels_format['xmin'] + offset
+        ymin = self.labels_format['ymin'] + offset
+        xmax = self.labels_format['xmax'] + offset
+        ymax = self.labels_format['ymax'] + offset
+        if labels.size > 0:
+            scaled_labels[:,[ymin,ymax]] = labels[:,[ymin,ymax]] * scale_y
+            scaled_labels[:,[xmin,xmax]] = labels[:,[xmin,xmax]] * scale_x
+        return scaled_labels
+
+    def _reads_image_files(self):
+        '''
+        Returns whether batches are read from the individual image files, i.e. neither from memory
+        nor from an HDF5 or memory-mapped dataset.
+        '''
+        return (self.images is None) and (self.hdf5_dataset is None) and (self.memmap_index is None)
+
+    def _load_batch_images(self, batch_indices, batch_filenames):
+        '''
+        Loads the images of a batch.
+
+        Arguments:
+            batch_indices (array): The dataset indices of the batch items.
+            batch_filenames (list): The file names of the batch items or `None`.
+
+        Returns:
+            A list containing the images of the batch as Numpy arrays.
+        '''
+        # We prioritize our options in the following order:
+        # 1) If we have the images already loaded in memory, get them from there.
+        # 2) Else, if we have a decoded-image cache, get the images that it contains from there
+        #    and read the others as described below.
+        # 3) Else, read the images from the dataset.
+        if not (self.images is None):
+            return [self.images[i] for i in batch_indices]
+        elif not (self.image_cache is None):
+            batch_X = [self.image_cache.get(i) for i in batch_indices]
+            missing = [j for j, image in enumerate(batch_X) if image is None]
+            if missing:
+                if not (batch_filenames is None):
+                    missing_filenames = [batch_filenames[j] for j in missing]
                 else:
-                    batch_filenames = None
-            elif not (self.hdf5_dataset is None):
-                for i in batch_indices:
-                    batch_X.append(self.hdf5_dataset['images'][i].reshape(self.hdf5_dataset['image_shapes'][i]))
-                if not (self.filenames is None):
-                    batch_filenames = self.filenames[current:current+batch_size]
+                    missing_filenames = None
+                images = self._read_batch_images(np.asarray(batch_indices)[missing], missing_filenames)
+                for j, image in zip(missing, images):
+                    batch_X[j] = self.image_cache.put(batch_indices[j], image)
+            return batch_X
+        else:
+            return self._read_batch_images(batch_indices, batch_filenames)
+
+    def _read_batch_images(self, batch_indices, batch_filenames):
+        '''
+        Reads the images of a batch from the dataset, i.e. from the HDF5 dataset, the memory-mapped
+        dataset, or the image files.
+
+        Arguments:
+            batch_indices (array): The dataset indices of the batch items.
+            batch_filenames (list): The file names of the batch items or `None`.
+
+        Returns:
+            A list containing the images of the batch as Numpy arrays.
+        '''
+        batch_X = []
+        # We prioritize our options in the following order:
+        # 1) If we have an HDF5 dataset, get the images from there.
+        # 2) Else, if we have a memory-mapped dataset, get the images from there.
+        # 3) Else, if we have none of the above, we'll have to load the individual image
+        #    files from disk.
+        if not (self.hdf5_dataset is None):
+            if self.hdf5_image_layout == 'contiguous':
+                # Read the whole batch at once. HDF5 requires the indices of such a read to be strictly increasing,
+                # so every image is read once and then put in place, which takes care of repeated indices, too.
+                unique_indices, inverse = np.unique(batch_indices, return_inverse=True)
+                images = self.hdf5_dataset['images'][unique_indices]
+                if len(unique_indices) < len(batch_indices):
+                    # Give repeated images their own copies, since the transformations may work in place.
+                    images = images[inverse]
+                    batch_X = list(images)
                 else:
-                    batch_filenames = None
+                    batch_X = [images[j] for j in inverse]
             else:
-                batch_filenames = self.filenames[current:current+batch_size]
-                for filename in batch_filenames:
-                    with Image.open(filename) as image:
-                        batch_X.append(np.array(image, dtype=np.uint8))
+                for i in batch_indices:
+                    batch_X.append(self._read_hdf5_image(i))
+        elif not (self.memmap_index is None):
+            for i in batch_indices:
+                batch_X.append(self._read_memmap_image(i))
+        else:
+            for filename in batch_filenames:
+                batch_X.append(self._load_image_file(filename))
+        return batch_X
 
-            # Get the labels for this batch (if there are any).
-            if not (self.labels is None):
-                batch_y = deepcopy(self.labels[current:current+batch_size])
-            else:
-                batch_y = None
+    def _prefetch_image_files(self, batches, num_threads, decode_size=None, stats=None):
+        '''
+        Decodes the image files of the batches in a pool of threads. The files of each batch are
+        decoded concurrently, and the files of the next batch are already being decoded while
+        the current batch is being processed. This works because PIL releases the GIL while it
+        decodes an image.
 
-            if not (self.eval_neutral is None):
-                batch_eval_neutral = self.eval_neutral[current:current+batch_size]
+        Arguments:
+            batches (iterable): An iterable that yields batch items as `_batch_items()` does.
+            num_threads (int): The number of decoding threads.
+            decode_size (tuple, optional): As described in the documentation of `generate()`.
+            stats (PipelineStats, optional): As described in the documentation of `generate()`. The time spent
+                waiting for the decoded images is recorded as the 'load' stage.
+
+        Yields:
+            3-tuples containing the batch items, a list of the decoded images of the batch, and
+            a list of the scales at which they were decoded or `None` if they were decoded at
+            full resolution.
+        '''
+        def submit(executor, batch):
+            batch_indices, batch_filenames = batch[0], batch[1]
+            if not (decode_size is None):
+                return [executor.submit(self._load_reduced_image_file, filename, decode_size) for filename in batch_filenames]
+            # Images that are in the decoded-image cache don't need to be decoded.
+            images = []
+            for i, filename in zip(batch_indices, batch_filenames):
+                image = None if (self.image_cache is None) else self.image_cache.get(i)
+                if image is None:
+                    images.append(executor.submit(self._load_image_file, filename))
+                else:
+                    images.append(image)
+            return images
+
+        def result(batch, images):
+            if not (decode_size is None):
+                batch_X, batch_decode_scales = zip(*[image.result() for image in images])
+                return list(batch_X), list(batch_decode_scales)
+            batch_X = []
+            for i, image in zip(batch[0], images):
+                if isinstance(image, np.ndarray):
+                    batch_X.append(image)
+                elif self.image_cache is None:
+                    batch_X.append(image.result())
+                else:
+                    batch_X.append(self.image_cache.put(i, image.result()))
+            return batch_X, None
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            next_batch = next(batches)
+            next_images = submit(executor, next_batch)
+            while True:
+                batch, images = next_batch, next_images
+                next_batch = next(batches)
+                next_images = submit(executor, next_batch)
+                start = time.perf_counter()
+                batch_X, batch_decode_scales = result(batch, images)
+                if not (stats is None):
+                    # The batch isn't complete without its images.
+                    stats.add_stage_time('load', time.perf_counter() - start)
+                    stats.add_stage_time('batch', time.perf_counter() - start)
+                yield batch, batch_X, batch_decode_scales
+
+    def _produce_batch(self,
+                       batch_indices,
+                       batch_filenames,
+                       batch_y,
+                       batch_image_ids,
+                       batch_eval_neutral,
+                       transform_plan,
+                       label_encoder,
+                       returns,
+                       keep_images_without_gt,
+                       degenerate_box_handling,
+                       box_filter,
+                       decode_size=None,
+                       stats=None,
+                       batch_buffers=None,
+                       batch_X=None,
+                       batch_decode_scales=None):
+        '''
+        Loads, transforms and encodes the items of one batch. This is where all the work of
+        `generate()` happens. It is a separate method so that the batches can be produced
+        in worker processes, too.
+
+        Arguments:
+            batch_indices (array): The dataset indices of the batch items.
+            batch_filenames (list): The file names of the batch items or `None`.
+            batch_y (list): The labels of the batch items or `None`. Will not be modified.
+            batch_image_ids (list): The image IDs of the batch items or `None`.
+            batch_eval_neutral (list): The evaluation-neutrality annotations of the batch items or `None`.
+            transform_plan (list): The transformations as compiled by `_compile_transformations()`.
+            All other arguments are as described in the documentation of `generate()`, `box_filter` is the
+            `BoxFilter` used to remove degenerate boxes if `degenerate_box_handling == 'remove'`.
+            batch_buffers (BatchBufferPool, optional): The preallocated arrays to stack the processed images into, if any.
+            batch_X (list, optional): The images of the batch items if they have already been loaded. If `None`,
+                they will be loaded by `_load_batch_images()`.
+            batch_decode_scales (list, optional): Only relevant if `batch_X` is given. The factors `(scale_y, scale_x)`
+                by which the images in `batch_X` were scaled during decoding, or `None` if they were decoded at full
+                resolution.
+
+        Returns:
+            The batch as a list of items as defined by the `returns` argument.
+        '''
+
+        batch_start = time.perf_counter()
+
+        # This data generator may have been unpickled or forked in another process, e.g. a Keras worker.
+        self._ensure_hdf5_dataset()
+
+        #########################################################################################
+        # Get the images, (maybe) image IDs, (maybe) labels, etc. for this batch.
+        #########################################################################################
+
+        if batch_X is None:
+            start = time.perf_counter()
+            if (decode_size is None) or not self._reads_image_files():
+                batch_X = self._load_batch_images(batch_indices, batch_filenames)
             else:
-                batch_eval_neutral = None
+                batch_X, batch_decode_scales = zip(*[self._load_reduced_image_file(filename, decode_size) for filename in batch_filenames])
+                batch_X = list(batch_X)
+            if not (stats is None):
+                stats.add_stage_time('load', time.perf_counter() - start)
+        else:
+            batch_X = list(batch_X)
 
-            # Get the image IDs for this batch (if there are any).
-            if not (self.image_ids is None):
-                batch_image_ids = self.image_ids[current:current+batch_size]
+        if not (stats is None):
+            # For image files that is the size of the files, otherwise the size of the stored images.
+            if self._reads_image_files():
+                bytes_read = sum(os.path.getsize(filename) for filename in batch_filenames)
+            else:
+                bytes_read = sum(image.nbytes for image in batch_X)
+
+        # Copy the lists for this batch so that removing items from them doesn't affect the dataset.
+        if not (batch_filenames is None):
+            batch_filenames = list(batch_filenames)
+
+        # The labels are read-only views into the dataset's `LabelStore` and the transformations
+        # copy them before they modify them, so the labels don't need to be copied here.
+        if not (batch_y is None):
+            batch_y = list(batch_y)
+
+        if not (batch_eval_neutral is None):
+            batch_eval_neutral = list(batch_eval_neutral)
+
+        if not (batch_image_ids is None):
+            batch_image_ids = list(batch_image_ids)
+
+        # The original, unaltered images and labels. Read-only images and labels, e.g. images in memory or in the
+        # decoded-image cache and labels from the `LabelStore`, can't be altered by the transformations, so only
+        # the others need to be copied. Images that were decoded at reduced resolution are decoded again at their
+        # original resolution.
+        if 'original_images' in returns:
+            batch_original_images = [image if not image.flags.writeable else np.copy(image) for image in batch_X]
+            if not (batch_decode_scales is None):
+                for i, scales in enumerate(batch_decode_scales):
+                    if scales != (1.0, 1.0):
+                        batch_original_images[i] = self._load_image_file(batch_filenames[i])
+        if 'original_labels' in returns:
+            if batch_y is None:
+                batch_original_labels = None
             else:
-                batch_image_ids = None
+                batch_original_labels = [labels if not np.asarray(labels).flags.writeable else np.array(labels) for labels in batch_y]
 
-            if 'original_images' in returns:
-                batch_original_images = deepcopy(batch_X) # The original, unaltered images
-            if 'original_labels' in returns:
-                batch_original_labels = deepcopy(batch_y) # The original, unaltered labels
+        # Images that were decoded at reduced resolution need their labels scaled accordingly.
+        if not (batch_decode_scales is None) and not (batch_y is None):
+            for i, (scale_y, scale_x) in enumerate(batch_decode_scales):
+                batch_y[i] = self._scale_labels(batch_y[i], scale_y, scale_x)
 
-            current += batch_size
+        #########################################################################################
+        # Maybe perform image transformations.
+        #########################################################################################
 
-            #########################################################################################
-            # Maybe perform image transformations.
-            #########################################################################################
+        batch_items_to_remove = [] # In case we need to remove any images from the batch, store their indices in this list.
+        batch_inverse_transforms = []
 
-            batch_items_to_remove = [] # In case we need to remove any images from the batch, store their indices in this list.
-            batch_inverse_transforms = []
+        for i in range(len(batch_X)):
 
-            for i in range(len(batch_X)):
+            if not (self.labels is None):
+                # Convert the labels for this image to an array (in case they aren't already).
+                batch_y[i] = np.asarray(batch_y[i])
+                # If this image has no ground truth boxes, maybe we don't want to keep it in the batch.
+                if (batch_y[i].size == 0) and not keep_images_without_gt:
+                    batch_items_to_remove.append(i)
+                    batch_inverse_transforms.append([])
+                    continue
 
-                if not (self.labels is None):
-                    # Convert the labels for this image to an array (in case they aren't already).
-                    batch_y[i] = np.array(batch_y[i])
-                    # If this image has no ground truth boxes, maybe we don't want to keep it in the batch.
-                    if (batch_y[i].size == 0) and not keep_images_without_gt:
-                        batch_items_to_remove.append(i)
-                        batch_inverse_transforms.append([])
-                        continue
+            inverse_transforms = []
 
-                # Apply any image transformations we may have received.
-                if transformations:
+            if not (batch_decode_scales is None) and ('inverse_transform' in returns):
+                # Predictions for an image that was decoded at reduced resolution must be scaled
+                # back to the original resolution. This happens after all other inverse transforms.
+                scale_y, scale_x = batch_decode_scales[i]
+                inverse_transforms.append(partial(self._scale_labels, scale_y=1/scale_y, scale_x=1/scale_x, offset=1))
 
-                    inverse_transforms = []
+            # Apply any image transformations we may have received.
+            if transform_plan:
 
-                    for transform in transformations:
+                transform_start = time.perf_counter()
 
-                        if not (self.labels is None):
+                for position, transform, return_inverter in transform_plan:
 
-                            if ('inverse_transform' in returns) and ('return_inverter' in inspect.signature(transform).parameters):
-                                batch_X[i], batch_y[i], inverse_transform = transform(batch_X[i], batch_y[i], return_inverter=True)
-                                inverse_transforms.append(inverse_transform)
-                            else:
-                                batch_X[i], batch_y[i] = transform(batch_X[i], batch_y[i])
+                    start = time.perf_counter()
 
-                            if batch_X[i] is None: # In case the transform failed to produce an output image, which is possible for some random transforms.
-                                batch_items_to_remove.append(i)
-                                batch_inverse_transforms.append([])
-                                continue
+                    if not (self.labels is None):
 
+                        if return_inverter:
+                            batch_X[i], batch_y[i], inverse_transform = transform(batch_X[i], batch_y[i], return_inverter=True)
+                            inverse_transforms.append(inverse_transform)
                         else:
+                            batch_X[i], batch_y[i] = transform(batch_X[i], batch_y[i])
 
-                            if ('inverse_transform' in returns) and ('return_inverter' in inspect.signature(transform).parameters):
-                                batch_X[i], inverse_transform = transform(batch_X[i], return_inverter=True)
-                                inverse_transforms.append(inverse_transform)
-                            else:
-                                batch_X[i] = transform(batch_X[i])
-
-                    batch_inverse_transforms.append(inverse_transforms[::-1])
-
-                #########################################################################################
-                # Check for degenerate boxes in this batch item.
-                #########################################################################################
-
-                if not (self.labels is None):
-
-                    xmin = self.labels_format['xmin']
-                    ymin = self.labels_format['ymin']
-                    xmax = self.labels_format['xmax']
-                    ymax = self.labels_format['ymax']
-
-                    if np.any(batch_y[i][:,xmax] - batch_y[i][:,xmin] <= 0) or np.any(batch_y[i][:,ymax] - batch_y[i][:,ymin] <= 0):
-                        if degenerate_box_handling == 'warn':
-                            warnings.warn("Detected degenerate ground truth bounding boxes for batch item {} with bounding boxes {}, ".format(i, batch_y[i]) +
-                                          "i.e. bounding boxes where xmax <= xmin and/or ymax <= ymin. " +
-                                          "This could mean that your dataset contains degenerate ground truth boxes, or that any image transformations you may apply might " +
-                                          "result in degenerate ground truth boxes, or that you are parsing the ground truth in the wrong coordinate format." +
-                                          "Degenerate ground truth bounding boxes may lead to NaN errors during the training.")
-                        elif degenerate_box_handling == 'remove':
-                            batch_y[i] = box_filter(batch_y[i])
-                            if (batch_y[i].size == 0) and not keep_images_without_gt:
-                                batch_items_to_remove.append(i)
+                    else:
 
-            #########################################################################################
-            # Remove any items we might not want to keep from the batch.
-            #########################################################################################
+                        if return_inverter:
+                            batch_X[i], inverse_transform = transform(batch_X[i], return_inverter=True)
+                            inverse_transforms.append(inverse_transform)
+                        else:
+                            batch_X[i] = transform(batch_X[i])
 
-            if batch_items_to_remove:
-                for j in sorted(batch_items_to_remove, reverse=True):
-                    # This isn't efficient, but it hopefully shouldn't need to be done often anyway.
-                    batch_X.pop(j)
-                    batch_filenames.pop(j)
-                    if batch_inverse_transforms: batch_inverse_transforms.pop(j)
-                    if not (self.labels is None): batch_y.pop(j)
-                    if not (self.image_ids is None): batch_image_ids.pop(j)
-                    if not (self.eval_neutral is None): batch_eval_neutral.pop(j)
-                    if 'original_images' in returns: batch_original_images.pop(j)
-                    if 'original_labels' in returns and not (self.labels is None): batch_original_labels.pop(j)
+                    if not (stats is None):
+                        stats.add_transform_time(position, transform, time.perf_counter() - start)
 
-            #########################################################################################
+                    if batch_X[i] is None: # In case the transform failed to produce an output image, which is possible for some random transforms.
+                        break
 
-            # CAUTION: Converting `batch_X` into an array will result in an empty batch if the images have varying sizes
-            #          or varying numbers of channels. At this point, all images must have the same size and the same
-            #          number of channels.
-            batch_X = np.array(batch_X)
-            if (batch_X.size == 0):
-                raise DegenerateBatchError("You produced an empty batch. This might be because the images in the batch vary " +
-                                           "in their size and/or number of channels. Note that after all transformations " +
-                                           "(if any were given) have been applied to all images in the batch, all images " +
-                                           "must be homogenous in size along all axes.")
+                if not (stats is None):
+                    stats.add_stage_time('transform', time.perf_counter() - transform_start)
+
+                if batch_X[i] is None:
+                    batch_items_to_remove.append(i)
+                    batch_inverse_transforms.append([])
+                    continue
+
+            batch_inverse_transforms.append(inverse_transforms[::-1])
 
             #########################################################################################
-            # If we have a label encoder, encode our labels.
+            # Check for degenerate boxes in this batch item.
             #########################################################################################
 
-            if not (label_encoder is None or self.labels is None):
+            if not (self.labels is None):
 
-                if ('matched_anchors' in returns) and isinstance(label_encoder, SSDInputEncoder):
-                    batch_y_encoded, batch_matched_anchors = label_encoder(batch_y, diagnostics=True)
+                start = time.perf_counter()
+
+                xmin = self.labels_format['xmin']
+                ymin = self.labels_format['ymin']
+                xmax = self.labels_format['xmax']
+                ymax = self.labels_format['ymax']
+
+                if np.any(batch_y[i][:,xmax] - batch_y[i][:,xmin] <= 0) or np.any(batch_y[i][:,ymax] - batch_y[i][:,ymin] <= 0):
+                    if degenerate_box_handling == 'warn':
+                        warnings.warn("Detected degenerate ground truth bounding boxes for batch item {} with bounding boxes {}, ".format(i, batch_y[i]) +
+                                      "i.e. bounding boxes where xmax <= xmin and/or ymax <= ymin. " +
+                                      "This could mean that your dataset contains degenerate ground truth boxes, or that any image transformations you may apply might " +
+                                      "result in degenerate ground truth boxes, or that you are parsing the ground truth in the wrong coordinate format." +
+                                      "Degenerate ground truth bounding boxes may lead to NaN errors during the training.")
+                    elif degenerate_box_handling == 'remove':
+                        batch_y[i] = box_filter(batch_y[i])
+                        if (batch_y[i].size == 0) and not keep_images_without_gt:
+                            batch_items_to_remove.append(i)
+
+                if not (stats is None):
+                    stats.add_stage_time('box_filter', time.perf_counter() - start)
+
+        #########################################################################################
+        # Remove any items we might not want to keep from the batch.
+        #########################################################################################
+
+        if batch_items_to_remove:
+            for j in sorted(batch_items_to_remove, reverse=True):
+                # This isn't efficient, but it hopefully shouldn't need to be done often anyway.
+                batch_X.pop(j)
+                if not (batch_filenames is None): batch_filenames.pop(j)
+                if batch_inverse_transforms: batch_inverse_transforms.pop(j)
+                if not (self.labels is None): batch_y.pop(j)
+                if not (self.image_ids is None): batch_image_ids.pop(j)
+                if not (self.eval_neutral is None): batch_eval_neutral.pop(j)
+                if 'original_images' in returns: batch_original_images.pop(j)
+                if 'original_labels' in returns and not (self.labels is None): batch_original_labels.pop(j)
+
+        #########################################################################################
+
+        # CAUTION: Converting `batch_X` into an array will result in an empty batch if the images have varying sizes
+        #          or varying numbers of channels. At this point, all images must have the same size and the same
+        #          number of channels.
+        start = time.perf_counter()
+        if batch_buffers is None:
+            batch_X = np.array(batch_X)
+        else:
+            batch_X = batch_buffers.stack(batch_X)
+        if not (stats is None):
+            stats.add_stage_time('stack', time.perf_counter() - start)
+        if (batch_X.size == 0):
+            raise DegenerateBatchError("You produced an empty batch. This might be because the images in the batch vary " +
+                                       "in their size and/or number of channels. Note that after all transformations " +
+                                       "(if any were given) have been applied to all images in the batch, all images " +
+                                       "must be homogenous in size along all axes.")
+
+        #########################################################################################
+        # If we have a label encoder, encode our labels.
+        #########################################################################################
+
+        if not (label_encoder is None or self.labels is None):
+
+            start = time.perf_counter()
+
+            if isinstance(label_encoder, SSDInputEncoder):
+                if 'matched_anchors' in returns:
+                    batch_y_encoded, batch_matched_anchors = label_encoder(batch_y, diagnostics=True, batch_buffers=batch_buffers)
                 else:
-                    batch_y_encoded = label_encoder(batch_y, diagnostics=False)
+                    batch_y_encoded = label_encoder(batch_y, diagnostics=False, batch_buffers=batch_buffers)
                     batch_matched_anchors = None
-
             else:
-                batch_y_encoded = None
+                batch_y_encoded = label_encoder(batch_y, diagnostics=False)
                 batch_matched_anchors = None
 
-            #########################################################################################
-            # Compose the output.
-            #########################################################################################
-
-            ret = []
-            if 'processed_images' in returns: ret.append(batch_X)
-            if 'encoded_labels' in returns: ret.append(batch_y_encoded)
-            if 'matched_anchors' in returns: ret.append(batch_matched_anchors)
-            if 'processed_labels' in returns: ret.append(batch_y)
-            if 'filenames' in returns: ret.append(batch_filenames)
-            if 'image_ids' in returns: ret.append(batch_image_ids)
-            if 'evaluation-neutral' in returns: ret.append(batch_eval_neutral)
-            if 'inverse_transform' in returns: ret.append(batch_inverse_transforms)
-            if 'original_images' in returns: ret.append(batch_original_images)
-            if 'original_labels' in returns: ret.append(batch_original_labels)
+            if not (stats is None):
+                stats.add_stage_time('encode', time.perf_counter() - start)
 
-            yield ret
+        else:
+            batch_y_encoded = None
+            batch_matched_anchors = None
+
+        #########################################################################################
+        # Compose the output.
+        #########################################################################################
+
+        ret = []
+        if 'processed_images' in returns: ret.append(batch_X)
+        if 'encoded_labels' in returns: ret.append(batch_y_encoded)
+        if 'matched_anchors' in returns: ret.append(batch_matched_anchors)
+        if 'processed_labels' in returns: ret.append(batch_y)
+        if 'filenames' in returns: ret.append(batch_filenames)
+        if 'image_ids' in returns: ret.append(batch_image_ids)
+        if 'evaluation-neutral' in returns: ret.append(batch_eval_neutral)
+        if 'inverse_transform' in returns: ret.append(batch_inverse_transforms)
+        if 'original_images' in returns: ret.append(batch_original_images)
+        if 'original_labels' in returns: ret.append(batch_original_labels)
+
+        if not (stats is None):
+            stats.add_stage_time('batch', time.perf_counter() - batch_start)
+            stats.add_batch(len(batch_X), bytes_read)
+
+        return ret
 
     def save_dataset(self,
                      filenames_path='filenames.pkl',
@@ -1187,7 +2879,8 @@ class DataGenerator:
 
         Arguments:
             filenames_path (str): The path under which to save the filenames pickle.
-            labels_path (str): The path under which to save the labels pickle.
+            labels_path (str): The path under which to save the labels pickle. The labels are
+                pickled as a `LabelStore`, which the constructor accepts just like a list.
             image_ids_path (str, optional): The path under which to save the image IDs pickle.
             eval_neutral_path (str, optional): The path under which to save the pickle for
                 the evaluation-neutrality annotations.
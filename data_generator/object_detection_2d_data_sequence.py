@@ -0,0 +1,133 @@
+'''
+A random-access Keras `Sequence` interface to the data generator for 2D object detection.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+from math import ceil
+from keras.utils import Sequence
+
+from data_generator.object_detection_2d_data_generator import DatasetError
+
+class DataGeneratorSequence(Sequence):
+    '''
+    Provides the batches of a `DataGenerator` through the `keras.utils.Sequence` interface,
+    i.e. by batch index rather than as an infinite Python generator.
+
+    Since every batch can be produced independently of all other batches, Keras can safely
+    produce the batches in parallel worker processes by passing `use_multiprocessing=True`
+    and `workers > 1` to `fit_generator()`, and every epoch visits every image exactly once.
+
+    The batches are produced exactly like the batches of `DataGenerator.generate()`, i.e. with
+    the same transformations and the same label encoder.
+    '''
+
+    def __init__(self,
+                 data_generator,
+                 batch_size=32,
+                 shuffle=True,
+                 transformations=[],
+                 label_encoder=None,
+                 returns={'processed_images', 'encoded_labels'},
+                 keep_images_without_gt=False,
+                 degenerate_box_handling='remove',
+                 decode_size=None,
+                 batch_sampler=None,
+                 stats=None,
+                 seed=None):
+        '''
+        All arguments except for `data_generator` and `seed` are as described in the documentation
+        of `DataGenerator.generate()`. Note that `stats` only records the batches that are produced in
+        the process that holds the stats object, i.e. not the batches that Keras produces in worker
+        processes with `use_multiprocessing=True`.
+
+        Arguments:
+            data_generator (DataGenerator): The data generator with the dataset to produce batches from.
+            seed (int, optional): If an integer, the shuffling and the random transformations of each epoch
+                are determined by this seed, so that the sequence of batches is reproducible. If `None`, they
+                are drawn from Numpy's global random number generator. The batches of a `batch_sampler` are
+                determined by the sampler's own seed.
+        '''
+
+        if data_generator.dataset_size == 0:
+            raise DatasetError("Cannot generate batches because you did not load a dataset.")
+
+        self.data_generator = data_generator
+        self.batch_size = batch_size if (batch_sampler is None) else batch_sampler.batch_size
+        self.shuffle = shuffle
+        self.batch_sampler = batch_sampler
+        self.seed = seed
+        self.processing_kwargs = data_generator._get_processing_kwargs(transformations=transformations,
+                                                                       label_encoder=label_encoder,
+                                                                       returns=returns,
+                                                                       keep_images_without_gt=keep_images_without_gt,
+                                                                       degenerate_box_handling=degenerate_box_handling,
+                                                                       decode_size=decode_size,
+                                                                       stats=stats)
+        if not (stats is None):
+            stats.start()
+        # The positions of the dataset items in the order in which they are visited in the current epoch.
+        self.positions = np.arange(data_generator.dataset_size)
+        self.epoch = -1
+        self.on_epoch_end()
+
+    def __len__(self):
+        if not (self.batch_sampler is None):
+            return len(self.batch_sampler)
+        return int(ceil(self.data_generator.dataset_size / self.batch_size))
+
+    def __getitem__(self, batch_idx):
+        '''
+        Produces the batch with the given index of the current epoch.
+
+        Since Keras may produce the batches in several processes that all start out with the same
+        state of Numpy's global random number generator, it is reseeded for every batch with a seed
+        that depends on the epoch and the batch index. Consequently, the random transformations that
+        are applied to a batch do not depend on the process that produces it.
+
+        Arguments:
+            batch_idx (int): The index of the batch within the current epoch.
+
+        Returns:
+            The batch as a list of items as defined by the `returns` argument.
+        '''
+        if not (0 <= batch_idx < len(self)):
+            raise IndexError("Batch index {} is out of range for a sequence of length {}.".format(batch_idx, len(self)))
+        np.random.seed((self.epoch_seed + batch_idx) % (2**32))
+        if self.batch_sampler is None:
+            positions = self.positions[batch_idx*self.batch_size:(batch_idx+1)*self.batch_size]
+            batch = self.data_generator._get_batch_items(positions)
+        else:
+            batch = self.data_generator._get_items(self.batches[batch_idx])
+        return self.data_generator._produce_batch(*batch, **self.processing_kwargs)
+
+    def on_epoch_end(self):
+        '''
+        Advances the sequence to the next epoch, reshuffling the dataset if `shuffle` is `True` or
+        drawing the next epoch's batches from the batch sampler.
+        Keras calls this method at the end of every epoch.
+        '''
+        self.epoch += 1
+        if self.seed is None:
+            random_state = np.random
+        else:
+            random_state = np.random.RandomState((self.seed + self.epoch) % (2**32))
+        if not (self.batch_sampler is None):
+            self.batches = self.batch_sampler.get_epoch_batches(self.epoch)
+        elif self.shuffle:
+            self.positions = random_state.permutation(self.data_generator.dataset_size)
+        self.epoch_seed = random_state.randint(np.iinfo(np.int32).max)
@@ -0,0 +1,173 @@
+'''
+Utilities to extend and merge the HDF5 datasets that `DataGenerator.create_hdf5_dataset()` produces.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+import sys
+from tqdm import tqdm
+import h5py
+
+# The datasets that an HDF5 dataset may contain. All of them have one entry per image.
+HDF5_DATASET_NAMES = ('images', 'image_shapes', 'labels', 'label_shapes', 'image_ids', 'eval_neutral')
+
+def resize_hdf5_datasets(hdf5_dataset, size):
+    '''
+    Resizes all per-image datasets of an HDF5 dataset to the given number of images at once.
+
+    Arguments:
+        hdf5_dataset (h5py.File): An HDF5 dataset that is open for writing.
+        size (int): The new number of images.
+
+    Returns:
+        None.
+
+    Raises:
+        ValueError: If the HDF5 dataset cannot be resized. This is the case for HDF5 datasets that
+            were created with an earlier version of `DataGenerator.create_hdf5_dataset()`, which
+            created some datasets with a fixed size.
+    '''
+    for name in HDF5_DATASET_NAMES:
+        if (name in hdf5_dataset) and (hdf5_dataset[name].maxshape[0] is not None):
+            raise ValueError("The '{}' dataset in the HDF5 file '{}' has a fixed size and cannot be extended. Recreate the HDF5 dataset to be able to extend it.".format(name, hdf5_dataset.filename))
+    for name in HDF5_DATASET_NAMES:
+        if name in hdf5_dataset:
+            hdf5_dataset[name].resize(size, axis=0)
+
+def check_hdf5_compatibility(hdf5_dataset, image_layout, has_labels, has_image_ids, has_eval_neutral, image_shape=None):
+    '''
+    Checks whether images with the given properties can be added to an HDF5 dataset.
+
+    Arguments:
+        hdf5_dataset (h5py.File): The HDF5 dataset to be extended.
+        image_layout (str): The image layout of the images to be added.
+        has_labels (bool): Whether or not the images to be added have labels.
+        has_image_ids (bool): Whether or not the images to be added have image IDs.
+        has_eval_neutral (bool): Whether or not the images to be added have evaluation-neutrality annotations.
+        image_shape (tuple, optional): The shape of the images to be added. Only relevant for the 'contiguous'
+            image layout, which requires all images to have the same shape.
+
+    Raises:
+        ValueError: If the images cannot be added to the HDF5 dataset.
+    '''
+    target_layout = hdf5_dataset.attrs.get('image_layout', 'flattened')
+    if image_layout != target_layout:
+        raise ValueError("Cannot add images with image layout '{}' to an HDF5 dataset with image layout '{}'.".format(image_layout, target_layout))
+    for name, value in [('has_labels', has_labels), ('has_image_ids', has_image_ids), ('has_eval_neutral', has_eval_neutral)]:
+        if bool(hdf5_dataset.attrs[name]) != bool(value):
+            raise ValueError("Cannot add images with `{} = {}` to an HDF5 dataset with `{} = {}`.".format(name, bool(value), name, bool(hdf5_dataset.attrs[name])))
+    if (image_layout == 'contiguous') and not (image_shape is None) and (tuple(image_shape) != hdf5_dataset['images'].shape[1:]):
+        raise ValueError("Cannot add images of shape {} to a contiguous HDF5 dataset with images of shape {}.".format(tuple(image_shape), hdf5_dataset['images'].shape[1:]))
+
+def update_variable_image_size(hdf5_dataset):
+    '''
+    Sets the 'variable_image_size' attribute of an HDF5 dataset to `True` if its images
+    do not all have the same shape.
+
+    Arguments:
+        hdf5_dataset (h5py.File): An HDF5 dataset that is open for writing.
+
+    Returns:
+        None.
+    '''
+    if not hdf5_dataset.attrs['variable_image_size']:
+        image_shapes = hdf5_dataset['image_shapes'][:]
+        if len(image_shapes) > 0 and np.any(image_shapes != image_shapes[0]):
+            hdf5_dataset.attrs.modify(name='variable_image_size', value=True)
+
+def merge_hdf5_datasets(target_path, source_paths, chunk_size=1000, verbose=True):
+    '''
+    Appends the images and annotations of one or more HDF5 datasets to another HDF5 dataset
+    in place. All datasets must have been produced by `DataGenerator.create_hdf5_dataset()` with
+    the same image layout and must contain the same kinds of annotations.
+
+    The target datasets are resized only once for all source datasets and the data is copied
+    in slices of `chunk_size` images, so no image is decoded or re-encoded.
+
+    Arguments:
+        target_path (str): The path of the HDF5 dataset to be extended.
+        source_paths (list): The paths of the HDF5 datasets to be appended to the target dataset
+            in this order.
+        chunk_size (int, optional): The number of images that are copied at once.
+        verbose (bool, optional): Whether or not to print out the progress of the merge.
+
+    Returns:
+        None.
+    '''
+    with h5py.File(target_path, 'a') as target:
+
+        sources = [h5py.File(source_path, 'r') for source_path in source_paths]
+
+        try:
+            for source in sources:
+                if 'n_committed' in source.attrs and source.attrs['n_committed'] < len(source['images']):
+                    raise ValueError("The HDF5 dataset at '{}' is incomplete. Resume its creation before merging it.".format(source.filename))
+                check_hdf5_compatibility(hdf5_dataset=target,
+                                         image_layout=source.attrs.get('image_layout', 'flattened'),
+                                         has_labels=source.attrs['has_labels'],
+                                         has_image_ids=source.attrs['has_image_ids'],
+                                         has_eval_neutral=source.attrs['has_eval_neutral'],
+                                         image_shape=source['images'].shape[1:])
+
+            offset = len(target['images'])
+            total_size = offset + sum(len(source['images']) for source in sources)
+            original_size = offset
+            original_n_committed = target.attrs.get('n_committed')
+            resize_hdf5_datasets(target, total_size)
+
+            try:
+                if verbose:
+                    progress = tqdm(total=total_size - offset, desc='Merging HDF5 datasets', file=sys.stdout)
+
+                for source in sources:
+                    source_size = len(source['images'])
+                    for start in range(0, source_size, chunk_size):
+                        end = min(start + chunk_size, source_size)
+                        for name in HDF5_DATASET_NAMES:
+                            if name in source:
+                                data = source[name][start:end]
+                                if data.dtype == object:
+                                    # h5py cannot write a slice of variable-length arrays at once if they
+                                    # happen to have the same length, so write them one by one.
+                                    for k in range(len(data)):
+                                        target[name][offset+start+k] = data[k]
+                                else:
+                                    target[name][offset+start:offset+end] = data
+                        if verbose:
+                            progress.update(end - start)
+                    offset += source_size
+                    target.attrs['n_committed'] = offset
+                    target.flush()
+
+                if verbose:
+                    progress.close()
+
+                update_variable_image_size(target)
+            except BaseException:
+                # Shrink the target dataset back to its original size rather than leaving it with
+                # a partial copy of the source datasets and zero-filled trailing entries.
+                resize_hdf5_datasets(target, original_size)
+                if original_n_committed is None:
+                    if 'n_committed' in target.attrs:
+                        del target.attrs['n_committed']
+                else:
+                    target.attrs['n_committed'] = original_n_committed
+                raise
+
+        finally:
+            for source in sources:
+                source.close()
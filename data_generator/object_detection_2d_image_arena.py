@@ -0,0 +1,189 @@
+'''
+A single shared memory buffer that holds all images of a dataset.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+import mmap
+import os
+
+class ImageArena:
+    '''
+    Stores all images of a dataset one after another in a single buffer of shared memory along
+    with an index of their offsets and shapes.
+
+    A list of separate Numpy arrays gets duplicated piece by piece in every forked worker process,
+    since merely accessing an array changes its reference count and thereby triggers copy-on-write
+    of the memory page it lives on. The images in an arena, on the other hand, are in a shared memory
+    mapping that the worker processes never write to, so all of them use one physical copy.
+
+    The buffer is either an anonymous shared memory mapping, which is shared with all processes that
+    are forked from the process that created it, or a file, e.g. in '/dev/shm', which other processes,
+    e.g. other training jobs on the same host, can attach to.
+
+    An arena behaves like a list of images: Indexing it with an integer returns the image as a read-only
+    view into the buffer.
+    '''
+
+    def __init__(self, buffer, offsets, shapes, ndims, path=None, fingerprint=None):
+        '''
+        Use `create()` or `attach()` instead of calling this constructor directly.
+
+        Arguments:
+            buffer (array): A 1D `uint8` Numpy array that contains all images.
+            offsets (array): The byte offsets of the images in the buffer.
+            shapes (array): An array of shape `(num_images, 3)` that contains the height, width, and number
+                of channels of each image.
+            ndims (array): The number of dimensions of each image, i.e. 2 for images without a channel axis
+                and 3 otherwise.
+            path (str, optional): The path of the file that contains the buffer, if any.
+            fingerprint (str, optional): A fingerprint of the dataset that the images belong to.
+        '''
+        self.buffer = buffer
+        self.offsets = offsets
+        self.shapes = shapes
+        self.ndims = ndims
+        self.path = path
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def create(cls, shapes, path=None, fingerprint=None):
+        '''
+        Allocates an arena for images of the given shapes.
+
+        Arguments:
+            shapes (list): The shape of each image, either `(height, width)` or `(height, width, channels)`.
+            path (str, optional): If `None`, the buffer is an anonymous shared memory mapping. Otherwise,
+                the path of the file in which to create the buffer.
+            fingerprint (str, optional): A fingerprint of the dataset that the images belong to. It is saved
+                in the index, so that `exists()` can tell an arena of a different dataset apart.
+
+        Returns:
+            A new `ImageArena`. Its images must be written with `write()`.
+        '''
+        ndims = np.array([len(shape) for shape in shapes], dtype=np.int8)
+        full_shapes = np.ones((len(shapes), 3), dtype=np.int64)
+        for i, shape in enumerate(shapes):
+            full_shapes[i,:len(shape)] = shape
+        sizes = np.prod(full_shapes, axis=1)
+        offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)
+        num_bytes = max(int(offsets[-1]), 1) # Memory mappings can't be empty.
+        if path is None:
+            buffer = np.frombuffer(mmap.mmap(-1, num_bytes), dtype=np.uint8)
+        else:
+            buffer = np.memmap(path, dtype=np.uint8, mode='w+', shape=(num_bytes,))
+        return cls(buffer, offsets, full_shapes, ndims, path, fingerprint)
+
+    @classmethod
+    def attach(cls, path):
+        '''
+        Attaches to an arena that was created in a file and completed with `save_index()`.
+
+        Arguments:
+            path (str): The path of the file that contains the buffer.
+
+        Returns:
+            The `ImageArena`, read-only.
+        '''
+        index = np.load(cls.get_index_path(path))
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        fingerprint = str(index['fingerprint']) if ('fingerprint' in index) else None
+        return cls(buffer, index['offsets'], index['shapes'], index['ndims'], path, fingerprint)
+
+    @staticmethod
+    def get_index_path(path):
+        '''
+        Returns the path of the index file of an arena whose buffer is in the file at `path`.
+        '''
+        return path + '.index.npz'
+
+    @classmethod
+    def exists(cls, path, fingerprint=None):
+        '''
+        Returns whether a complete arena exists at `path`, i.e. whether one can attach to it. If a
+        fingerprint is given, the arena must also have been created with this fingerprint.
+        '''
+        if not (os.path.isfile(path) and os.path.isfile(cls.get_index_path(path))):
+            return False
+        if fingerprint is None:
+            return True
+        index = np.load(cls.get_index_path(path))
+        return ('fingerprint' in index) and (str(index['fingerprint']) == fingerprint)
+
+    @classmethod
+    def remove(cls, path):
+        '''
+        Deletes the files of an arena. Processes that are attached to it keep their mapping of the buffer.
+        '''
+        for file_path in [cls.get_index_path(path), path]:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    def write(self, i, image):
+        '''
+        Writes an image into its place in the buffer.
+
+        Arguments:
+            i (int): The index of the image.
+            image (array): The image. Must have the shape that was given for it in `create()`.
+        '''
+        shape = tuple(self.shapes[i,:self.ndims[i]])
+        if image.shape != shape:
+            raise ValueError("The image arena expects image {} to have shape {}, but it has shape {}.".format(i, shape, image.shape))
+        self.buffer[self.offsets[i]:self.offsets[i+1]] = np.asarray(image, dtype=np.uint8).reshape(-1)
+
+    def save_index(self):
+        '''
+        Writes the index of an arena whose buffer is in a file next to that file, so that other
+        processes can attach to the arena. Call this only once all images have been written.
+        '''
+        self.buffer.flush()
+        # Write to a temporary file first so that nobody attaches to an incomplete arena.
+        temp_path = '{}.{}.tmp.npz'.format(self.path, os.getpid())
+        arrays = {'offsets': self.offsets, 'shapes': self.shapes, 'ndims': self.ndims}
+        if not (self.fingerprint is None):
+            arrays['fingerprint'] = np.array(self.fingerprint)
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, self.get_index_path(self.path))
+
+    def __len__(self):
+        return len(self.ndims)
+
+    def __getitem__(self, i):
+        image = self.buffer[self.offsets[i]:self.offsets[i+1]].reshape(self.shapes[i,:self.ndims[i]])
+        image.flags.writeable = False
+        return image
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        # A process that receives a pickled arena attaches to the file if there is one. An anonymous
+        # memory mapping can only be shared by forking, otherwise it has to be copied.
+        state = self.__dict__.copy()
+        if self.path is None:
+            state['buffer'] = np.array(self.buffer)
+        else:
+            state['buffer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.buffer is None:
+            self.buffer = np.memmap(self.path, dtype=np.uint8, mode='r')
@@ -0,0 +1,108 @@
+'''
+A cache for decoded images with a memory budget.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+from collections import OrderedDict
+
+class DecodedImageCache:
+    '''
+    A least-recently-used cache for decoded images whose total size is limited to a given
+    number of bytes.
+
+    This is the middle ground between decoding every image anew for every batch and loading
+    the entire dataset into memory: If the dataset is only slightly larger than the cache,
+    most images are still served from the cache.
+
+    The cached images are read-only, so that the transformations can't modify them by accident.
+    '''
+
+    def __init__(self, max_bytes):
+        '''
+        Arguments:
+            max_bytes (int): The maximal total size of the cached images in bytes.
+        '''
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.images = OrderedDict() # Ordered from the least recently to the most recently used image.
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, key):
+        return key in self.images
+
+    def get(self, key):
+        '''
+        Returns the cached image for the given key, or `None` if the image is not in the cache.
+
+        Arguments:
+            key (int): The key of the image, usually its dataset index.
+
+        Returns:
+            The cached image as a read-only Numpy array or `None`.
+        '''
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+        else:
+            self.images.move_to_end(key)
+            self.hits += 1
+        return image
+
+    def put(self, key, image):
+        '''
+        Adds an image to the cache and evicts the least recently used images as long as the
+        cache exceeds its budget. Images that are larger than the entire budget are not cached.
+
+        Arguments:
+            key (int): The key of the image, usually its dataset index.
+            image (array): The decoded image.
+
+        Returns:
+            The image as a read-only Numpy array.
+        '''
+        image = np.asarray(image).view()
+        image.flags.writeable = False
+        if image.nbytes > self.max_bytes:
+            return image
+        if key in self.images:
+            self.num_bytes -= self.images.pop(key).nbytes
+        self.images[key] = image
+        self.num_bytes += image.nbytes
+        while self.num_bytes > self.max_bytes:
+            _, evicted_image = self.images.popitem(last=False)
+            self.num_bytes -= evicted_image.nbytes
+        return image
+
+    def clear(self):
+        '''
+        Removes all images from the cache.
+        '''
+        self.images.clear()
+        self.num_bytes = 0
+
+    def get_hit_rate(self):
+        '''
+        Returns:
+            The fraction of lookups that found their image in the cache so far.
+        '''
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
@@ -0,0 +1,104 @@
+'''
+A compact store for the ground truth labels of a dataset.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+
+class LabelStore:
+    '''
+    Stores the ground truth boxes of all images of a dataset in one contiguous 2D Numpy array
+    of shape `(total_boxes, num_columns)` along with an array of offsets so that the boxes of
+    image `i` are the rows `offsets[i]:offsets[i+1]` of that array.
+
+    A `LabelStore` behaves like a list of the 2D label arrays of all images: Indexing it with an
+    integer returns the labels of that image as a read-only view into the contiguous array, so
+    no labels are copied until a transformation actually modifies them. Indexing it with a slice
+    or a sequence of integers returns a list of such views.
+
+    Compared to a list of Python lists, this saves the conversion of every box into a Numpy array
+    every time a batch is produced, and it takes up a fraction of the memory.
+    '''
+
+    def __init__(self, boxes, offsets):
+        '''
+        Arguments:
+            boxes (array): A 2D Numpy array that contains the boxes of all images one after another.
+            offsets (array): A 1D Numpy array of length `num_images + 1` that contains the row index
+                in `boxes` at which the boxes of each image begin, followed by the total number of boxes.
+        '''
+        self.boxes = np.asarray(boxes)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if self.boxes.flags.writeable:
+            # Make sure that nobody modifies the labels of the dataset through one of the views.
+            self.boxes = self.boxes.view()
+            self.boxes.flags.writeable = False
+
+    @classmethod
+    def from_labels(cls, labels, num_columns=5):
+        '''
+        Creates a `LabelStore` from a list that contains for each image either a 2D Numpy array or
+        a list of boxes, where each box is a list.
+
+        Arguments:
+            labels (list): The labels of all images.
+            num_columns (int, optional): The number of columns of the boxes. Only needed if no image has any boxes.
+
+        Returns:
+            A new `LabelStore`.
+        '''
+        if isinstance(labels, LabelStore):
+            return labels
+        labels = [np.asarray(image_labels) for image_labels in labels]
+        offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(image_labels) for image_labels in labels])
+        non_empty_labels = [image_labels for image_labels in labels if len(image_labels) > 0]
+        if non_empty_labels:
+            boxes = np.concatenate(non_empty_labels, axis=0)
+        else:
+            boxes = np.zeros((0, num_columns), dtype=np.int32)
+        return cls(boxes, offsets)
+
+    def __setstate__(self, state):
+        # Unpickled arrays are writable again.
+        self.__init__(state['boxes'], state['offsets'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        elif isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not (0 <= index < len(self)):
+                raise IndexError("Index {} is out of range for labels of {} images.".format(index, len(self)))
+            return self.boxes[self.offsets[index]:self.offsets[index+1]]
+        else:
+            return [self[i] for i in index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_num_boxes(self):
+        '''
+        Returns:
+            A 1D Numpy array that contains the number of boxes of each image.
+        '''
+        return np.diff(self.offsets)
@@ -18,6 +18,20 @@ limitations under the License.
 
 from __future__ import division
 import numpy as np
+import inspect
+
+def supports_inverter(transform):
+    '''
+    Checks whether a transformation can return an inverter function, i.e. whether
+    it accepts a `return_inverter` argument.
+
+    Arguments:
+        transform (callable): The transformation.
+
+    Returns:
+        `True` if the transformation accepts a `return_inverter` argument, `False` otherwise.
+    '''
+    return 'return_inverter' in inspect.signature(transform).parameters
 
 def apply_inverse_transforms(y_pred_decoded, inverse_transforms):
     '''
@@ -0,0 +1,287 @@
+'''
+Utilities to produce batches of the data generator in parallel worker processes.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+import multiprocessing
+from collections import deque
+
+# The state of a worker process. It is set once by `init_worker()` when the worker
+# process starts and is then used by all tasks that this worker process runs.
+_worker_data_generator = None
+_worker_processing_kwargs = None
+_worker_ring_buffer = None
+
+class SharedBatchRingBuffer:
+    '''
+    A ring buffer of preallocated batch slots in shared memory.
+
+    Worker processes write the large outputs of a batch, i.e. the processed images and the
+    encoded labels, into a slot of the buffer instead of sending them back to the main process
+    through a pipe. The main process then reads them as Numpy views into the shared memory,
+    so the batches are neither pickled nor copied on their way to the trainer.
+
+    The buffer must be created before the worker processes are started so that they inherit it.
+    '''
+
+    def __init__(self, n_slots, batch_size, arrays):
+        '''
+        Arguments:
+            n_slots (int): The number of batch slots.
+            batch_size (int): The maximal number of items per batch.
+            arrays (dict): A dictionary that maps the name of each array that each slot holds
+                to a 2-tuple `(item_shape, dtype)`, where `item_shape` is the shape of the array
+                for a single batch item.
+        '''
+        self.n_slots = n_slots
+        self.batch_size = batch_size
+        self.arrays = {}
+        self.buffers = {}
+        for name, (item_shape, dtype) in arrays.items():
+            item_shape = tuple(item_shape)
+            dtype = np.dtype(dtype)
+            n_bytes = n_slots * batch_size * int(np.prod(item_shape)) * dtype.itemsize
+            self.arrays[name] = (item_shape, dtype)
+            self.buffers[name] = multiprocessing.RawArray('B', n_bytes)
+
+    def get_slot(self, name, slot):
+        '''
+        Returns a Numpy view of shape `(batch_size,) + item_shape` into the given slot of the
+        given array.
+        '''
+        item_shape, dtype = self.arrays[name]
+        array = np.frombuffer(self.buffers[name], dtype=dtype)
+        return array.reshape((self.n_slots, self.batch_size) + item_shape)[slot]
+
+    def write(self, name, slot, batch):
+        '''
+        Writes a batch into the given slot of the given array.
+
+        Arguments:
+            name (str): The name of the array.
+            slot (int): The index of the slot.
+            batch (array): The batch to be written. Must have at most `batch_size` items and
+                items of the shape and data type that the array was created for.
+        '''
+        item_shape, dtype = self.arrays[name]
+        if (batch.shape[1:] != item_shape) or (len(batch) > self.batch_size):
+            raise ValueError("The shared memory batch buffer for '{}' holds up to {} items of shape {}, but received a batch of shape {}. ".format(name, self.batch_size, item_shape, batch.shape) +
+                             "Shared memory batches are only possible if all batches have the same item shape.")
+        self.get_slot(name, slot)[:len(batch)] = batch
+
+def get_shared_return_positions(returns):
+    '''
+    Returns a dictionary that maps the names of the outputs of `DataGenerator._produce_batch()` that
+    can be passed through shared memory, i.e. 'processed_images' and 'encoded_labels', to their positions
+    in the output list, for those of them that are in `returns`.
+    '''
+    positions = {}
+    if 'processed_images' in returns:
+        positions['processed_images'] = 0
+    if 'encoded_labels' in returns:
+        positions['encoded_labels'] = len(positions)
+    return positions
+
+def get_multiprocessing_context():
+    '''
+    Returns the `fork` multiprocessing context if the platform supports it and the
+    default context otherwise. Forking is preferred because the worker processes
+    then inherit the dataset (e.g. images loaded into memory) without it having
+    to be pickled.
+    '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    else:
+        return multiprocessing.get_context()
+
+def init_worker(data_generator, processing_kwargs, ring_buffer=None):
+    '''
+    Initializes a worker process of the batch production pool.
+
+    Arguments:
+        data_generator (DataGenerator): The data generator whose batches the worker
+            process will produce.
+        processing_kwargs (dict): The keyword arguments for `DataGenerator._produce_batch()`
+            that are the same for all batches, i.e. the transformations, the label
+            encoder, etc.
+        ring_buffer (SharedBatchRingBuffer, optional): The shared memory buffer that the
+            worker process writes its batches into, if any.
+    '''
+    global _worker_data_generator, _worker_processing_kwargs, _worker_ring_buffer
+    _worker_data_generator = data_generator
+    _worker_processing_kwargs = processing_kwargs
+    _worker_ring_buffer = ring_buffer
+    # HDF5 file handles do not survive `fork()`, so every worker opens its own.
+    data_generator._ensure_hdf5_dataset()
+
+def produce_batch(batch, seed):
+    '''
+    Produces one batch inside a worker process.
+
+    Arguments:
+        batch (tuple): The arguments for `DataGenerator._produce_batch()` that
+            are specific to this batch, i.e. the indices, file names, labels,
+            image IDs, and evaluation-neutrality annotations of the batch items.
+        seed (int): The seed for Numpy's random number generator. Each batch is
+            produced with its own seed so that the random transformations in the
+            worker processes are not identical copies of one another and so that
+            the output does not depend on which worker produces which batch.
+
+    Returns:
+        A 2-tuple containing the batch output as returned by `DataGenerator._produce_batch()`
+        and the pipeline stats that were recorded for the batch as returned by
+        `PipelineStats.get_counters()`, or `None` if no stats are recorded.
+    '''
+    np.random.seed(seed)
+    # The worker's copy of the stats only records this batch. The calling process merges them.
+    stats = _worker_processing_kwargs['stats']
+    if not (stats is None):
+        stats.reset()
+    ret = _worker_data_generator._produce_batch(*batch, **_worker_processing_kwargs)
+    return ret, (None if stats is None else stats.get_counters())
+
+def produce_batch_into_slot(batch, seed, slot):
+    '''
+    Produces one batch inside a worker process and writes its processed images and encoded
+    labels into the given slot of the worker's shared memory buffer.
+
+    Arguments:
+        batch (tuple): As described for `produce_batch()`.
+        seed (int): As described for `produce_batch()`.
+        slot (int): The slot of the shared memory buffer to write the batch into.
+
+    Returns:
+        A 3-tuple containing the number of items in the batch, the batch output as returned
+        by `DataGenerator._produce_batch()`, in which the outputs that were written to shared
+        memory are replaced by `None`, and the pipeline stats as returned by `produce_batch()`.
+    '''
+    ret, counters = produce_batch(batch, seed)
+    n_items = None
+    for name, position in get_shared_return_positions(_worker_processing_kwargs['returns']).items():
+        if name in _worker_ring_buffer.arrays:
+            _worker_ring_buffer.write(name, slot, ret[position])
+            n_items = len(ret[position])
+            ret[position] = None
+    return n_items, ret, counters
+
+def init_hdf5_worker(data_generator):
+    '''
+    Initializes a worker process that prepares images for an HDF5 dataset.
+
+    Arguments:
+        data_generator (DataGenerator): The data generator whose dataset is being converted.
+    '''
+    global _worker_data_generator
+    _worker_data_generator = data_generator
+
+def prepare_hdf5_image(task):
+    '''
+    Loads, resizes and encodes one image for an HDF5 dataset inside a worker process.
+
+    Arguments:
+        task (tuple): The arguments for `DataGenerator._prepare_hdf5_image()`.
+
+    Returns:
+        The output of `DataGenerator._prepare_hdf5_image()`.
+    '''
+    return _worker_data_generator._prepare_hdf5_image(*task)
+
+def parallel_batches(data_generator, batches, processing_kwargs, num_workers, max_queue_size, batch_size=None, shared_memory=False):
+    '''
+    Produces batches in a pool of worker processes and yields them in the order
+    in which they were requested.
+
+    Arguments:
+        data_generator (DataGenerator): The data generator whose batches are to be produced.
+        batches (iterable): An iterable that yields the batch-specific arguments for
+            `DataGenerator._produce_batch()` for each batch in the order in which the
+            batches are to be yielded.
+        processing_kwargs (dict): The keyword arguments for `DataGenerator._produce_batch()`
+            that are the same for all batches.
+        num_workers (int): The number of worker processes.
+        max_queue_size (int): The maximal number of batches that are being produced
+            or are waiting to be yielded at any time.
+        batch_size (int, optional): The maximal number of items per batch. Only relevant
+            if `shared_memory` is `True`.
+        shared_memory (bool, optional): If `True`, the worker processes write the processed
+            images and the encoded labels into a `SharedBatchRingBuffer` with `max_queue_size + 1`
+            slots and the yielded batches contain views into this buffer. The shapes of the
+            buffer's arrays are taken from the first batch, which is produced in this process.
+
+    Yields:
+        The batch outputs as returned by `DataGenerator._produce_batch()`.
+    '''
+    ring_buffer = None
+    if shared_memory:
+        # The first batch is produced with its own seed just like the batches of the workers, so
+        # that the sequence of batches doesn't depend on where they are produced.
+        batch = next(batches)
+        seed = np.random.randint(np.iinfo(np.int32).max)
+        random_state = np.random.get_state()
+        np.random.seed(seed)
+        try:
+            first_batch = data_generator._produce_batch(*batch, **processing_kwargs)
+        finally:
+            np.random.set_state(random_state)
+        arrays = {}
+        for name, position in get_shared_return_positions(processing_kwargs['returns']).items():
+            if isinstance(first_batch[position], np.ndarray):
+                arrays[name] = (first_batch[position].shape[1:], first_batch[position].dtype)
+        ring_buffer = SharedBatchRingBuffer(n_slots=max_queue_size + 1,
+                                            batch_size=batch_size,
+                                            arrays=arrays)
+        yield first_batch
+
+    context = get_multiprocessing_context()
+    pool = context.Pool(processes=num_workers,
+                        initializer=init_worker,
+                        initargs=(data_generator, processing_kwargs, ring_buffer))
+    pending = deque()
+    n_submitted = 0
+    try:
+        while True:
+            # Keep the queue full. The seeds are drawn in this process so that
+            # the sequence of batches is reproducible via `np.random.seed()`. Each
+            # batch is requested before its seed is drawn, so that the random numbers
+            # that follow a requested batch only depend on the batches before it.
+            while len(pending) < max_queue_size:
+                batch = next(batches)
+                seed = np.random.randint(np.iinfo(np.int32).max)
+                if ring_buffer is None:
+                    pending.append((None, pool.apply_async(produce_batch, (batch, seed))))
+                else:
+                    # With `max_queue_size + 1` slots, a slot is only reused once the batch
+                    # that was previously written to it has been yielded and the next batch
+                    # has been requested.
+                    slot = n_submitted % ring_buffer.n_slots
+                    pending.append((slot, pool.apply_async(produce_batch_into_slot, (batch, seed, slot))))
+                n_submitted += 1
+            slot, result = pending.popleft()
+            if ring_buffer is None:
+                ret, counters = result.get()
+            else:
+                n_items, ret, counters = result.get()
+                for name, position in get_shared_return_positions(processing_kwargs['returns']).items():
+                    if name in ring_buffer.arrays:
+                        ret[position] = ring_buffer.get_slot(name, slot)[:n_items]
+            if not (counters is None):
+                processing_kwargs['stats'].merge(counters)
+            yield ret
+    finally:
+        pool.terminate()
+        pool.join()
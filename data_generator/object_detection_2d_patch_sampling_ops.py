@@ -270,7 +270,8 @@ class CropPad:
         if (self.patch_ymin > img_height) or (self.patch_xmin > img_width):
             raise ValueError("The given patch doesn't overlap with the input image.")
 
-        labels = np.copy(labels)
+        if not (labels is None):
+            labels = np.copy(labels)
 
         xmin = self.labels_format['xmin']
         ymin = self.labels_format['ymin']
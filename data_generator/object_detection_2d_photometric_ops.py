@@ -356,7 +356,7 @@ class Gamma:
         self.table = np.array([((i / 255.0) ** self.gamma_inv) * 255 for i in np.arange(0, 256)]).astype("uint8")
 
     def __call__(self, image, labels=None):
-        image = cv2.LUT(image, table)
+        image = cv2.LUT(image, self.table)
         if labels is None:
             return image
         else:
@@ -483,3 +483,138 @@ class RandomChannelSwap:
             return image
         else:
             return image, labels
+
+class RandomPhotometricDistortions:
+    '''
+    Randomly changes the brightness, contrast, gamma value, saturation and hue of RGB images
+    in as few passes over the image as possible. For the same random parameters, it produces the
+    same images as the chain of `RandomBrightness`, `RandomContrast`, `RandomGamma`, `RandomSaturation`
+    and `RandomHue` with the usual conversions between `uint8` and `float32` and between RGB and HSV
+    in between, but all random parameters are sampled up front:
+
+    1. The brightness, contrast and gamma changes only depend on the value of each pixel in
+       each channel, so they are combined into one 256-entry lookup table that is applied in
+       a single pass.
+    2. The saturation and hue changes are applied in a single round trip through the HSV color
+       space, again by way of a lookup table. Like in the chain, the round trip happens even if
+       neither of them is applied, since the conversion of `uint8` images to HSV and back is lossy.
+
+    Like in the chains of the original SSD implementation, the contrast change happens either
+    before or after the saturation and hue changes. In the latter case, the contrast change gets
+    its own lookup table after the HSV round trip.
+
+    Important:
+        - Expects RGB input.
+        - Expects input array to be of `dtype` `uint8` with three channels.
+    '''
+    def __init__(self,
+                 random_brightness=(-32, 32, 0.5),
+                 random_contrast=(0.5, 1.5, 0.5),
+                 random_saturation=(0.5, 1.5, 0.5),
+                 random_hue=(18, 0.5),
+                 random_gamma=(0.25, 2.0, 0.0),
+                 contrast_first=0.5):
+        '''
+        Arguments:
+            random_brightness (tuple, optional): A 3-tuple `(lower, upper, prob)` with the arguments of `RandomBrightness`.
+            random_contrast (tuple, optional): A 3-tuple `(lower, upper, prob)` with the arguments of `RandomContrast`.
+            random_saturation (tuple, optional): A 3-tuple `(lower, upper, prob)` with the arguments of `RandomSaturation`.
+            random_hue (tuple, optional): A 2-tuple `(max_delta, prob)` with the arguments of `RandomHue`.
+            random_gamma (tuple, optional): A 3-tuple `(lower, upper, prob)` with the arguments of `RandomGamma`.
+                The gamma change is applied right after the brightness and contrast changes. By default, the
+                gamma value is never changed.
+            contrast_first (float, optional): The probability with which the contrast change happens before
+                the saturation and hue changes rather than after them.
+        '''
+        if random_brightness[0] >= random_brightness[1]: raise ValueError("The upper bound of `random_brightness` must be greater than the lower bound.")
+        if random_contrast[0] >= random_contrast[1]: raise ValueError("The upper bound of `random_contrast` must be greater than the lower bound.")
+        if random_saturation[0] >= random_saturation[1]: raise ValueError("The upper bound of `random_saturation` must be greater than the lower bound.")
+        if not (0 <= random_hue[0] <= 180): raise ValueError("The maximal hue change of `random_hue` must be in the closed interval `[0, 180]`.")
+        if random_gamma[0] >= random_gamma[1]: raise ValueError("The upper bound of `random_gamma` must be greater than the lower bound.")
+        self.random_brightness = random_brightness
+        self.random_contrast = random_contrast
+        self.random_saturation = random_saturation
+        self.random_hue = random_hue
+        self.random_gamma = random_gamma
+        self.contrast_first = contrast_first
+        self.values = np.arange(256, dtype=np.float32)
+
+    def sample_parameters(self):
+        '''
+        Samples all random parameters for one image.
+
+        Returns:
+            A dictionary with the brightness delta, the contrast factor, the gamma value, the saturation factor,
+            and the hue delta, each of which is `None` if the respective change is not applied, and a boolean
+            that is `True` if the contrast change happens before the saturation and hue changes.
+        '''
+        def sample(lower, upper, prob):
+            if np.random.uniform(0,1) >= (1.0-prob):
+                return np.random.uniform(lower, upper)
+            return None
+        return {'contrast_first': np.random.uniform(0,1) < self.contrast_first,
+                'brightness': sample(*self.random_brightness),
+                'contrast': sample(*self.random_contrast),
+                'gamma': sample(*self.random_gamma),
+                'saturation': sample(*self.random_saturation),
+                'hue': sample(-self.random_hue[0], self.random_hue[0], self.random_hue[1])}
+
+    def get_intensity_table(self, brightness=None, contrast=None, gamma=None):
+        '''
+        Builds the lookup table for the given brightness, contrast and gamma changes, in this order.
+
+        Returns:
+            A `uint8` array of length 256, or `None` if none of the changes is applied.
+        '''
+        if (brightness is None) and (contrast is None) and (gamma is None):
+            return None
+        table = self.values
+        if not (brightness is None):
+            table = np.clip(table + brightness, 0, 255)
+        if not (contrast is None):
+            table = np.clip(127.5 + contrast * (table - 127.5), 0, 255)
+        table = np.round(table, decimals=0).astype(np.uint8)
+        if not (gamma is None):
+            table = (((table / 255.0) ** (1.0 / gamma)) * 255).astype(np.uint8)
+        return table
+
+    def get_hsv_table(self, saturation=None, hue=None):
+        '''
+        Builds the lookup table for the given saturation and hue changes.
+
+        Returns:
+            A `uint8` array of shape `(256, 1, 3)` that contains one lookup table for each HSV channel,
+            or `None` if neither of the changes is applied.
+        '''
+        if (saturation is None) and (hue is None):
+            return None
+        table = np.repeat(self.values[:, np.newaxis], 3, axis=1)
+        if not (hue is None):
+            table[:, 0] = (table[:, 0] + hue) % 180.0
+        if not (saturation is None):
+            table[:, 1] = np.clip(table[:, 1] * saturation, 0, 255)
+        return np.round(table, decimals=0).astype(np.uint8).reshape(256, 1, 3)
+
+    def __call__(self, image, labels=None):
+        params = self.sample_parameters()
+        hsv_table = self.get_hsv_table(params['saturation'], params['hue'])
+        if params['contrast_first']:
+            table_before = self.get_intensity_table(params['brightness'], params['contrast'], params['gamma'])
+            table_after = None
+        else:
+            table_before = self.get_intensity_table(params['brightness'])
+            table_after = self.get_intensity_table(contrast=params['contrast'], gamma=params['gamma'])
+
+        if not (table_before is None):
+            image = cv2.LUT(image, table_before)
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+        if not (hsv_table is None):
+            image = cv2.LUT(image, hsv_table)
+        image = cv2.cvtColor(image, cv2.COLOR_HSV2RGB)
+        if not (table_after is None):
+            image = cv2.LUT(image, table_after)
+
+        if labels is None:
+            return image
+        else:
+            return image, labels
@@ -0,0 +1,173 @@
+'''
+Instrumentation of the batch production of the data generator for 2D object detection.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import json
+import os
+import time
+from collections import OrderedDict
+
+class PipelineStats:
+    '''
+    Accumulates how much time the data generator spends in each stage of the batch production, how
+    much time each transformation takes, how many bytes of image data are read, and how many images
+    are produced per second.
+
+    The stages are:
+    * 'load': Loading and decoding the images. If the image files are decoded by a thread pool,
+        this is the time spent waiting for the decoded images.
+    * 'transform': Applying the transformations. The time of every single transformation is
+        recorded separately, too.
+    * 'box_filter': Checking for and removing degenerate boxes.
+    * 'stack': Stacking the images into one array.
+    * 'encode': Encoding the labels.
+    * 'batch': Producing the entire batch, i.e. all of the above and everything in between.
+
+    Pass a `PipelineStats` object to `DataGenerator.generate()` to record the stats of its batches. The
+    stats of batches that are produced in worker processes are sent back to the calling process along
+    with the batches. The stage times are the sum over all processes, so with several worker processes
+    they can add up to more than the elapsed time.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''
+        Discards all stats that were recorded so far.
+        '''
+        self.stage_times = OrderedDict()
+        self.transform_times = OrderedDict()
+        self.num_batches = 0
+        self.num_images = 0
+        self.bytes_read = 0
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        '''
+        Starts the clock for the elapsed time, unless it is already running.
+        '''
+        if self.start_time is None:
+            self.start_time = time.time()
+
+    def add_stage_time(self, stage, seconds):
+        '''
+        Adds time to a stage.
+
+        Arguments:
+            stage (str): The name of the stage.
+            seconds (float): The time in seconds.
+        '''
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+
+    def add_transform_time(self, position, transform, seconds):
+        '''
+        Adds time to a transformation.
+
+        Arguments:
+            position (int): The position of the transformation in the list of transformations.
+            transform (callable): The transformation.
+            seconds (float): The time in seconds.
+        '''
+        key = '{}:{}'.format(position, type(transform).__name__)
+        self.transform_times[key] = self.transform_times.get(key, 0.0) + seconds
+
+    def add_batch(self, num_images, bytes_read):
+        '''
+        Records that a batch has been produced.
+
+        Arguments:
+            num_images (int): The number of images in the batch.
+            bytes_read (int): The number of bytes of image data that were read for the batch.
+        '''
+        self.num_batches += 1
+        self.num_images += num_images
+        self.bytes_read += bytes_read
+        self.end_time = time.time()
+
+    def get_counters(self):
+        '''
+        Returns:
+            The recorded stats except for the times of day as a dictionary that can be passed to `merge()`,
+            e.g. to send the stats of a worker process to the calling process.
+        '''
+        return {'stage_times': dict(self.stage_times),
+                'transform_times': dict(self.transform_times),
+                'num_batches': self.num_batches,
+                'num_images': self.num_images,
+                'bytes_read': self.bytes_read}
+
+    def merge(self, counters):
+        '''
+        Adds stats that were recorded elsewhere, e.g. in a worker process.
+
+        Arguments:
+            counters (dict): The stats as returned by `get_counters()`.
+        '''
+        for stage, seconds in counters['stage_times'].items():
+            self.add_stage_time(stage, seconds)
+        for key, seconds in counters['transform_times'].items():
+            self.transform_times[key] = self.transform_times.get(key, 0.0) + seconds
+        self.num_batches += counters['num_batches']
+        self.num_images += counters['num_images']
+        self.bytes_read += counters['bytes_read']
+        self.end_time = time.time()
+
+    def get_elapsed_time(self):
+        '''
+        Returns:
+            The time in seconds from the start until the most recently recorded batch.
+        '''
+        if (self.start_time is None) or (self.end_time is None):
+            return 0.0
+        return self.end_time - self.start_time
+
+    def to_dict(self):
+        '''
+        Returns:
+            A dictionary that contains the totals, the elapsed time, the number of images per second, and for
+            each stage and each transformation the total time, the time per batch, and the fraction of the
+            total batch production time.
+        '''
+        elapsed_time = self.get_elapsed_time()
+        batch_time = self.stage_times.get('batch', 0.0)
+        def summarize(times):
+            return OrderedDict((name, {'total_time': seconds,
+                                       'time_per_batch': seconds / self.num_batches if self.num_batches > 0 else 0.0,
+                                       'fraction': seconds / batch_time if batch_time > 0 else 0.0})
+                               for name, seconds in times.items())
+        return OrderedDict([('num_batches', self.num_batches),
+                            ('num_images', self.num_images),
+                            ('bytes_read', self.bytes_read),
+                            ('elapsed_time', elapsed_time),
+                            ('images_per_second', self.num_images / elapsed_time if elapsed_time > 0 else 0.0),
+                            ('stages', summarize(self.stage_times)),
+                            ('transforms', summarize(self.transform_times))])
+
+    def dump_json(self, file_path):
+        '''
+        Writes the stats as returned by `to_dict()` to a JSON file.
+
+        Arguments:
+            file_path (str): The path of the JSON file.
+        '''
+        temp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(temp_path, file_path)
@@ -0,0 +1,351 @@
+'''
+Batch samplers that determine which dataset items make up each batch of an epoch.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+from math import ceil
+
+from data_generator.object_detection_2d_label_store import LabelStore
+
+class AliasTable:
+    '''
+    Draws samples from a discrete probability distribution in constant time per sample using
+    Vose's alias method.
+
+    The table is built once in linear time. Each draw then takes one uniformly random column
+    of the table and one uniformly random number that decides between the column's own outcome
+    and its alias, regardless of the number of outcomes.
+    '''
+
+    def __init__(self, weights):
+        '''
+        Arguments:
+            weights (array): The non-negative, not necessarily normalized weights of the outcomes.
+                At least one weight must be positive.
+        '''
+        weights = np.asarray(weights, dtype=np.float64)
+        if (weights.ndim != 1) or (len(weights) == 0) or np.any(weights < 0) or not (np.sum(weights) > 0):
+            raise ValueError("The weights must be a non-empty 1D array of non-negative numbers with a positive sum.")
+        n = len(weights)
+        scaled_weights = weights * (n / np.sum(weights))
+        self.probabilities = np.ones(n, dtype=np.float64)
+        self.aliases = np.arange(n, dtype=np.int64)
+        small = [i for i in range(n) if scaled_weights[i] < 1.0]
+        large = [i for i in range(n) if scaled_weights[i] >= 1.0]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            self.probabilities[i] = scaled_weights[i]
+            self.aliases[i] = j
+            # The large outcome gives away what the small outcome's column lacks.
+            scaled_weights[j] -= 1.0 - scaled_weights[i]
+            if scaled_weights[j] < 1.0:
+                small.append(j)
+            else:
+                large.append(j)
+        # Whatever is left over has a probability of 1 up to rounding errors.
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def draw(self, size, random_state=np.random):
+        '''
+        Draws samples from the distribution.
+
+        Arguments:
+            size (int): The number of samples.
+            random_state (RandomState, optional): The random number generator to use.
+
+        Returns:
+            A 1D Numpy array of the drawn outcomes.
+        '''
+        columns = random_state.randint(len(self), size=size)
+        use_column = random_state.random_sample(size) < self.probabilities[columns]
+        return np.where(use_column, columns, self.aliases[columns])
+
+class BatchSampler:
+    '''
+    The base class of all batch samplers. A batch sampler splits each epoch into batches of dataset
+    indices. It can be passed to `DataGenerator.generate()` or to `DataGeneratorSequence` instead
+    of a batch size, in which case it determines the order and the composition of the batches.
+
+    If a sampler has a seed, the batches of each epoch depend only on the seed and the epoch. Otherwise
+    they are drawn from Numpy's global random number generator, so they are reproducible via
+    `np.random.seed()`.
+    '''
+
+    def __init__(self, batch_size, shuffle=True, seed=None):
+        '''
+        Arguments:
+            batch_size (int): The maximal number of items per batch.
+            shuffle (bool, optional): Whether or not to randomize the batches of each epoch.
+            seed (int, optional): If an integer, the batches of each epoch are determined by this
+                seed and the epoch.
+        '''
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+
+    def get_random_state(self, epoch):
+        '''
+        Returns the random number generator for the given epoch.
+        '''
+        if self.seed is None:
+            return np.random
+        else:
+            return np.random.RandomState((self.seed + epoch) % (2**32))
+
+    def get_epoch_batches(self, epoch):
+        '''
+        Returns the batches of the given epoch.
+
+        Arguments:
+            epoch (int): The index of the epoch, starting at 0.
+
+        Returns:
+            A list of 1D Numpy arrays that contain the dataset indices of the items of each batch.
+        '''
+        raise NotImplementedError
+
+    def __len__(self):
+        '''
+        Returns the number of batches per epoch.
+        '''
+        raise NotImplementedError
+
+class AspectRatioBucketSampler(BatchSampler):
+    '''
+    Groups the images of a dataset into buckets of similar aspect ratio and, optionally, similar size
+    and forms each batch from the images of a single bucket, so that portrait and landscape images
+    never end up in the same batch.
+
+    This makes the most difference if the images are transformed with variable output sizes, e.g. by
+    `DataAugmentationVariableInputSize`, since the images of a batch then have similar shapes. If all
+    images within a bucket have the same shape, the batches can be stacked into a single array without
+    any padding or resizing.
+
+    The items within each bucket are shuffled and the batches of all buckets are shuffled, too, so the
+    order of the batches stays random. Only the last batch of each bucket may be smaller than the batch size.
+    '''
+
+    def __init__(self,
+                 image_sizes,
+                 batch_size,
+                 shuffle=True,
+                 aspect_ratio_boundaries=(0.5, 0.75, 1.0, 1.333, 2.0),
+                 size_boundaries=None,
+                 drop_last=False,
+                 seed=None):
+        '''
+        Arguments:
+            image_sizes (array): An array of shape `(dataset_size, 2)` that contains the height and width
+                of every image of the dataset, e.g. as returned by `DataGenerator.get_image_sizes()`.
+            batch_size (int): The maximal number of items per batch.
+            shuffle (bool, optional): Whether or not to randomize the batches of each epoch. If `False`,
+                the buckets are visited one after another and the items in each bucket are in the order
+                of the dataset.
+            aspect_ratio_boundaries (tuple, optional): The boundaries between the aspect ratio buckets in
+                ascending order, where the aspect ratio is the width divided by the height. If `None`,
+                the images are bucketed by their exact height and width instead, so that the images of
+                each batch can be stacked as they are.
+            size_boundaries (tuple, optional): Only relevant if `aspect_ratio_boundaries` is not `None`.
+                The boundaries between the size buckets in ascending order, where the size is the geometric
+                mean of the height and the width in pixels. If `None`, the images are bucketed by aspect
+                ratio only.
+            drop_last (bool, optional): If `True`, the last batch of each bucket is dropped if it is smaller
+                than the batch size, so that all batches have the same size.
+            seed (int, optional): If an integer, the batches of each epoch are determined by this seed and
+                the epoch.
+        '''
+        super(AspectRatioBucketSampler, self).__init__(batch_size, shuffle, seed)
+        image_sizes = np.asarray(image_sizes)
+        heights = image_sizes[:,0].astype(np.float64)
+        widths = image_sizes[:,1].astype(np.float64)
+        if aspect_ratio_boundaries is None:
+            _, bucket_ids = np.unique(image_sizes[:,:2], axis=0, return_inverse=True)
+            bucket_ids = bucket_ids.reshape(-1)
+        else:
+            bucket_ids = np.digitize(widths / heights, aspect_ratio_boundaries)
+        if not (aspect_ratio_boundaries is None or size_boundaries is None):
+            size_bucket_ids = np.digitize(np.sqrt(heights * widths), size_boundaries)
+            bucket_ids = bucket_ids * (len(size_boundaries) + 1) + size_bucket_ids
+        self.drop_last = drop_last
+        # The dataset indices of the images in each non-empty bucket, in the order of the dataset.
+        order = np.argsort(bucket_ids, kind='mergesort')
+        split_points = np.flatnonzero(np.diff(bucket_ids[order])) + 1
+        self.buckets = np.split(order, split_points) if len(order) > 0 else []
+
+    def get_epoch_batches(self, epoch):
+        random_state = self.get_random_state(epoch)
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = random_state.permutation(bucket)
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start+self.batch_size]
+                if self.drop_last and (len(batch) < self.batch_size):
+                    break
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in random_state.permutation(len(batches))]
+        return batches
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(bucket) // self.batch_size for bucket in self.buckets)
+        else:
+            return sum(int(ceil(len(bucket) / self.batch_size)) for bucket in self.buckets)
+
+class ClassBalancedSampler(BatchSampler):
+    '''
+    Samples the images of a dataset with replacement such that images that contain rare classes are
+    drawn more often than images that contain only frequent classes.
+
+    The weight of an image is `(1 / frequency)^power` of the rarest class that it contains, where the
+    frequency of a class is the number of images that contain it. The images are then drawn from an
+    `AliasTable`, so each draw takes constant time, and oversampling an image doesn't duplicate it
+    anywhere in the dataset.
+    '''
+
+    def __init__(self,
+                 labels,
+                 batch_size,
+                 class_id_column=0,
+                 power=1.0,
+                 epoch_size=None,
+                 seed=None):
+        '''
+        Arguments:
+            labels (LabelStore or list): The labels of the dataset, e.g. `DataGenerator.labels`.
+            batch_size (int): The number of items per batch.
+            class_id_column (int, optional): The column of the labels that contains the class IDs,
+                i.e. `DataGenerator.labels_format['class_id']`.
+            power (float, optional): How strongly to balance the classes. 0 means that all images are
+                equally likely, 1 means that every class appears in roughly as many drawn images as every
+                other class, as far as the images' combinations of classes allow.
+            epoch_size (int, optional): The number of images that are drawn per epoch. If `None`, this
+                is the number of images in the dataset.
+            seed (int, optional): If an integer, the batches of each epoch are determined by this seed and
+                the epoch.
+        '''
+        super(ClassBalancedSampler, self).__init__(batch_size, True, seed)
+        labels = LabelStore.from_labels(labels)
+        self.image_weights = self.get_image_weights(labels, class_id_column, power)
+        self.alias_table = AliasTable(self.image_weights)
+        self.epoch_size = len(labels) if (epoch_size is None) else epoch_size
+
+    @staticmethod
+    def get_image_weights(labels, class_id_column=0, power=1.0):
+        '''
+        Computes the sampling weight of every image from the class histogram of the labels.
+
+        Arguments:
+            labels (LabelStore): The labels of the dataset.
+            class_id_column (int, optional): The column of the labels that contains the class IDs.
+            power (float, optional): As described for the constructor.
+
+        Returns:
+            A 1D Numpy array that contains the weight of each image. Images without any boxes get the
+            smallest weight of any image with boxes.
+        '''
+        num_boxes = labels.get_num_boxes()
+        if np.sum(num_boxes) == 0:
+            return np.ones(len(labels), dtype=np.float64)
+        image_indices = np.repeat(np.arange(len(labels)), num_boxes)
+        class_ids = labels.boxes[:,class_id_column].astype(np.int64)
+        # Count every class only once per image.
+        image_classes = np.unique(np.stack([image_indices, class_ids], axis=1), axis=0)
+        class_frequencies = np.bincount(image_classes[:,1])
+        class_weights = np.zeros(len(class_frequencies), dtype=np.float64)
+        present = class_frequencies > 0
+        class_weights[present] = (1.0 / class_frequencies[present]) ** power
+        image_weights = np.zeros(len(labels), dtype=np.float64)
+        np.maximum.at(image_weights, image_classes[:,0], class_weights[image_classes[:,1]])
+        image_weights[num_boxes == 0] = np.min(image_weights[num_boxes > 0])
+        return image_weights
+
+    def get_epoch_batches(self, epoch):
+        indices = self.alias_table.draw(self.epoch_size, self.get_random_state(epoch))
+        return [indices[start:start+self.batch_size] for start in range(0, self.epoch_size, self.batch_size)]
+
+    def __len__(self):
+        return int(ceil(self.epoch_size / self.batch_size))
+
+class ShardedSampler(BatchSampler):
+    '''
+    Splits each epoch of a dataset into disjoint, equally sized shards, one for each of several
+    data-parallel training processes, e.g. on different nodes.
+
+    Every process creates a `ShardedSampler` with the same seed and its own rank. Each epoch, all
+    processes compute the same permutation of the dataset from the seed and the epoch, and each
+    process takes every `world_size`-th item of it, starting at its rank. If the dataset size is not
+    divisible by the world size, the permutation is padded with its first items, so all shards have
+    the same size and the processes stay in lockstep.
+    '''
+
+    def __init__(self,
+                 dataset_size,
+                 batch_size,
+                 rank,
+                 world_size,
+                 shuffle=True,
+                 seed=0):
+        '''
+        Arguments:
+            dataset_size (int): The number of images in the dataset.
+            batch_size (int): The maximal number of items per batch of this process.
+            rank (int): The index of this process, between 0 and `world_size - 1`.
+            world_size (int): The total number of processes.
+            shuffle (bool, optional): Whether or not to shuffle the dataset every epoch before it is sharded.
+            seed (int, optional): The seed that determines the permutation of each epoch together with the
+                epoch. Must be the same for all processes.
+        '''
+        if not (0 <= rank < world_size):
+            raise ValueError("`rank` must be between 0 and `world_size - 1`, but is {} for `world_size = {}`.".format(rank, world_size))
+        if seed is None:
+            raise ValueError("A sharded sampler needs a seed, since all processes must use the same permutations.")
+        super(ShardedSampler, self).__init__(batch_size, shuffle, seed)
+        self.dataset_size = dataset_size
+        self.rank = rank
+        self.world_size = world_size
+        self.shard_size = int(ceil(dataset_size / world_size))
+
+    def get_shard(self, epoch):
+        '''
+        Returns the dataset indices of this process's shard for the given epoch.
+
+        Arguments:
+            epoch (int): The index of the epoch, starting at 0.
+
+        Returns:
+            A 1D Numpy array of length `shard_size`.
+        '''
+        if self.shuffle:
+            indices = self.get_random_state(epoch).permutation(self.dataset_size)
+        else:
+            indices = np.arange(self.dataset_size)
+        padded_size = self.shard_size * self.world_size
+        indices = np.resize(indices, padded_size) # Repeats the first items as padding.
+        return indices[self.rank:padded_size:self.world_size]
+
+    def get_epoch_batches(self, epoch):
+        shard = self.get_shard(epoch)
+        return [shard[start:start+self.batch_size] for start in range(0, self.shard_size, self.batch_size)]
+
+    def __len__(self):
+        return int(ceil(self.shard_size / self.batch_size))
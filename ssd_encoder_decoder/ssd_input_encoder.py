@@ -274,7 +274,11 @@ class SSDInputEncoder:
             self.offsets_diag.append(offset)
             self.centers_diag.append(center)
 
-    def __call__(self, ground_truth_labels, diagnostics=False):
+        # The encoding template for a single batch item. It only depends on the anchor boxes, so it is
+        # built once and then broadcast to the batch size of every batch.
+        self.encoding_template = None
+
+    def __call__(self, ground_truth_labels, diagnostics=False, batch_buffers=None):
         '''
         Converts ground truth bounding box data into a suitable format to train an SSD model.
 
@@ -288,6 +292,9 @@ class SSDInputEncoder:
                 but also a copy of it with anchor box coordinates in place of the ground truth coordinates.
                 This can be very useful if you want to visualize which anchor boxes got matched to which ground truth
                 boxes.
+            batch_buffers (BatchBufferPool, optional): If given, the encoded labels (and the matched anchors) are
+                written into the pool's preallocated, rotating buffers instead of newly allocated arrays. They stay
+                valid until the pool has handed out its other buffers.
 
         Returns:
             `y_encoded`, a 3D numpy array of shape `(batch_size, #boxes, #classes + 4 + 4 + 4)` that serves as the
@@ -310,7 +317,7 @@ class SSDInputEncoder:
         # Generate the template for y_encoded.
         ##################################################################################
 
-        y_encoded = self.generate_encoding_template(batch_size=batch_size, diagnostics=False)
+        y_encoded = self.generate_encoding_template(batch_size=batch_size, diagnostics=False, batch_buffers=batch_buffers)
 
         ##################################################################################
         # Match ground truth boxes to anchor boxes.
@@ -411,7 +418,11 @@ class SSDInputEncoder:
 
         if diagnostics:
             # Here we'll save the matched anchor boxes (i.e. anchor boxes that were matched to a ground truth box, but keeping the anchor box coordinates).
-            y_matched_anchors = np.copy(y_encoded)
+            if batch_buffers is None:
+                y_matched_anchors = np.copy(y_encoded)
+            else:
+                y_matched_anchors = batch_buffers.empty('matched_anchors', y_encoded.shape, y_encoded.dtype)
+                y_matched_anchors[:] = y_encoded
             y_matched_anchors[:,:,-12:-8] = 0 # Keeping the anchor box coordinates means setting the offsets to zero.
             return y_encoded, y_matched_anchors
         else:
@@ -547,7 +558,7 @@ class SSDInputEncoder:
         else:
             return boxes_tensor
 
-    def generate_encoding_template(self, batch_size, diagnostics=False):
+    def generate_encoding_template(self, batch_size, diagnostics=False, batch_buffers=None):
         '''
         Produces an encoding template for the ground truth label tensor for a given batch.
 
@@ -564,6 +575,8 @@ class SSDInputEncoder:
             batch_size (int): The batch size.
             diagnostics (bool, optional): See the documnentation for `generate_anchor_boxes()`. The diagnostic output
                 here is similar, just for all predictor conv layers.
+            batch_buffers (BatchBufferPool, optional): If given, the template is written into the next of the pool's
+                preallocated buffers for the encoded labels instead of a newly allocated array.
 
         Returns:
             A Numpy array of shape `(batch_size, #boxes, #classes + 12)`, the template into which to encode
@@ -571,39 +584,47 @@ class SSDInputEncoder:
             output contains not only the 4 predicted box coordinate offsets, but also the 4 coordinates for
             the anchor boxes and the 4 variance values.
         '''
-        # Tile the anchor boxes for each predictor layer across all batch items.
-        boxes_batch = []
-        for boxes in self.boxes_list:
-            # Prepend one dimension to `self.boxes_list` to account for the batch size and tile it along.
-            # The result will be a 5D tensor of shape `(batch_size, feature_map_height, feature_map_width, n_boxes, 4)`
-            boxes = np.expand_dims(boxes, axis=0)
-            boxes = np.tile(boxes, (batch_size, 1, 1, 1, 1))
-
-            # Now reshape the 5D tensor above into a 3D tensor of shape
-            # `(batch, feature_map_height * feature_map_width * n_boxes, 4)`. The resulting
-            # order of the tensor content will be identical to the order obtained from the reshaping operation
-            # in our Keras model (we're using the Tensorflow backend, and tf.reshape() and np.reshape()
-            # use the same default index order, which is C-like index ordering)
-            boxes = np.reshape(boxes, (batch_size, -1, 4))
-            boxes_batch.append(boxes)
-
-        # Concatenate the anchor tensors from the individual layers to one.
-        boxes_tensor = np.concatenate(boxes_batch, axis=1)
-
-        # 3: Create a template tensor to hold the one-hot class encodings of shape `(batch, #boxes, #classes)`
-        #    It will contain all zeros for now, the classes will be set in the matching process that follows
-        classes_tensor = np.zeros((batch_size, boxes_tensor.shape[1], self.n_classes))
-
-        # 4: Create a tensor to contain the variances. This tensor has the same shape as `boxes_tensor` and simply
-        #    contains the same 4 variance values for every position in the last axis.
-        variances_tensor = np.zeros_like(boxes_tensor)
-        variances_tensor += self.variances # Long live broadcasting
-
-        # 4: Concatenate the classes, boxes and variances tensors to get our final template for y_encoded. We also need
-        #    another tensor of the shape of `boxes_tensor` as a space filler so that `y_encoding_template` has the same
-        #    shape as the SSD model output tensor. The content of this tensor is irrelevant, we'll just use
-        #    `boxes_tensor` a second time.
-        y_encoding_template = np.concatenate((classes_tensor, boxes_tensor, boxes_tensor, variances_tensor), axis=2)
+        if self.encoding_template is None:
+            # Build the template for a single batch item.
+            boxes_batch = []
+            for boxes in self.boxes_list:
+                # Prepend one dimension to `self.boxes_list` to account for the batch size.
+                # The result will be a 5D tensor of shape `(1, feature_map_height, feature_map_width, n_boxes, 4)`
+                boxes = np.expand_dims(boxes, axis=0)
+
+                # Now reshape the 5D tensor above into a 3D tensor of shape
+                # `(1, feature_map_height * feature_map_width * n_boxes, 4)`. The resulting
+                # order of the tensor content will be identical to the order obtained from the reshaping operation
+                # in our Keras model (we're using the Tensorflow backend, and tf.reshape() and np.reshape()
+                # use the same default index order, which is C-like index ordering)
+                boxes = np.reshape(boxes, (1, -1, 4))
+                boxes_batch.append(boxes)
+
+            # Concatenate the anchor tensors from the individual layers to one.
+            boxes_tensor = np.concatenate(boxes_batch, axis=1)
+
+            # 3: Create a template tensor to hold the one-hot class encodings of shape `(1, #boxes, #classes)`
+            #    It will contain all zeros for now, the classes will be set in the matching process that follows
+            classes_tensor = np.zeros((1, boxes_tensor.shape[1], self.n_classes))
+
+            # 4: Create a tensor to contain the variances. This tensor has the same shape as `boxes_tensor` and simply
+            #    contains the same 4 variance values for every position in the last axis.
+            variances_tensor = np.zeros_like(boxes_tensor)
+            variances_tensor += self.variances # Long live broadcasting
+
+            # 4: Concatenate the classes, boxes and variances tensors to get our final template for y_encoded. We also need
+            #    another tensor of the shape of `boxes_tensor` as a space filler so that `y_encoding_template` has the same
+            #    shape as the SSD model output tensor. The content of this tensor is irrelevant, we'll just use
+            #    `boxes_tensor` a second time.
+            self.encoding_template = np.concatenate((classes_tensor, boxes_tensor, boxes_tensor, variances_tensor), axis=2)
+
+        # Broadcast the template across all batch items.
+        shape = (batch_size,) + self.encoding_template.shape[1:]
+        if batch_buffers is None:
+            y_encoding_template = np.empty(shape, dtype=self.encoding_template.dtype)
+        else:
+            y_encoding_template = batch_buffers.empty('encoded_labels', shape, self.encoding_template.dtype)
+        y_encoding_template[:] = self.encoding_template
 
         if diagnostics:
             return y_encoding_template, self.centers_diag, self.wh_list_diag, self.steps_diag, self.offsets_diag
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def image_dataset(tmp_path):
+    '''
+    A small dataset of random PNG images of the same size with one box each.
+
+    Returns:
+        A 2-tuple containing the list of file names and the list of labels.
+    '''
+    rng = np.random.RandomState(0)
+    filenames = []
+    labels = []
+    for i in range(12):
+        image = rng.randint(0, 256, size=(60, 80, 3)).astype(np.uint8)
+        filename = str(tmp_path / 'image_{:02d}.png'.format(i))
+        Image.fromarray(image).save(filename)
+        filenames.append(filename)
+        labels.append(np.array([[1 + i % 3, 10, 10, 40, 30]]))
+    return filenames, labels
@@ -0,0 +1,192 @@
+import pickle
+
+import h5py
+import numpy as np
+import pytest
+from PIL import Image
+
+from data_generator import object_detection_2d_hdf5_utils
+from data_generator.object_detection_2d_data_generator import DataGenerator
+from data_generator.object_detection_2d_geometric_ops import RandomFlip
+from data_generator.object_detection_2d_photometric_ops import RandomPhotometricDistortions
+from data_generator.object_detection_2d_samplers import ClassBalancedSampler
+
+def test_contiguous_hdf5_batches_with_repeated_indices(image_dataset, tmp_path):
+    filenames, labels = image_dataset
+    hdf5_path = str(tmp_path / 'dataset.h5')
+    DataGenerator(filenames=filenames, labels=labels, verbose=False).create_hdf5_dataset(file_path=hdf5_path,
+                                                                                       image_layout='contiguous',
+                                                                                       verbose=False)
+    data_generator = DataGenerator(hdf5_dataset_path=hdf5_path, filenames=filenames, verbose=False)
+
+    # The sampler draws with replacement, so the batches contain repeated indices.
+    sampler = ClassBalancedSampler(data_generator.labels, batch_size=8, epoch_size=48, seed=0)
+    generator = data_generator.generate(batch_sampler=sampler,
+                                        returns={'processed_images', 'filenames'},
+                                        keep_images_without_gt=True)
+
+    num_repeated = 0
+    for _ in range(len(sampler)):
+        batch_X, batch_filenames = next(generator)
+        num_repeated += len(batch_filenames) - len(set(batch_filenames))
+        for image, filename in zip(batch_X, batch_filenames):
+            assert np.array_equal(image, np.array(Image.open(filename)))
+    assert num_repeated > 0
+
+def test_append_to_contiguous_hdf5_dataset_checks_shapes_first(image_dataset, tmp_path):
+    filenames, labels = image_dataset
+    hdf5_path = str(tmp_path / 'dataset.h5')
+    DataGenerator(filenames=filenames[:6], labels=labels[:6], verbose=False).create_hdf5_dataset(file_path=hdf5_path,
+                                                                                               image_layout='contiguous',
+                                                                                               verbose=False)
+    # One image of the wrong size among the images to be appended.
+    odd_filename = str(tmp_path / 'odd.png')
+    Image.fromarray(np.zeros((50, 80, 3), dtype=np.uint8)).save(odd_filename)
+    with pytest.raises(ValueError):
+        DataGenerator(filenames=filenames[6:9] + [odd_filename], labels=labels[6:10], verbose=False).append_to_hdf5_dataset(hdf5_path, verbose=False)
+    with h5py.File(hdf5_path, 'r') as hdf5_dataset:
+        assert len(hdf5_dataset['images']) == 6
+
+    # The HDF5 dataset can still be appended to.
+    DataGenerator(filenames=filenames[6:], labels=labels[6:], verbose=False).append_to_hdf5_dataset(hdf5_path, verbose=False)
+    with h5py.File(hdf5_path, 'r') as hdf5_dataset:
+        assert len(hdf5_dataset['images']) == 12
+        assert hdf5_dataset.attrs['n_committed'] == 12
+
+def test_append_to_hdf5_dataset_rolls_back_on_failure(image_dataset, tmp_path):
+    filenames, labels = image_dataset
+    hdf5_path = str(tmp_path / 'dataset.h5')
+    DataGenerator(filenames=filenames[:6], labels=labels[:6], verbose=False).create_hdf5_dataset(file_path=hdf5_path,
+                                                                                               verbose=False)
+    missing_filename = str(tmp_path / 'missing.png')
+    with pytest.raises(IOError):
+        DataGenerator(filenames=filenames[6:9] + [missing_filename], labels=labels[6:10], verbose=False).append_to_hdf5_dataset(hdf5_path,
+                                                                                                                               commit_size=2,
+                                                                                                                               verbose=False)
+    with h5py.File(hdf5_path, 'r') as hdf5_dataset:
+        assert all(len(hdf5_dataset[name]) == 6 for name in ['images', 'image_shapes', 'labels', 'label_shapes'])
+        assert hdf5_dataset.attrs['n_committed'] == 6
+
+@pytest.mark.parametrize('resume_after', [1, 3])
+def test_resume_with_shared_memory_workers(image_dataset, resume_after):
+    filenames, labels = image_dataset
+    def start_generator(initial_state=None):
+        data_generator = DataGenerator(filenames=filenames, labels=labels, verbose=False)
+        generator = data_generator.generate(batch_size=4,
+                                            transformations=[RandomPhotometricDistortions(), RandomFlip(dim='horizontal')],
+                                            returns={'processed_images', 'processed_labels'},
+                                            num_workers=2,
+                                            shared_memory=True,
+                                            initial_state=initial_state)
+        return data_generator, generator
+
+    np.random.seed(0)
+    data_generator, generator = start_generator()
+    # The processed images are views into the shared memory, so they are copied.
+    batches = [(np.copy(batch_X), batch_y) for batch_X, batch_y in (next(generator) for _ in range(8))]
+    state = data_generator.get_generator_state(num_batches=resume_after)
+    generator.close()
+
+    _, generator = start_generator(initial_state=state)
+    for batch_X, batch_y in batches[resume_after:]:
+        resumed_batch_X, resumed_batch_y = next(generator)
+        assert np.array_equal(resumed_batch_X, batch_X)
+        assert all(np.array_equal(a, b) for a, b in zip(resumed_batch_y, batch_y))
+    generator.close()
+
+def test_image_arena_of_another_dataset_is_rebuilt(image_dataset, tmp_path):
+    filenames, labels = image_dataset
+    arena_path = str(tmp_path / 'arena.bin')
+    DataGenerator(load_images_into_memory=True, filenames=filenames[:6], labels=labels[:6], image_arena_path=arena_path, verbose=False)
+
+    # A different dataset of the same size must not attach to the existing arena.
+    data_generator = DataGenerator(load_images_into_memory=True, filenames=filenames[6:], labels=labels[6:], image_arena_path=arena_path, verbose=False)
+    for image, filename in zip(data_generator.images, filenames[6:]):
+        assert np.array_equal(image, np.array(Image.open(filename)))
+
+    # The same dataset attaches to the arena that was just built.
+    data_generator = DataGenerator(load_images_into_memory=True, filenames=filenames[6:], labels=labels[6:], image_arena_path=arena_path, verbose=False)
+    assert data_generator.images.buffer.mode == 'r'
+    for image, filename in zip(data_generator.images, filenames[6:]):
+        assert np.array_equal(image, np.array(Image.open(filename)))
+
+def test_unpickled_hdf5_data_generator_produces_batches(image_dataset, tmp_path):
+    filenames, labels = image_dataset
+    hdf5_path = str(tmp_path / 'dataset.h5')
+    DataGenerator(filenames=filenames, labels=labels, verbose=False).create_hdf5_dataset(file_path=hdf5_path, verbose=False)
+    # Without file names, the images can only be read from the HDF5 dataset.
+    data_generator = DataGenerator(hdf5_dataset_path=hdf5_path, verbose=False)
+
+    # This is what a `DataGeneratorSequence` does in a Keras worker process.
+    data_generator = pickle.loads(pickle.dumps(data_generator))
+    processing_kwargs = data_generator._get_processing_kwargs(transformations=[],
+                                                              label_encoder=None,
+                                                              returns={'processed_images'},
+                                                              keep_images_without_gt=True,
+                                                              degenerate_box_handling='remove',
+                                                              decode_size=None,
+                                                              stats=None)
+    batch_X, = data_generator._produce_batch(*data_generator._get_items(np.arange(4)), **processing_kwargs)
+    assert len(batch_X) == 4
+    for image, filename in zip(batch_X, filenames[:4]):
+        assert np.array_equal(image, np.array(Image.open(filename)))
+
+def test_merge_hdf5_datasets_rolls_back_on_failure(image_dataset, tmp_path, monkeypatch):
+    filenames, labels = image_dataset
+    target_path = str(tmp_path / 'target.h5')
+    source_path = str(tmp_path / 'source.h5')
+    DataGenerator(filenames=filenames[:6], labels=labels[:6], verbose=False).create_hdf5_dataset(file_path=target_path, verbose=False)
+    DataGenerator(filenames=filenames[6:], labels=labels[6:], verbose=False).create_hdf5_dataset(file_path=source_path, verbose=False)
+    with h5py.File(target_path, 'a') as target:
+        del target.attrs['n_committed'] # Like an HDF5 dataset that was created before the attribute existed.
+
+    class FailingProgress(object):
+        # Fails after the first chunk has been copied.
+        def __init__(self, *args, **kwargs):
+            pass
+        def update(self, n):
+            raise RuntimeError('Interrupted')
+
+    monkeypatch.setattr(object_detection_2d_hdf5_utils, 'tqdm', FailingProgress)
+    with pytest.raises(RuntimeError):
+        object_detection_2d_hdf5_utils.merge_hdf5_datasets(target_path, [source_path], chunk_size=2, verbose=True)
+    with h5py.File(target_path, 'r') as target:
+        assert all(len(target[name]) == 6 for name in ['images', 'image_shapes', 'labels', 'label_shapes'])
+        assert not ('n_committed' in target.attrs)
+
+    # The target dataset can still be merged into.
+    monkeypatch.undo()
+    object_detection_2d_hdf5_utils.merge_hdf5_datasets(target_path, [source_path], chunk_size=2, verbose=False)
+    data_generator = DataGenerator(hdf5_dataset_path=target_path, verbose=False)
+    assert data_generator.dataset_size == 12
+    for i, filename in enumerate(filenames):
+        assert np.array_equal(data_generator._load_batch_images([i], None)[0], np.array(Image.open(filename)))
+
+@pytest.mark.parametrize('use_sampler', [False, True])
+def test_resume_from_initial_generator_state(image_dataset, use_sampler):
+    filenames, labels = image_dataset
+    data_generator = DataGenerator(filenames=filenames, labels=labels, verbose=False)
+    def start_generator(initial_state=None):
+        # Without a seed, the sampler draws the batches from Numpy's global random number generator.
+        sampler = ClassBalancedSampler(data_generator.labels, batch_size=4, epoch_size=8) if use_sampler else None
+        return data_generator.generate(batch_size=4,
+                                       shuffle=True,
+                                       transformations=[RandomPhotometricDistortions()],
+                                       returns={'processed_images', 'filenames'},
+                                       batch_sampler=sampler,
+                                       initial_state=initial_state)
+
+    np.random.seed(0)
+    generator = start_generator()
+    batches = [next(generator) for _ in range(6)]
+    state = data_generator.get_generator_state(num_batches=0)
+    assert state['num_batches'] == 0
+    with pytest.raises(ValueError):
+        data_generator.get_generator_state(num_batches=-1)
+
+    np.random.seed(1)
+    generator = start_generator(initial_state=state)
+    for batch_X, batch_filenames in batches:
+        resumed_batch_X, resumed_batch_filenames = next(generator)
+        assert resumed_batch_filenames == batch_filenames
+        assert np.array_equal(resumed_batch_X, batch_X)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from data_generator.object_detection_2d_image_cache import DecodedImageCache
+
+def make_image(num_bytes):
+    return np.zeros((num_bytes // 3, 1, 3), dtype=np.uint8)
+
+def test_lru_eviction_by_byte_budget():
+    cache = DecodedImageCache(max_bytes=300)
+    for key in range(3):
+        cache.put(key, make_image(90))
+    assert len(cache) == 3
+    assert cache.num_bytes == 270
+
+    # Using image 0 makes image 1 the least recently used image, which gets evicted first.
+    assert not (cache.get(0) is None)
+    cache.put(3, make_image(90))
+    assert (1 not in cache) and all(key in cache for key in [0, 2, 3])
+    assert cache.num_bytes == 270
+
+    # A large image evicts as many images as necessary to fit into the budget.
+    cache.put(4, make_image(210))
+    assert (0 not in cache) and (2 not in cache) and (3 in cache) and (4 in cache)
+    assert cache.num_bytes == 300
+
+def test_images_larger_than_budget_are_not_cached():
+    cache = DecodedImageCache(max_bytes=300)
+    cache.put(0, make_image(90))
+    image = cache.put(1, make_image(330))
+    assert image.shape == (110, 1, 3)
+    assert (1 not in cache) and (0 in cache)
+    assert cache.num_bytes == 90
+
+def test_replacing_an_image_updates_size():
+    cache = DecodedImageCache(max_bytes=300)
+    cache.put(0, make_image(90))
+    cache.put(0, make_image(150))
+    assert len(cache) == 1
+    assert cache.num_bytes == 150
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.num_bytes == 0
+
+def test_cached_images_are_read_only_and_counted():
+    cache = DecodedImageCache(max_bytes=300)
+    image = make_image(90)
+    cached_image = cache.put(0, image)
+    with pytest.raises(ValueError):
+        cached_image[0, 0, 0] = 1
+    image[0, 0, 0] = 1 # The original array stays writable.
+    assert cache.get(1) is None
+    assert not (cache.get(0) is None)
+    assert cache.get_hit_rate() == 0.5
@@ -0,0 +1,45 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from data_generator.object_detection_2d_label_store import LabelStore
+
+@pytest.fixture
+def labels():
+    # Images with one, no, and several boxes, as arrays and as lists.
+    return [np.array([[1, 10, 20, 30, 40]]),
+            np.zeros((0, 5), dtype=np.int64),
+            [[2, 0, 0, 5, 5], [3, 1, 1, 8, 9], [1, 4, 4, 6, 6]],
+            [],
+            [[2, 3, 3, 7, 7]]]
+
+def test_from_labels_round_trip(labels):
+    store = LabelStore.from_labels(labels)
+    assert len(store) == len(labels)
+    assert np.array_equal(store.get_num_boxes(), [1, 0, 3, 0, 1])
+    for image_labels, stored_labels in zip(labels, store):
+        assert stored_labels.shape == (len(image_labels), 5)
+        assert np.array_equal(stored_labels, np.reshape(image_labels, (-1, 5)))
+    assert np.array_equal(store[-1], labels[-1])
+    assert [len(image_labels) for image_labels in store[1:4]] == [0, 3, 0]
+    assert [len(image_labels) for image_labels in store[[2, 0, 2]]] == [3, 1, 3]
+    with pytest.raises(IndexError):
+        store[len(labels)]
+    assert LabelStore.from_labels(store) is store
+
+def test_from_labels_without_boxes():
+    store = LabelStore.from_labels([[], np.zeros((0, 6))], num_columns=6)
+    assert len(store) == 2
+    assert store.boxes.shape == (0, 6)
+    assert all(image_labels.shape == (0, 6) for image_labels in store)
+
+def test_labels_are_read_only(labels):
+    store = LabelStore.from_labels(labels)
+    with pytest.raises(ValueError):
+        store[0][0, 1] = 0
+    # The views stay read-only after the store is pickled, e.g. to be sent to a worker process.
+    store = pickle.loads(pickle.dumps(store))
+    with pytest.raises(ValueError):
+        store[2][1, 1] = 0
+    assert np.array_equal(store[2], labels[2])
@@ -0,0 +1,41 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from data_generator.object_detection_2d_photometric_ops import (ConvertColor, ConvertDataType, Brightness, Contrast,
+                                                                 Saturation, Hue, RandomPhotometricDistortions)
+
+def apply_chain(image, brightness, contrast, saturation, hue, contrast_first):
+    '''
+    Applies the given changes like the chains of individual ops that `RandomPhotometricDistortions` replaces.
+    '''
+    to_float32 = ConvertDataType(to='float32')
+    to_uint8 = ConvertDataType(to='uint8')
+    intensity_ops = [Brightness(brightness)] if not (brightness is None) else []
+    contrast_ops = [Contrast(contrast)] if not (contrast is None) else []
+    hsv_ops = [op(param) for param, op in [(saturation, Saturation), (hue, Hue)] if not (param is None)]
+    if contrast_first:
+        chain = [to_float32] + intensity_ops + contrast_ops + [to_uint8]
+    else:
+        chain = [to_float32] + intensity_ops + [to_uint8]
+    chain += [ConvertColor(current='RGB', to='HSV'), to_float32] + hsv_ops + [to_uint8, ConvertColor(current='HSV', to='RGB')]
+    if not contrast_first:
+        chain += [to_float32] + contrast_ops + [to_uint8]
+    for op in chain:
+        image = op(image)
+    return image
+
+@pytest.mark.parametrize('brightness, contrast, saturation, hue, contrast_first',
+                         list(itertools.product([None, -20.3], [None, 1.37], [None, 0.61], [None, 11.2], [True, False])))
+def test_random_photometric_distortions_match_chain(brightness, contrast, saturation, hue, contrast_first, monkeypatch):
+    image = np.random.RandomState(0).randint(0, 256, size=(40, 50, 3)).astype(np.uint8)
+    distortions = RandomPhotometricDistortions()
+    monkeypatch.setattr(distortions, 'sample_parameters', lambda: {'contrast_first': contrast_first,
+                                                                   'brightness': brightness,
+                                                                   'contrast': contrast,
+                                                                   'gamma': None,
+                                                                   'saturation': saturation,
+                                                                   'hue': hue})
+    expected = apply_chain(image, brightness, contrast, saturation, hue, contrast_first)
+    assert np.array_equal(distortions(image), expected)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from data_generator.object_detection_2d_samplers import AliasTable, AspectRatioBucketSampler, ClassBalancedSampler, ShardedSampler
+
+@pytest.fixture
+def image_sizes():
+    # Portrait, square and landscape images of a few different sizes.
+    rng = np.random.RandomState(0)
+    heights = rng.choice([200, 300, 400], size=50)
+    widths = rng.choice([200, 300, 400, 600], size=50)
+    return np.stack([heights, widths], axis=1)
+
+@pytest.mark.parametrize('aspect_ratio_boundaries', [(0.5, 0.75, 1.0, 1.333, 2.0), None])
+def test_aspect_ratio_bucket_sampler_partitions_dataset(image_sizes, aspect_ratio_boundaries):
+    sampler = AspectRatioBucketSampler(image_sizes, batch_size=4, aspect_ratio_boundaries=aspect_ratio_boundaries, seed=0)
+    bucket_ids = np.full(len(image_sizes), -1)
+    for i, bucket in enumerate(sampler.buckets):
+        bucket_ids[bucket] = i
+    for epoch in range(3):
+        batches = sampler.get_epoch_batches(epoch)
+        assert len(batches) == len(sampler)
+        assert all(0 < len(batch) <= 4 for batch in batches)
+        # Every image appears exactly once per epoch.
+        assert np.array_equal(np.sort(np.concatenate(batches)), np.arange(len(image_sizes)))
+        # Every batch comes from a single bucket.
+        assert all(len(np.unique(bucket_ids[batch])) == 1 for batch in batches)
+        if aspect_ratio_boundaries is None:
+            assert all(len(np.unique(image_sizes[batch], axis=0)) == 1 for batch in batches)
+
+def test_aspect_ratio_bucket_sampler_drop_last(image_sizes):
+    sampler = AspectRatioBucketSampler(image_sizes, batch_size=4, drop_last=True, seed=0)
+    batches = sampler.get_epoch_batches(0)
+    assert len(batches) == len(sampler)
+    assert all(len(batch) == 4 for batch in batches)
+    assert len(np.unique(np.concatenate(batches))) == 4 * len(batches)
+
+def test_aspect_ratio_bucket_sampler_is_reproducible(image_sizes):
+    batches = AspectRatioBucketSampler(image_sizes, batch_size=4, seed=3).get_epoch_batches(1)
+    same_batches = AspectRatioBucketSampler(image_sizes, batch_size=4, seed=3).get_epoch_batches(1)
+    other_batches = AspectRatioBucketSampler(image_sizes, batch_size=4, seed=3).get_epoch_batches(2)
+    assert all(np.array_equal(a, b) for a, b in zip(batches, same_batches))
+    assert not all(np.array_equal(a, b) for a, b in zip(batches, other_batches))
+
+def test_alias_table_frequencies():
+    weights = np.array([1.0, 0.0, 3.0, 0.5, 5.5])
+    table = AliasTable(weights)
+    samples = table.draw(200000, np.random.RandomState(0))
+    frequencies = np.bincount(samples, minlength=len(weights)) / len(samples)
+    assert frequencies[1] == 0
+    np.testing.assert_allclose(frequencies, weights / np.sum(weights), atol=0.005)
+
+def test_alias_table_rejects_invalid_weights():
+    for weights in [[], [0.0, 0.0], [1.0, -1.0], [[1.0, 2.0]]]:
+        with pytest.raises(ValueError):
+            AliasTable(weights)
+
+def test_class_balanced_sampler():
+    # Class 1 is in 8 images, class 2 in 2 images, and one image has no boxes.
+    labels = [np.array([[1, 0, 0, 10, 10]])] * 8 + [np.array([[1, 0, 0, 10, 10], [2, 5, 5, 20, 20]]), np.array([[2, 0, 0, 10, 10]]), np.zeros((0, 5))]
+    sampler = ClassBalancedSampler(labels, batch_size=16, epoch_size=100, seed=0)
+    np.testing.assert_allclose(sampler.image_weights, [1/9] * 8 + [1/2, 1/2, 1/9])
+
+    batches = sampler.get_epoch_batches(0)
+    assert len(batches) == len(sampler) == 7
+    assert sum(len(batch) for batch in batches) == 100
+    same_batches = ClassBalancedSampler(labels, batch_size=16, epoch_size=100, seed=0).get_epoch_batches(0)
+    assert all(np.array_equal(a, b) for a, b in zip(batches, same_batches))
+
+    # The images are drawn in proportion to their weights.
+    samples = np.concatenate([np.concatenate(sampler.get_epoch_batches(epoch)) for epoch in range(200)])
+    frequencies = np.bincount(samples, minlength=len(labels)) / len(samples)
+    np.testing.assert_allclose(frequencies, sampler.image_weights / np.sum(sampler.image_weights), atol=0.01)
+
+@pytest.mark.parametrize('dataset_size', [40, 43])
+def test_sharded_sampler(dataset_size):
+    world_size = 4
+    samplers = [ShardedSampler(dataset_size, batch_size=3, rank=rank, world_size=world_size, seed=7) for rank in range(world_size)]
+    for epoch in range(3):
+        shards = [sampler.get_shard(epoch) for sampler in samplers]
+        # All shards have the same length and together they cover the whole dataset.
+        assert all(len(shard) == samplers[0].shard_size for shard in shards)
+        assert np.array_equal(np.unique(np.concatenate(shards)), np.arange(dataset_size))
+        # The shards only overlap in the items that pad the dataset to a multiple of the world size.
+        num_padding = samplers[0].shard_size * world_size - dataset_size
+        assert len(np.concatenate(shards)) - len(np.unique(np.concatenate(shards))) == num_padding
+        for sampler, shard in zip(samplers, shards):
+            batches = sampler.get_epoch_batches(epoch)
+            assert len(batches) == len(sampler)
+            assert np.array_equal(np.concatenate(batches), shard)
+    # A new sampler with the same seed produces the same shards, a new epoch produces different ones.
+    assert np.array_equal(ShardedSampler(dataset_size, 3, rank=1, world_size=world_size, seed=7).get_shard(2), samplers[1].get_shard(2))
+    assert not np.array_equal(samplers[1].get_shard(1), samplers[1].get_shard(2))
+
+def test_sharded_sampler_without_shuffling():
+    samplers = [ShardedSampler(10, batch_size=2, rank=rank, world_size=2, shuffle=False) for rank in range(2)]
+    assert np.array_equal(samplers[0].get_shard(0), [0, 2, 4, 6, 8])
+    assert np.array_equal(samplers[1].get_shard(5), [1, 3, 5, 7, 9])